@@ -2,10 +2,11 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
 from dotenv import load_dotenv
 import json
 import os
-from typing import Any
+from typing import Any, AsyncIterable
 
 from livekit import rtc, api
 from livekit.agents import (
@@ -18,16 +19,31 @@ from livekit.agents import (
     cli,
     WorkerOptions,
     RoomInputOptions,
+    ModelSettings,
+    ChatContext,
+    ChatMessage,
+    StopResponse,
+    FunctionTool,
 )
-from livekit.plugins import (
-    assemblyai,
-    google,
-    elevenlabs,
-    silero,
-    noise_cancellation,  # noqa: F401
-)
-from livekit.plugins.turn_detector.english import EnglishModel
-from log_streamer import broadcast_log
+from livekit.plugins import noise_cancellation
+import log_streamer
+from log_streamer import set_call_context
+import amd
+import bookings
+import contacts
+import filler
+import prompts
+import providers
+import rate_limits
+import recorder
+import redial
+import scheduling
+import tts_cache
+import turn_metrics
+import worker_load
+from contacts import ContactRecord
+from prompts import build_greeting, build_instructions
+from worker_models import prewarm, record_job_setup, session_models
 
 # load environment variables, this is optional, only used for local development
 load_dotenv(dotenv_path=".env.local")
@@ -36,46 +52,117 @@ logger.setLevel(logging.INFO)
 
 outbound_trunk_id = os.getenv("SIP_OUTBOUND_TRUNK_ID")
 
-class WebSocketLogHandler(logging.Handler):
-    def emit(self, record):
-        log_entry = self.format(record)
-        asyncio.create_task(broadcast_log(log_entry))  # non-blocking
+TTS_VOICE_ID = "Xb7hH8MSUJpSbSDYk0k2"
+TTS_MODEL = "eleven_multilingual_v2"
+TRANSFER_NOTICE = "Sure, I'll transfer you to someone now. Please hold."
+TRANSFER_ERROR = "Sorry, there was an error transferring the call."
+VOICEMAIL_MESSAGE = (
+    "Hi, this is your dental office calling about your upcoming appointment. "
+    "Please give us a call back when you can. Thank you!"
+)
+# spoken word for word, so their audio is synthesized once and cached
+CACHED_PHRASES = (TRANSFER_NOTICE, TRANSFER_ERROR, VOICEMAIL_MESSAGE, *filler.FILLER_PHRASES)
 
 # Replace your logger configuration:
 logger = logging.getLogger("outbound-caller")
 logger.setLevel(logging.INFO)
 
-stream_handler = WebSocketLogHandler()
-formatter = logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s")
-stream_handler.setFormatter(formatter)
-logger.addHandler(stream_handler)
+log_streamer.attach_handler(logger)
+
+def record_outcome(outcome: str, **details: Any):
+    """How the call went, stored with its record (see call_records.py)"""
+    logger.info(
+        f"call outcome: {outcome}",
+        extra={"event": "call_outcome", "data": {"outcome": outcome, **details}},
+    )
+
 
 class OutboundCaller(Agent):
     def __init__(
         self,
         *,
-        name: str,
-        appointment_time: str,
+        name: str | None,
+        appointment_time: str | None,
         dial_info: dict[str, Any],
+        call_id: str,
+        call_providers: providers.CallProviders,
     ):
-        super().__init__(
-            instructions=f"""
-            You are a scheduling assistant for a dental practice. Your interface with user will be voice.
-            You will be on a call with a patient who has an upcoming appointment. Your goal is to confirm the appointment details.
-            As a customer service representative, you will be polite and professional at all times. Allow user to end the conversation.
-
-            When the user would like to be transferred to a human agent, first confirm with them. upon confirmation, use the transfer_call tool.
-            The customer's name is {name}. His appointment is on {appointment_time}.
-            """
-        )
+        super().__init__(instructions=build_instructions(name, appointment_time))
+        # spoken as soon as the call is answered, see prepare_greeting
+        self.greeting = build_greeting(name, appointment_time)
+        # (date, start minutes) of the appointment being confirmed, when known
+        self.appointment = scheduling.parse_appointment(appointment_time)
+        # the slot booked on this call, if the user moved their appointment
+        self.booking: bookings.Booking | None = None
+        # phrases are played in the voice of the TTS provider tried first
+        self.tts_cache = tts_cache.PhraseCache(call_providers.tts_voice(), CACHED_PHRASES)
+        # plays a filler phrase when a tool is slow to answer
+        self.masker = filler.ToolLatencyMasker(self.tts_cache)
+        # answering machine detection, started when the call is answered
+        self.screening: asyncio.Task[amd.Decision] | None = None
+        # tasks running alongside the conversation, see spawn()
+        self.background_tasks: set[asyncio.Task] = set()
+        # STT/LLM/TTS providers, with hedging and failover (see providers.py)
+        self.providers = call_providers
         # keep reference to the participant for transfers
         self.participant: rtc.RemoteParticipant | None = None
 
         self.dial_info = dial_info
+        # the room name, also the idempotency key for bookings made on the call
+        self.call_id = call_id
 
     def set_participant(self, participant: rtc.RemoteParticipant):
         self.participant = participant
 
+    def spawn(self, coro) -> asyncio.Task:
+        """Run a task alongside the call; the event loop only keeps a weak reference to it"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def set_contact(self, contact: ContactRecord | None):
+        """Update the instructions with details looked up after the agent was built"""
+        if contact is None:
+            logger.warning(f"no contact on file for {self.dial_info['phone_number']}")
+            return
+        if contact.transfer_to and not self.dial_info.get("transfer_to"):
+            self.dial_info["transfer_to"] = contact.transfer_to
+        await self.update_instructions(
+            build_instructions(contact.name, contact.appointment_time)
+        )
+        self.appointment = scheduling.parse_appointment(contact.appointment_time)
+        self.greeting = build_greeting(contact.name, contact.appointment_time)
+
+    async def stt_node(self, audio: AsyncIterable[rtc.AudioFrame], model_settings: ModelSettings):
+        # opening the stream counts against the STT provider's rate limit
+        await self.providers.acquire("stt")
+        async for event in Agent.default.stt_node(self, audio, model_settings):
+            yield event
+
+    async def tts_node(self, text: AsyncIterable[str], model_settings: ModelSettings):
+        # fixed phrases play from the cache, everything else goes to the TTS providers
+        async for frame in self.tts_cache.tts_node(text, self.providers.tts_node):
+            yield frame
+
+    async def llm_node(self, chat_ctx: ChatContext, tools: list[FunctionTool], model_settings: ModelSettings):
+        # send the instructions and the most recent turns, within HISTORY_TOKEN_BUDGET
+        async for chunk in self.providers.llm_node(
+            prompts.trim_history(chat_ctx), tools, model_settings.tool_choice
+        ):
+            yield chunk
+
+    async def on_user_turn_completed(self, turn_ctx: ChatContext, new_message: ChatMessage):
+        # don't spend an LLM call answering a voicemail greeting
+        if self.screening is None or self.screening.cancelled():
+            return
+        try:
+            decision = await asyncio.wait_for(asyncio.shield(self.screening), amd.AMD_TIMEOUT)
+        except asyncio.TimeoutError:
+            return
+        if decision.label == "machine":
+            raise StopResponse()
+
     async def hangup(self):
         """Helper function to hang up the call by deleting the room"""
 
@@ -97,9 +184,7 @@ class OutboundCaller(Agent):
         logger.info(f"transferring call to {transfer_to}")
 
         # let the message play fully before transferring
-        await ctx.session.generate_reply(
-            instructions="let the user know you'll be transferring them"
-        )
+        await ctx.session.say(TRANSFER_NOTICE)
 
         job_ctx = get_job_context()
         try:
@@ -112,11 +197,10 @@ class OutboundCaller(Agent):
             )
 
             logger.info(f"transferred call to {transfer_to}")
+            record_outcome("transferred", transfer_to=transfer_to)
         except Exception as e:
             logger.error(f"error transferring call: {e}")
-            await ctx.session.generate_reply(
-                instructions="there was an error transferring the call."
-            )
+            await ctx.session.say(TRANSFER_ERROR)
             await self.hangup()
 
     @function_tool()
@@ -140,14 +224,19 @@ class OutboundCaller(Agent):
         """Called when the user asks about alternative appointment availability
 
         Args:
-            date: The date of the appointment to check availability for
+            date: The date to check availability for, as YYYY-MM-DD or a weekday name
         """
         logger.info(
             f"looking up availability for {self.participant.identity} on {date}"
         )
-        await asyncio.sleep(3)
+        day = scheduling.parse_date(date)
+        if day is None:
+            return "ask the user for a specific date"
+        # answered from the in-memory index, too fast to need a filler phrase
+        times = scheduling.get_index().free_times(day)
         return {
-            "available_times": ["1pm", "2pm", "3pm"],
+            "date": day.isoformat(),
+            "available_times": [scheduling.format_time(t) for t in times],
         }
 
     @function_tool()
@@ -167,56 +256,194 @@ class OutboundCaller(Agent):
         logger.info(
             f"confirming appointment for {self.participant.identity} on {date} at {time}"
         )
+        day, start = scheduling.parse_date(date), scheduling.parse_time(time)
+        if day is None or start is None:
+            return "ask the user for a specific date and time"
+        if (day, start) == self.appointment:
+            record_outcome("confirmed", date=day.isoformat(), time=scheduling.format_time(start))
+            return "reservation confirmed"
+
+        # moving to another slot: hold it so no other call can take it, then
+        # write the booking before telling the user it's done
+        index, store = scheduling.get_index(), bookings.get_store()
+        available = index.providers_at(day, start)
+        booking, booked = None, False
+        try:
+            async with self.masker.mask(ctx.session, "confirm_appointment"):
+                provider = await store.hold(self.call_id, day, start, available) if available else None
+                if provider is not None:
+                    booking = bookings.Booking(
+                        self.call_id, provider, day, start, self.dial_info["phone_number"]
+                    )
+                    booked = await store.book(booking)
+        except Exception as e:
+            logger.error(f"failed to book {day.isoformat()} {scheduling.format_time(start)}: {e}")
+            return "the booking could not be saved, apologize and tell the user the office will call back"
+        if not booked:
+            # booked from another process since the index was loaded
+            for p in available:
+                index.remove(p, day, start)
+            return "that time is not available, offer another one with look_up_availability"
+
+        index.remove(provider, day, start)
+        if self.booking is not None:
+            # rebooking replaces the call's earlier booking, so that slot is free again
+            index.add(self.booking.provider, self.booking.date, self.booking.start)
+        self.booking = booking
+        self.appointment = (day, start)
+        logger.info(f"booked {day.isoformat()} {scheduling.format_time(start)} with {provider}")
+        record_outcome(
+            "confirmed", date=day.isoformat(), time=scheduling.format_time(start), provider=provider
+        )
         return "reservation confirmed"
 
     @function_tool()
     async def detected_answering_machine(self, ctx: RunContext):
         """Called when the call reaches voicemail. Use this tool AFTER you hear the voicemail greeting"""
         logger.info(f"detected answering machine for {self.participant.identity}")
+        record_outcome("voicemail", detected_by="llm")
         await self.hangup()
 
 
+async def prepare_greeting(
+    session: AgentSession,
+    agent: OutboundCaller,
+    session_started: asyncio.Task,
+    contact_lookup: asyncio.Task | None,
+) -> list[rtc.AudioFrame]:
+    """Runs while the phone rings: finish the contact lookup and synthesize the greeting"""
+    await session_started
+    if contact_lookup is not None:
+        try:
+            await agent.set_contact(await contact_lookup)
+        except Exception as e:
+            logger.error(f"contact lookup failed: {e}")
+    try:
+        await agent.providers.acquire("tts")
+        async with session.tts.synthesize(agent.greeting) as stream:
+            return [ev.frame async for ev in stream]
+    except Exception as e:
+        logger.warning(f"could not synthesize the greeting ahead of time: {e}")
+        return []
+
+
+async def screen_answering_machine(session: AgentSession, agent: OutboundCaller, participant):
+    """Local answering machine detection on the first seconds of audio, before any LLM call"""
+    decision = await agent.screening
+    logger.info(
+        f"answering machine detection: {decision.label} after {decision.at:.1f}s ({decision.reason})",
+        extra={"event": "amd", "data": {"label": decision.label, "seconds": decision.at}},
+    )
+    if decision.label != "machine":
+        return
+    record_outcome("voicemail", detected_by="amd", action=amd.AMD_ACTION)
+    session.interrupt()
+    if amd.AMD_ACTION == "message":
+        # after a beep the recording has already started
+        if decision.reason != "beep":
+            await amd.wait_for_greeting_end(participant)
+        await session.say(VOICEMAIL_MESSAGE, allow_interruptions=False)
+    await agent.hangup()
+
+
 async def entrypoint(ctx: JobContext):
     logger.info(f"connecting to room {ctx.room.name}")
     await ctx.connect()
+    setup_started = time.perf_counter()
+    worker_load.start_monitor(ctx)
+    # write any booking made on the call and release the slot it held
+    ctx.add_shutdown_callback(lambda: bookings.get_store().finish_call(ctx.room.name))
 
     # when dispatching the agent, we'll pass it the approriate info to dial the user
     # dial_info is a dict with the following keys:
     # - phone_number: the phone number to dial
     # - transfer_to: the phone number to transfer the call to when requested
+    # - name, appointment_time, sip_trunk_id: optional, set by campaign dispatches
+    # - timezone, attempt: optional, used to schedule redials of failed calls
     dial_info = json.loads(ctx.job.metadata)
     participant_identity = phone_number = dial_info["phone_number"]
+    set_call_context(room=ctx.room.name, phone_number=phone_number)
+    # until the call is answered, provider requests leave the rate limit reserve alone
+    rate_limits.set_answered(False)
+    logger.info(
+        f"call started, attempt {dial_info.get('attempt', 1)}",
+        extra={
+            "event": "call_started",
+            "data": {"agent_name": ctx.job.agent_name, "attempt": dial_info.get("attempt", 1)},
+        },
+    )
+
+    async def log_call_ended():
+        logger.info("call ended", extra={"event": "call_ended"})
+
+    ctx.add_shutdown_callback(log_call_ended)
+
+    # campaign dispatches already carry the contact's details, otherwise look them
+    # up while the phone is ringing so the lookup adds no latency
+    contact_lookup = None
+    if not (dial_info.get("name") and dial_info.get("appointment_time")):
+        contact_lookup = asyncio.create_task(contacts.get_cache().get(phone_number))
+
+    # VAD and turn detector are loaded once per process in prewarm
+    models = session_models(ctx.proc)
+    # Google AI, AssemblyAI and ElevenLabs by default, fastest healthy provider
+    # first; set STT_PROVIDERS / LLM_PROVIDERS / TTS_PROVIDERS to add fallbacks
+    call_providers = providers.for_call(
+        {"voice_id": TTS_VOICE_ID, "model": TTS_MODEL}, vad=models["vad"]
+    )
+    ctx.add_shutdown_callback(call_providers.log_summary)
 
-    # look up the user's phone number and appointment details
     agent = OutboundCaller(
-        name="Jayden",
-        appointment_time="next Tuesday at 3pm",
+        name=dial_info.get("name"),
+        appointment_time=dial_info.get("appointment_time"),
         dial_info=dial_info,
+        call_id=ctx.room.name,
+        call_providers=call_providers,
     )
 
-    # the following uses Google AI, assemblyai and elevenlabs
     session = AgentSession(
-        turn_detection="stt",
-    stt=assemblyai.STT(
-      end_of_turn_confidence_threshold=0.7,
-      min_end_of_turn_silence_when_confident=160,
-      max_turn_silence=2400,
-    ),
-    vad=silero.VAD.load(),
-        # you can also use OpenAI's TTS with openai.TTS()
-          tts = elevenlabs.TTS(
-                voice_id="Xb7hH8MSUJpSbSDYk0k2",
-                model="eleven_multilingual_v2"  # or remove if unsure
-            ),
-           llm=google.LLM(
-        model="gemini-2.0-flash-exp",
-        temperature=0.8,
-    ),
-
+        **models,
+        **call_providers.components(),
         # you can also use a speech-to-speech model like OpenAI's Realtime API
         # llm=openai.realtime.RealtimeModel()
     )
 
+    # synthesize any fixed phrases missing from the cache with the first TTS provider
+    # while the phone rings
+    agent.spawn(
+        agent.tts_cache.warm(call_providers.ttss[0][1], CACHED_PHRASES, lambda: call_providers.acquire("tts"))
+    )
+    ctx.add_shutdown_callback(agent.masker.log_summary)
+    ctx.add_shutdown_callback(agent.tts_cache.log_summary)
+
+    # per-turn latency (STT, end of turn, LLM, TTS, playout) for /metrics and the dashboard
+    turns = turn_metrics.TurnCollector(session)
+    ctx.add_shutdown_callback(turns.log_summary)
+
+    # stream the conversation to the dashboards alongside the logs, and into the call record
+    @session.on("conversation_item_added")
+    def on_conversation_item(ev):
+        logger.info(
+            f"{ev.item.role}: {ev.item.text_content}",
+            extra={"event": "transcript", "data": {"role": ev.item.role, "text": ev.item.text_content}},
+        )
+
+    @session.on("function_tools_executed")
+    def on_tools_executed(ev):
+        for call, output in zip(ev.function_calls, ev.function_call_outputs):
+            logger.info(
+                f"tool call: {call.name}({call.arguments})",
+                extra={
+                    "event": "tool_call",
+                    "data": {
+                        "tool": call.name,
+                        "arguments": call.arguments,
+                        "output": output.output if output else None,
+                        "is_error": output.is_error if output else False,
+                    },
+                },
+            )
+
     # start the session first before dialing, to ensure that when the user picks up
     # the agent does not miss anything the user says
     session_started = asyncio.create_task(
@@ -229,13 +456,22 @@ async def entrypoint(ctx: JobContext):
             ),
         )
     )
+    record_job_setup(time.perf_counter() - setup_started)
+
+    # open the provider connections and get the greeting ready while the phone
+    # rings, so the agent speaks as soon as the user picks up
+    for component in (session.stt, session.llm, session.tts):
+        warm = getattr(component, "prewarm", None)
+        if warm is not None:
+            warm()
+    greeting = asyncio.create_task(prepare_greeting(session, agent, session_started, contact_lookup))
 
     # `create_sip_participant` starts dialing the user
     try:
         await ctx.api.sip.create_sip_participant(
             api.CreateSIPParticipantRequest(
                 room_name=ctx.room.name,
-                sip_trunk_id=outbound_trunk_id,
+                sip_trunk_id=dial_info.get("sip_trunk_id") or outbound_trunk_id,
                 sip_call_to=phone_number,
                 participant_identity=participant_identity,
                 # function blocks until user answers the call, or if the call fails
@@ -243,104 +479,67 @@ async def entrypoint(ctx: JobContext):
             )
         )
 
-        # wait for the agent session start and participant join
-        await session_started
+        turns.mark_answered()
+        rate_limits.set_answered(True)
+
+        # the session, contact and greeting are normally ready by now
+        greeting_frames = await greeting
         participant = await ctx.wait_for_participant(identity=participant_identity)
         logger.info(f"participant joined: {participant.identity}")
 
         agent.set_participant(participant)
+        if recorder.RECORD_CALLS:
+            # frames are only queued here, encoding runs in another process
+            call_recorder = recorder.CallRecorder(ctx.room.name)
+            call_recorder.start()
+            call_recorder.record_participant(participant)
+            call_recorder.record_agent(ctx.room)
+            ctx.add_shutdown_callback(call_recorder.aclose)
+        agent.screening = asyncio.create_task(amd.detect(participant))
+        # hangs up, or leaves a message, if a machine answered
+        agent.spawn(screen_answering_machine(session, agent, participant))
+
+        async def greeting_audio():
+            for frame in greeting_frames:
+                yield frame
+
+        session.say(agent.greeting, audio=greeting_audio() if greeting_frames else None)
 
     except api.TwirpError as e:
+        failure = {
+            "room": ctx.room.name,
+            "agent_name": ctx.job.agent_name,
+            "dial_info": dial_info,
+            "sip_status_code": e.metadata.get("sip_status_code"),
+        }
         logger.error(
             f"error creating SIP participant: {e.message}, "
             f"SIP status: {e.metadata.get('sip_status_code')} "
-            f"{e.metadata.get('sip_status')}"
+            f"{e.metadata.get('sip_status')}",
+            extra={"event": "dial_failed", "data": failure},
         )
+        # nobody will hear it, don't keep synthesizing it
+        greeting.cancel()
+        # busy / no-answer / congestion failures are redialed; the event above can
+        # be dropped by the bus, so the failure is queued directly as well
+        await redial.report_dial_failed(failure)
         ctx.shutdown()
 
-import threading
-import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
-from livekit import api
-import os
-import json
-from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
-from log_streamer import register_client, unregister_client
-
-app = FastAPI()
-# load environment variables, this is optional, only used for local development
-load_dotenv(dotenv_path=".env.local")
-
-
-app = FastAPI()
-
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Or specify your frontend domain
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
-@app.websocket("/ws/logs")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    register_client(websocket)
-    try:
-        while True:
-            await websocket.receive_text()  # Keep connection alive
-    except WebSocketDisconnect:
-        unregister_client(websocket)
-
-
-class DispatchRequest(BaseModel):
-    room_name: str
-    agent_name: str
-    phone_number: str
-    transfer_to : str
-
-
-@app.post("/dispatch")
-async def create_agent_dispatch(data: DispatchRequest):
-    lkapi = api.LiveKitAPI(
-        url=os.getenv("LIVEKIT_URL"),
-        api_key=os.getenv("LIVEKIT_API_KEY"),
-        api_secret=os.getenv("LIVEKIT_API_SECRET")
+def worker_options() -> WorkerOptions:
+    return WorkerOptions(
+        entrypoint_fnc=entrypoint,
+        prewarm_fnc=prewarm,
+        agent_name="outbound-caller",
+        # report load from measured CPU and audio loop lag, and turn jobs away
+        # when saturated so LiveKit routes them to another worker
+        load_fnc=worker_load.compute_load,
+        load_threshold=worker_load.LOAD_THRESHOLD,
+        request_fnc=worker_load.admit,
     )
-    dispatch = await lkapi.agent_dispatch.create_dispatch(
-        api.CreateAgentDispatchRequest(
-            agent_name=data.agent_name, room=data.room_name,metadata = json.dumps({
-        "phone_number": data.phone_number,
-        "transfer_to": data.transfer_to
-    })
-        )
-    )
-    print("created dispatch", dispatch)
-
-    dispatches = await lkapi.agent_dispatch.list_dispatch(room_name=data.room_name)
-    print(f"there are {len(dispatches)} dispatches in {data.room_name}")
-    await lkapi.aclose()
-
-    
-    return {
-        "message": "Dispatch created successfully",
-        "dispatch": data.room_name
-    }
 
 
-def start_fastapi():
-    uvicorn.run(app, host="0.0.0.0", port=8000)
-
+# Agent worker only; scale it horizontally by running more of these. The
+# dispatch API runs separately (server.py), or use app.py to run both locally.
 if __name__ == "__main__":
-    # Start FastAPI server in a separate thread
-    threading.Thread(target=start_fastapi, daemon=True).start()
-    cli.run_app(
-        WorkerOptions(
-            entrypoint_fnc=entrypoint,
-            agent_name="outbound-caller",
-        )
-    )
+    cli.run_app(worker_options())
@@ -0,0 +1,250 @@
+"""Answering machine detection from the first seconds of callee audio.
+
+Humans answer with a short "Hello?" and then wait; voicemail greetings talk
+for several seconds and often end in a beep. The detector only looks at
+frame energy, speech/silence cadence and a tonal beep, so it decides long
+before the greeting would reach STT and the LLM.
+
+Evaluate it on labelled recordings (one folder per label, e.g. human/ and
+machine/):
+
+    python amd.py eval recordings/ --out amd_eval.json
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+import time
+import wave
+from dataclasses import dataclass
+
+import numpy as np
+
+FRAME_MS = 20
+# what to do on a machine: "hangup" right away, or "message" after the beep
+AMD_ACTION = os.getenv("AMD_ACTION", "message")
+# give up and let the LLM decide after this much audio
+AMD_TIMEOUT = float(os.getenv("AMD_TIMEOUT", "5.0"))
+
+SPEECH_DB = -40.0  # dBFS, quieter frames are never speech
+SPEECH_OVER_FLOOR_DB = 12.0
+MAX_GAP = 0.3  # pauses shorter than this are within one utterance
+MACHINE_SPEECH = 2.4  # one utterance this long is a recorded greeting
+HUMAN_MAX_SPEECH = 1.8  # a human greeting is shorter than this...
+HUMAN_SILENCE = 0.7  # ...and followed by this much silence
+NO_SPEECH_TIMEOUT = 3.0
+BEEP_HZ = (500.0, 2500.0)
+BEEP_TONALITY = 0.6  # share of the frame's energy around the peak frequency
+BEEP_MIN = 0.16
+GREETING_END_SILENCE = 1.0
+
+
+@dataclass
+class Decision:
+    label: str  # "human", "machine" or "unknown"
+    at: float  # seconds of audio it took to decide
+    reason: str
+
+
+class AnsweringMachineDetector:
+    """Feed it callee audio as it arrives; push() returns a Decision once it's sure"""
+
+    def __init__(self, sample_rate: int, *, until_greeting_ends: bool = False):
+        self.sample_rate = sample_rate
+        # once a machine is known: only decide when its greeting is over (beep or silence)
+        self.until_greeting_ends = until_greeting_ends
+        self._frame_len = sample_rate * FRAME_MS // 1000
+        self._window = np.hanning(self._frame_len)
+        self._freqs = np.fft.rfftfreq(self._frame_len, 1 / sample_rate)
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._floor: float | None = None
+        self.elapsed = 0.0
+        self.speech = 0.0  # total speech so far
+        self.utterance = 0.0  # length of the current utterance, pauses included
+        self.silence = 0.0  # silence since the last speech frame
+        self.heard_speech = False
+        self._beep = 0.0
+        self._beep_bin = -1
+        self.decision: Decision | None = None
+
+    def push(self, pcm: np.ndarray) -> Decision | None:
+        """int16 mono samples, any length"""
+        if self.decision is not None:
+            return self.decision
+        samples = np.concatenate([self._pending, pcm.astype(np.float32) / 32768.0])
+        n = len(samples) // self._frame_len * self._frame_len
+        self._pending = samples[n:]
+        for frame in samples[:n].reshape(-1, self._frame_len):
+            self.decision = self._frame(frame)
+            if self.decision is not None:
+                return self.decision
+        return None
+
+    def _frame(self, frame: np.ndarray) -> Decision | None:
+        step = FRAME_MS / 1000
+        self.elapsed += step
+        db = 20 * np.log10(np.sqrt(np.mean(frame**2)) + 1e-9)
+        # the noise floor follows quiet frames down at once and creeps up slowly
+        self._floor = db if self._floor is None else min(self._floor + 0.1, db)
+
+        if self._is_beep(frame, db):
+            self._beep += step
+            if self._beep >= BEEP_MIN:
+                return Decision("machine", self.elapsed, "beep")
+        else:
+            self._beep = 0.0
+
+        if db > max(SPEECH_DB, self._floor + SPEECH_OVER_FLOOR_DB):
+            self.heard_speech = True
+            self.speech += step
+            # a short pause belongs to the utterance, a long one starts a new one
+            self.utterance = self.utterance + self.silence + step if self.silence < MAX_GAP else step
+            self.silence = 0.0
+        else:
+            self.silence += step
+
+        if self.until_greeting_ends:
+            if self.heard_speech and self.silence >= GREETING_END_SILENCE:
+                return Decision("machine", self.elapsed, "greeting ended")
+            return None
+        if self.utterance >= MACHINE_SPEECH:
+            return Decision("machine", self.elapsed, "long greeting")
+        if self.heard_speech and self.speech < HUMAN_MAX_SPEECH and self.silence >= HUMAN_SILENCE:
+            return Decision("human", self.elapsed, "short greeting then silence")
+        if not self.heard_speech and self.elapsed >= NO_SPEECH_TIMEOUT:
+            return Decision("unknown", self.elapsed, "no speech")
+        if self.elapsed >= AMD_TIMEOUT:
+            return Decision("unknown", self.elapsed, "timeout")
+        return None
+
+    def _is_beep(self, frame: np.ndarray, db: float) -> bool:
+        if db < SPEECH_DB:
+            return False
+        spectrum = np.abs(np.fft.rfft(frame * self._window)) ** 2
+        peak = int(np.argmax(spectrum))
+        if not BEEP_HZ[0] <= self._freqs[peak] <= BEEP_HZ[1]:
+            return False
+        tonality = spectrum[max(0, peak - 2) : peak + 3].sum() / (spectrum.sum() + 1e-12)
+        # a beep holds the same pitch from frame to frame
+        steady = self._beep_bin < 0 or abs(peak - self._beep_bin) <= 1
+        self._beep_bin = peak
+        return tonality >= BEEP_TONALITY and steady
+
+
+async def _listen(participant, detector: AnsweringMachineDetector) -> Decision | None:
+    from livekit import rtc
+
+    stream = rtc.AudioStream.from_participant(
+        participant=participant,
+        track_source=rtc.TrackSource.SOURCE_MICROPHONE,
+        sample_rate=detector.sample_rate,
+        num_channels=1,
+    )
+    try:
+        async for ev in stream:
+            decision = detector.push(np.frombuffer(ev.frame.data, dtype=np.int16))
+            if decision is not None:
+                return decision
+    finally:
+        await stream.aclose()
+    return None
+
+
+async def detect(participant, sample_rate: int = 16000) -> Decision:
+    """Run the detector on a participant's audio from the moment they answer"""
+    detector = AnsweringMachineDetector(sample_rate)
+    decision = await _listen(participant, detector)
+    return decision or Decision("unknown", detector.elapsed, "audio ended")
+
+
+async def wait_for_greeting_end(participant, sample_rate: int = 16000, timeout: float = 20.0) -> bool:
+    """After a machine answered: wait for the beep, or the silence after its greeting"""
+    detector = AnsweringMachineDetector(sample_rate, until_greeting_ends=True)
+    try:
+        return await asyncio.wait_for(_listen(participant, detector), timeout) is not None
+    except asyncio.TimeoutError:
+        return False
+
+
+def _read_wav(path: str) -> tuple[np.ndarray, int]:
+    with wave.open(path) as w:
+        if w.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit audio")
+        pcm = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+        if w.getnchannels() > 1:
+            pcm = pcm.reshape(-1, w.getnchannels()).mean(axis=1).astype(np.int16)
+        return pcm, w.getframerate()
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(values, q * 100)) if values else 0.0
+
+
+def evaluate(root: str) -> dict:
+    """Accuracy and decision latency over root/<label>/*.wav"""
+    rows = []
+    for expected in sorted(os.listdir(root)):
+        folder = os.path.join(root, expected)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if not name.endswith(".wav"):
+                continue
+            pcm, rate = _read_wav(os.path.join(folder, name))
+            detector = AnsweringMachineDetector(rate)
+            started = time.perf_counter()
+            step = rate * FRAME_MS // 1000
+            decision = None
+            for i in range(0, len(pcm), step):
+                decision = detector.push(pcm[i : i + step])
+                if decision is not None:
+                    break
+            decision = decision or Decision("unknown", detector.elapsed, "audio ended")
+            rows.append(
+                {
+                    "file": os.path.join(expected, name),
+                    "expected": expected,
+                    "predicted": decision.label,
+                    "reason": decision.reason,
+                    "decision_seconds": decision.at,
+                    "cpu_ms": (time.perf_counter() - started) * 1000,
+                }
+            )
+
+    confusion: dict[str, dict[str, int]] = {}
+    for r in rows:
+        by_label = confusion.setdefault(r["expected"], {})
+        by_label[r["predicted"]] = by_label.get(r["predicted"], 0) + 1
+    decided = [r for r in rows if r["predicted"] != "unknown"]
+    latency = [r["decision_seconds"] for r in decided]
+    return {
+        "files": len(rows),
+        "accuracy": sum(r["predicted"] == r["expected"] for r in rows) / len(rows) if rows else 0.0,
+        # how often it commits to an answer, and how often that answer is right
+        "coverage": len(decided) / len(rows) if rows else 0.0,
+        "precision_when_decided": (
+            sum(r["predicted"] == r["expected"] for r in decided) / len(decided) if decided else 0.0
+        ),
+        "confusion": confusion,
+        "decision_seconds": {
+            "p50": _percentile(latency, 0.5),
+            "p95": _percentile(latency, 0.95),
+            "max": max(latency, default=0.0),
+        },
+        "cpu_ms_per_file": sum(r["cpu_ms"] for r in rows) / len(rows) if rows else 0.0,
+        "rows": rows,
+    }
+
+
+if __name__ == "__main__":
+    # python amd.py eval <dir with human/ and machine/ wavs> [--out report.json]
+    if len(sys.argv) not in (3, 5) or sys.argv[1] != "eval" or (len(sys.argv) == 5 and sys.argv[3] != "--out"):
+        sys.exit("usage: python amd.py eval <recordings dir> [--out report.json]")
+
+    report = evaluate(sys.argv[2])
+    if len(sys.argv) == 5:
+        with open(sys.argv[4], "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps({k: v for k, v in report.items() if k != "rows"}, indent=2))
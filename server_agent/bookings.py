@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import scheduling
+
+logger = logging.getLogger("outbound-caller")
+
+# a hold outlives any real call; it only matters if the job dies without releasing it
+HOLD_TTL = float(os.getenv("BOOKING_HOLD_TTL", "900"))
+MAX_BATCH = 200
+
+
+@dataclass(frozen=True)
+class Booking:
+    call_id: str
+    provider: str
+    date: datetime.date
+    start: int
+    phone_number: str | None = None
+
+
+class BookingStore:
+    """Slot holds and bookings in the schedule database.
+
+    A call first holds the slot, which is a single conditional insert and is what
+    stops two calls from getting the same slot. The booking is written before
+    confirm_appointment answers; bookings queued while a write is in flight go
+    out together in the next one. The call id is the idempotency key: holding or
+    booking the same slot again from the same call is a no-op, and a new slot
+    replaces the old one.
+    """
+
+    def __init__(self, path: str | None = None):
+        self._conn = scheduling.connect(path)
+        self._lock = threading.Lock()
+        # bookings waiting for the next write, with whoever waits on them
+        self._pending: list[tuple[Booking, asyncio.Future]] = []
+        self._write_lock = asyncio.Lock()
+        self.holds = 0
+        self.conflicts = 0
+        self.written = 0
+
+    def _hold(self, call_id: str, date: str, start: int, providers: list[str]) -> str | None:
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so the checks and the
+            # insert below are atomic across job processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT provider FROM bookings WHERE call_id = ? AND date = ? AND start = ?"
+                    " UNION SELECT provider FROM holds"
+                    " WHERE call_id = ? AND date = ? AND start = ? AND expires_at > ?",
+                    (call_id, date, start, call_id, date, start, now),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("COMMIT")
+                    return row[0]
+
+                for provider in providers:
+                    if self._conn.execute(
+                        "SELECT 1 FROM bookings WHERE provider = ? AND date = ? AND start = ?",
+                        (provider, date, start),
+                    ).fetchone():
+                        continue
+                    # takes the slot unless another call holds it and the hold is live
+                    cur = self._conn.execute(
+                        """INSERT INTO holds (provider, date, start, call_id, expires_at)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(provider, date, start) DO UPDATE SET
+                            call_id = excluded.call_id,
+                            expires_at = excluded.expires_at
+                        WHERE holds.expires_at <= ?""",
+                        (provider, date, start, call_id, now + HOLD_TTL, now),
+                    )
+                    if cur.rowcount:
+                        self._conn.execute("COMMIT")
+                        return provider
+                self._conn.execute("COMMIT")
+                return None
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def hold(
+        self, call_id: str, date: datetime.date, start: int, providers: list[str]
+    ) -> str | None:
+        """Claim the slot with the first of `providers` that's still free, returning it"""
+        provider = await asyncio.to_thread(
+            self._hold, call_id, date.isoformat(), start, providers
+        )
+        if provider is None:
+            self.conflicts += 1
+        else:
+            self.holds += 1
+        return provider
+
+    def _write(self, batch: list[Booking]) -> list[bool]:
+        """Whether each booking was written"""
+        now = time.time()
+        written = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for b in batch:
+                    try:
+                        self._conn.execute(
+                            """INSERT INTO bookings
+                                (call_id, provider, date, start, phone_number, booked_at)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(call_id) DO UPDATE SET
+                                provider = excluded.provider,
+                                date = excluded.date,
+                                start = excluded.start,
+                                phone_number = excluded.phone_number,
+                                booked_at = excluded.booked_at""",
+                            (b.call_id, b.provider, b.date.isoformat(), b.start, b.phone_number, now),
+                        )
+                        written.append(True)
+                    except sqlite3.IntegrityError:
+                        # the hold expired and someone else booked the slot
+                        logger.error(
+                            f"slot {b.provider} {b.date} {scheduling.format_time(b.start)} "
+                            f"was booked by another call, dropping booking for {b.call_id}"
+                        )
+                        written.append(False)
+                    self._conn.execute(
+                        "DELETE FROM holds WHERE call_id = ? AND provider = ? AND date = ? AND start = ?",
+                        (b.call_id, b.provider, b.date.isoformat(), b.start),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.written += sum(written)
+        return written
+
+    async def book(self, booking: Booking) -> bool:
+        """Write the booking, False if its slot was lost to another call"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((booking, future))
+        await self.flush()
+        return await future
+
+    async def flush(self):
+        async with self._write_lock:
+            if not self._pending:
+                return
+            while self._pending:
+                batch = self._pending[:MAX_BATCH]
+                del self._pending[:MAX_BATCH]
+                try:
+                    written = await asyncio.to_thread(self._write, [b for b, _ in batch])
+                except Exception as e:
+                    logger.error(f"failed to write {len(batch)} bookings: {e}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), ok in zip(batch, written):
+                    if not future.done():
+                        future.set_result(ok)
+            # the slot index only knows what this process booked, pick up the rest
+            scheduling.invalidate()
+
+    def _release(self, call_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM holds WHERE call_id = ?", (call_id,))
+
+    async def finish_call(self, call_id: str):
+        """On hangup: write anything still queued, then drop any hold the call didn't book"""
+        await self.flush()
+        await asyncio.to_thread(self._release, call_id)
+
+    def get_stats(self) -> dict:
+        return {
+            "holds": self.holds,
+            "conflicts": self.conflicts,
+            "written": self.written,
+            "pending": len(self._pending),
+        }
+
+
+_store: BookingStore | None = None
+
+
+def get_store() -> BookingStore:
+    """The process-wide booking store, opening the database on first use"""
+    global _store
+    if _store is None:
+        _store = BookingStore()
+    return _store
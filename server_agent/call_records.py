@@ -0,0 +1,300 @@
+"""Call records and transcripts, kept after the call is over.
+
+Job processes already send every transcript line, tool call, outcome and
+timing as a structured event over the event bus; the API appends the ones
+that matter here to SQLite (WAL) from a background thread, in batches, so
+neither the call nor the event loop ever waits on the disk.
+
+Each call gets a row in `calls` (status, timings) and its events go to
+`call_events`. Events are unique per (room, ts, event), so with several API
+workers receiving the same event it is only stored once.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+logger = logging.getLogger("outbound-caller")
+
+CALLS_DB = os.getenv("CALLS_DB", "calls.db")
+FLUSH_INTERVAL = 0.1
+MAX_BATCH = 500
+# events waiting to be written; the oldest are dropped when full
+MAX_PENDING_EVENTS = 100_000
+
+# events that make up a call record, plain log lines are not kept
+RECORDED_EVENTS = frozenset(
+    {
+        "call_started",
+        "transcript",
+        "tool_call",
+        "call_outcome",
+        "dial_failed",
+        "amd",
+        "first_word",
+        "turn",
+        "call_latency",
+        "call_ended",
+        "recording",
+    }
+)
+# a call is "in_progress" until it ends or one of these is reported
+STATUSES = ("in_progress", "completed", "confirmed", "transferred", "voicemail", "sip_error")
+# what /calls/{room}/transcript returns
+TRANSCRIPT_EVENTS = ("transcript", "tool_call")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    room TEXT PRIMARY KEY,
+    phone_number TEXT,
+    status TEXT NOT NULL DEFAULT 'in_progress',
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    sip_status INTEGER,
+    time_to_first_word REAL,
+    turns INTEGER NOT NULL DEFAULT 0,
+    latency TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calls_started ON calls (started_at);
+CREATE INDEX IF NOT EXISTS calls_status ON calls (status, started_at);
+CREATE INDEX IF NOT EXISTS calls_phone_number ON calls (phone_number, started_at);
+CREATE TABLE IF NOT EXISTS call_events (
+    id INTEGER PRIMARY KEY,
+    room TEXT NOT NULL,
+    ts REAL NOT NULL,
+    event TEXT NOT NULL,
+    role TEXT,
+    text TEXT,
+    data TEXT,
+    UNIQUE (room, ts, event)
+);
+CREATE INDEX IF NOT EXISTS call_events_room ON call_events (room, event, id);
+"""
+
+_CALL_COLUMNS = (
+    "room",
+    "phone_number",
+    "status",
+    "started_at",
+    "ended_at",
+    "sip_status",
+    "time_to_first_word",
+    "turns",
+    "latency",
+)
+
+
+def connect(path: str = CALLS_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL keeps the database consistent on a crash; NORMAL only risks the last batches
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _call_updates(event: str, data: Dict[str, Any], ts: float) -> tuple[str, tuple] | None:
+    """The change an event makes to its call's row"""
+    if event == "call_outcome" and data.get("outcome") in STATUSES:
+        return "status = ?", (data["outcome"],)
+    if event == "dial_failed":
+        try:
+            sip_status = int(data.get("sip_status_code") or 0) or None
+        except ValueError:
+            sip_status = None
+        return "status = 'sip_error', sip_status = ?, ended_at = ?", (sip_status, ts)
+    if event == "first_word":
+        return "time_to_first_word = ?", (data.get("seconds"),)
+    if event == "turn":
+        return "turns = turns + 1", ()
+    if event == "call_latency":
+        return "latency = ?", (json.dumps(data),)
+    if event == "call_ended":
+        return (
+            "ended_at = ?, status = CASE status WHEN 'in_progress' THEN 'completed' ELSE status END",
+            (ts,),
+        )
+    return None
+
+
+class CallStore:
+    """Append-only, batched writer for call events plus the queries behind /calls"""
+
+    def __init__(self, path: str = CALLS_DB):
+        self._path = path
+        self._pending: deque = deque(maxlen=MAX_PENDING_EVENTS)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # readers get their own connection, WAL lets them run alongside the writer
+        self._read_conn: sqlite3.Connection | None = None
+        self._read_lock = threading.Lock()
+        self.stats = {"received": 0, "written": 0, "duplicates": 0, "dropped": 0, "errors": 0}
+
+    def append(self, event: Dict[str, Any]):
+        """Queue a job event if it belongs to a call record; never blocks"""
+        if event.get("event") not in RECORDED_EVENTS or not event.get("room"):
+            return
+        self.stats["received"] += 1
+        if len(self._pending) == MAX_PENDING_EVENTS:
+            self.stats["dropped"] += 1
+        self._pending.append(event)
+
+    async def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="call-records-writer", daemon=True)
+            self._thread.start()
+
+    async def aclose(self):
+        """Write what's queued and stop the writer"""
+        if self._thread is not None:
+            self._stop.set()
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    def _run(self):
+        conn = connect(self._path)
+        try:
+            while not self._stop.wait(FLUSH_INTERVAL):
+                self._drain(conn)
+            self._drain(conn)
+        finally:
+            conn.close()
+
+    def _drain(self, conn: sqlite3.Connection):
+        while self._pending:
+            batch = []
+            while self._pending and len(batch) < MAX_BATCH:
+                batch.append(self._pending.popleft())
+            try:
+                self._write(conn, batch)
+            except sqlite3.Error as e:
+                self.stats["errors"] += 1
+                self.stats["dropped"] += len(batch)
+                logger.error(f"failed to write {len(batch)} call events: {e}")
+                return
+
+    def _write(self, conn: sqlite3.Connection, batch: list[Dict[str, Any]]):
+        now = time.time()
+        written = duplicates = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for e in batch:
+                room, event, ts = e["room"], e["event"], e.get("ts") or now
+                data = e.get("data") if isinstance(e.get("data"), dict) else {}
+                cur = conn.execute(
+                    """INSERT OR IGNORE INTO call_events (room, ts, event, role, text, data)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                    (
+                        room,
+                        ts,
+                        event,
+                        data.get("role"),
+                        data.get("text"),
+                        # role and text have their own columns
+                        json.dumps(data, default=str) if data and event != "transcript" else None,
+                    ),
+                )
+                if not cur.rowcount:
+                    # already stored by another API worker
+                    duplicates += 1
+                    continue
+                written += 1
+                conn.execute(
+                    """INSERT INTO calls (room, phone_number, started_at, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(room) DO UPDATE SET
+                        phone_number = COALESCE(calls.phone_number, excluded.phone_number),
+                        started_at = MIN(calls.started_at, excluded.started_at),
+                        updated_at = excluded.updated_at""",
+                    (room, e.get("phone_number"), ts, now),
+                )
+                update = _call_updates(event, data, ts)
+                if update is not None:
+                    sql, params = update
+                    conn.execute(f"UPDATE calls SET {sql} WHERE room = ?", (*params, room))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.stats["written"] += written
+        self.stats["duplicates"] += duplicates
+
+    def _reader(self) -> sqlite3.Connection:
+        if self._read_conn is None:
+            self._read_conn = connect(self._path)
+        return self._read_conn
+
+    def list_calls(
+        self,
+        *,
+        status: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        phone_number: str | None = None,
+        limit: int = 50,
+    ) -> list[Dict[str, Any]]:
+        """Most recent calls first; `until` pages back from the last started_at seen"""
+        clauses, params = [], []
+        for column, op, value in (
+            ("status", "=", status),
+            ("phone_number", "=", phone_number),
+            ("started_at", ">=", since),
+            ("started_at", "<", until),
+        ):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._read_lock:
+            rows = self._reader().execute(
+                f"SELECT {', '.join(_CALL_COLUMNS)} FROM calls {where} ORDER BY started_at DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [_call_row(r) for r in rows]
+
+    def get_call(self, room: str) -> Dict[str, Any] | None:
+        with self._read_lock:
+            row = self._reader().execute(
+                f"SELECT {', '.join(_CALL_COLUMNS)} FROM calls WHERE room = ?", (room,)
+            ).fetchone()
+        return _call_row(row) if row else None
+
+    def transcript(self, room: str, *, after: int = 0, limit: int = 100) -> list[Dict[str, Any]]:
+        """Transcript lines and tool calls in order; pass the last id seen as `after`"""
+        placeholders = ", ".join("?" for _ in TRANSCRIPT_EVENTS)
+        with self._read_lock:
+            rows = self._reader().execute(
+                f"""SELECT id, ts, event, role, text, data FROM call_events
+                WHERE room = ? AND event IN ({placeholders}) AND id > ?
+                ORDER BY id LIMIT ?""",
+                (room, *TRANSCRIPT_EVENTS, after, limit),
+            ).fetchall()
+        return [
+            {
+                "id": id_,
+                "ts": ts,
+                "event": event,
+                "role": role,
+                "text": text,
+                "data": json.loads(data) if data else None,
+            }
+            for id_, ts, event, role, text, data in rows
+        ]
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": len(self._pending)}
+
+
+def _call_row(row: tuple) -> Dict[str, Any]:
+    call = dict(zip(_CALL_COLUMNS, row))
+    call["latency"] = json.loads(call["latency"]) if call["latency"] else None
+    return call
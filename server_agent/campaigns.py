@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+
+import shared_state
+from contacts import ContactCache
+
+logger = logging.getLogger("outbound-caller")
+
+CONTACT_FIELDS = ("phone_number", "transfer_to", "name", "appointment_time", "sip_trunk_id", "timezone")
+
+DEFAULT_MAX_CONCURRENT_CALLS = int(os.getenv("CAMPAIGN_MAX_CONCURRENT_CALLS", "20"))
+DEFAULT_CALLS_PER_SECOND = float(os.getenv("CAMPAIGN_CALLS_PER_SECOND", "5"))
+DEFAULT_PER_TRUNK_LIMIT = int(os.getenv("CAMPAIGN_PER_TRUNK_LIMIT", "10"))
+# how often progress is mirrored to the shared state backend
+STATE_SYNC_INTERVAL = 0.5
+# contacts looked up per batch when filling in missing names/appointments
+PREFETCH_BATCH = 500
+
+_NUMERIC_FIELDS = ("total", "queued", "dialing", "done", "failed", "created_at", "finished_at")
+
+# called with the fields of a DispatchRequest, returns once the dispatch is created
+DispatchFnc = Callable[[dict[str, Any]], Awaitable[dict[str, Any]]]
+# called with a dispatch id, returns the final status once the call is over;
+# "failed" and "unknown" (no longer tracked) count as failed calls
+WaitFnc = Callable[[str], Awaitable[str]]
+
+
+@dataclass
+class Contact:
+    phone_number: str
+    transfer_to: str = ""
+    name: str = ""
+    appointment_time: str = ""
+    sip_trunk_id: str = ""
+    timezone: str = ""  # IANA name, redials stay inside the callee's calling hours
+
+
+def parse_contacts(raw: bytes, filename: str = "") -> list[Contact]:
+    """Parse a CSV (with header row) or JSONL contact upload"""
+    text = raw.decode("utf-8-sig")
+    if filename.endswith(".jsonl") or text.lstrip().startswith("{"):
+        rows = (json.loads(line) for line in text.splitlines() if line.strip())
+    else:
+        rows = csv.DictReader(io.StringIO(text))
+
+    contacts = []
+    for lineno, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            raise ValueError(f"contact {lineno} is not an object")
+        fields = {}
+        for k in CONTACT_FIELDS:
+            value = row.get(k)
+            # JSONL numbers are fine (phone numbers without a "+"), nested values aren't
+            if isinstance(value, (dict, list, bool)):
+                raise ValueError(f"contact {lineno} has an invalid {k}")
+            fields[k] = str(value if value is not None else "").strip()
+        if not fields["phone_number"]:
+            raise ValueError(f"contact {lineno} has no phone_number")
+        contacts.append(Contact(**fields))
+    return contacts
+
+
+class RateLimiter:
+    """Spaces out acquisitions so no more than `rate` happen per second"""
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self._interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+@dataclass
+class Campaign:
+    id: str
+    agent_name: str
+    max_concurrent_calls: int
+    calls_per_second: float
+    per_trunk_limit: int
+    pending: deque[Contact]
+    total: int
+    # trunk id -> contacts taken from `pending` while their trunk was full
+    parked: dict[str, deque[Contact]] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    status: str = "running"
+    dialing: int = 0
+    done: int = 0
+    failed: int = 0
+    task: asyncio.Task | None = None
+
+    def queued(self) -> int:
+        return len(self.pending) + sum(len(contacts) for contacts in self.parked.values())
+
+    def progress(self) -> dict[str, Any]:
+        return {
+            "campaign_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "queued": self.queued(),
+            "dialing": self.dialing,
+            "done": self.done,
+            "failed": self.failed,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class CampaignScheduler:
+    """Feeds campaign contacts into dispatch with concurrency, rate and trunk caps.
+
+    A campaign runs in the API worker that accepted the upload. With a shared state
+    backend its progress is mirrored there, so any worker can report or cancel it.
+    """
+
+    def __init__(
+        self,
+        dispatch: DispatchFnc,
+        default_trunk_id: str | None = None,
+        wait_for_call: WaitFnc | None = None,
+        state: shared_state.RedisState | None = None,
+        contacts: ContactCache | None = None,
+    ):
+        self._dispatch = dispatch
+        self._wait_for_call = wait_for_call
+        self._default_trunk_id = default_trunk_id or ""
+        self._state = state
+        self._contacts = contacts
+        self.campaigns: dict[str, Campaign] = {}
+
+    def submit(
+        self,
+        contacts: list[Contact],
+        *,
+        agent_name: str,
+        max_concurrent_calls: int = DEFAULT_MAX_CONCURRENT_CALLS,
+        calls_per_second: float = DEFAULT_CALLS_PER_SECOND,
+        per_trunk_limit: int = DEFAULT_PER_TRUNK_LIMIT,
+    ) -> Campaign:
+        campaign = Campaign(
+            id=uuid.uuid4().hex[:12],
+            agent_name=agent_name,
+            max_concurrent_calls=max_concurrent_calls,
+            calls_per_second=calls_per_second,
+            per_trunk_limit=per_trunk_limit,
+            pending=deque(contacts),
+            total=len(contacts),
+        )
+        self.campaigns[campaign.id] = campaign
+        campaign.task = asyncio.create_task(self._run(campaign))
+        logger.info(f"campaign {campaign.id} queued {campaign.total} contacts")
+        return campaign
+
+    def cancel(self, campaign_id: str) -> Campaign | None:
+        campaign = self.campaigns.get(campaign_id)
+        if campaign and campaign.status == "running":
+            campaign.status = "cancelled"
+            campaign.pending.clear()
+            campaign.parked.clear()
+        return campaign
+
+    async def progress(self, campaign_id: str) -> dict[str, Any] | None:
+        campaign = self.campaigns.get(campaign_id)
+        if campaign is not None:
+            return campaign.progress()
+        if self._state is not None:
+            fields = await self._state.load(f"campaign:{campaign_id}")
+            if fields:
+                return shared_state.decode(fields, _NUMERIC_FIELDS)
+        return None
+
+    async def request_cancel(self, campaign_id: str) -> dict[str, Any] | None:
+        """Cancel a campaign running in this or (with shared state) another worker"""
+        campaign = self.cancel(campaign_id)
+        if campaign is not None:
+            return campaign.progress()
+        progress = await self.progress(campaign_id)
+        if progress is not None and self._state is not None:
+            # picked up by the owning worker on its next sync
+            await self._state.set_field(f"campaign:{campaign_id}", "cancel_requested", 1)
+        return progress
+
+    async def _sync(self, campaign: Campaign):
+        key = f"campaign:{campaign.id}"
+        while True:
+            try:
+                await self._state.save(key, campaign.progress())
+                if await self._state.get_field(key, "cancel_requested"):
+                    self.cancel(campaign.id)
+            except Exception as e:
+                logger.warning(f"campaign {campaign.id} state sync failed: {e}")
+            await asyncio.sleep(STATE_SYNC_INTERVAL)
+
+    async def _save_final(self, campaign: Campaign):
+        try:
+            await self._state.save(f"campaign:{campaign.id}", campaign.progress())
+        except Exception as e:
+            logger.warning(f"campaign {campaign.id} state sync failed: {e}")
+
+    async def _prefetch(self, campaign: Campaign):
+        """Fill in names/appointments from the contact store in batches, ahead of dialing,
+        so the agent gets them in the dispatch metadata and skips its own lookup"""
+        incomplete = [c for c in campaign.pending if not (c.name and c.appointment_time)]
+        for i in range(0, len(incomplete), PREFETCH_BATCH):
+            batch = incomplete[i : i + PREFETCH_BATCH]
+            try:
+                found = await self._contacts.get_many([c.phone_number for c in batch])
+            except Exception as e:
+                logger.warning(f"campaign {campaign.id} contact prefetch failed: {e}")
+                return
+            for contact in batch:
+                record = found.get(contact.phone_number)
+                if record is None:
+                    continue
+                contact.name = contact.name or record.name or ""
+                contact.appointment_time = contact.appointment_time or record.appointment_time or ""
+                contact.transfer_to = contact.transfer_to or record.transfer_to or ""
+
+    async def _run(self, campaign: Campaign):
+        # prefetch and state sync are cancelled when the campaign finishes
+        background: list[asyncio.Task] = []
+        if self._contacts is not None:
+            background.append(asyncio.create_task(self._prefetch(campaign)))
+        if self._state is not None:
+            background.append(asyncio.create_task(self._sync(campaign)))
+        try:
+            await self._dial_all(campaign)
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            if self._state is not None:
+                await self._save_final(campaign)
+
+    async def _dial_all(self, campaign: Campaign):
+        slots = asyncio.Semaphore(campaign.max_concurrent_calls)
+        limiter = RateLimiter(campaign.calls_per_second)
+        # calls in progress per trunk, a full trunk doesn't hold up the others
+        busy: dict[str, int] = {}
+        freed = asyncio.Event()
+        in_flight: set[asyncio.Task] = set()
+
+        def finished(trunk_id: str):
+            busy[trunk_id] -= 1
+            slots.release()
+            freed.set()
+
+        while campaign.queued():
+            await slots.acquire()
+            picked = self._next_contact(campaign, busy)
+            if picked is None:
+                slots.release()
+                if not campaign.queued():  # cancelled while waiting for a slot
+                    break
+                # every queued contact is for a full trunk
+                freed.clear()
+                await freed.wait()
+                continue
+            contact, trunk_id = picked
+            busy[trunk_id] = busy.get(trunk_id, 0) + 1
+            campaign.dialing += 1
+            task = asyncio.create_task(self._dial(campaign, contact, trunk_id, limiter))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            task.add_done_callback(lambda _, trunk_id=trunk_id: finished(trunk_id))
+
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        if campaign.status == "running":
+            campaign.status = "completed"
+        campaign.finished_at = time.time()
+        logger.info(
+            f"campaign {campaign.id} {campaign.status}: "
+            f"{campaign.done} done, {campaign.failed} failed"
+        )
+
+    def _next_contact(self, campaign: Campaign, busy: dict[str, int]) -> tuple[Contact, str] | None:
+        """The next contact whose trunk has room; contacts for full trunks are parked"""
+        for trunk_id, parked in campaign.parked.items():
+            if parked and busy.get(trunk_id, 0) < campaign.per_trunk_limit:
+                return parked.popleft(), trunk_id
+        while campaign.pending:
+            contact = campaign.pending.popleft()
+            trunk_id = contact.sip_trunk_id or self._default_trunk_id
+            if busy.get(trunk_id, 0) < campaign.per_trunk_limit:
+                return contact, trunk_id
+            campaign.parked.setdefault(trunk_id, deque()).append(contact)
+        return None
+
+    async def _dial(
+        self,
+        campaign: Campaign,
+        contact: Contact,
+        trunk_id: str,
+        limiter: RateLimiter,
+    ):
+        await limiter.acquire()
+        try:
+            result = await self._dispatch(
+                {
+                    "room_name": f"campaign-{campaign.id}-{uuid.uuid4().hex[:8]}",
+                    "agent_name": campaign.agent_name,
+                    "phone_number": contact.phone_number,
+                    "transfer_to": contact.transfer_to,
+                    "name": contact.name or None,
+                    "appointment_time": contact.appointment_time or None,
+                    "sip_trunk_id": trunk_id or None,
+                    "timezone": contact.timezone or None,
+                }
+            )
+            status = "succeeded"
+            if self._wait_for_call and result.get("dispatch_id"):
+                # keep the call and trunk slot until the call is over
+                status = await self._wait_for_call(result["dispatch_id"])
+            if status in ("failed", "unknown"):
+                campaign.failed += 1
+            else:
+                campaign.done += 1
+        except Exception as e:
+            logger.error(f"campaign {campaign.id} dispatch to {contact.phone_number} failed: {e}")
+            campaign.failed += 1
+        finally:
+            campaign.dialing -= 1
+
+
+def create_router(
+    dispatch: DispatchFnc,
+    wait_for_call: WaitFnc | None = None,
+    state: shared_state.RedisState | None = None,
+    contacts: ContactCache | None = None,
+) -> APIRouter:
+    router = APIRouter()
+    scheduler = CampaignScheduler(
+        dispatch, os.getenv("SIP_OUTBOUND_TRUNK_ID"), wait_for_call, state, contacts
+    )
+
+    @router.post("/campaigns")
+    async def create_campaign(
+        file: UploadFile = File(...),
+        agent_name: str = Form("outbound-caller"),
+        max_concurrent_calls: int = Form(DEFAULT_MAX_CONCURRENT_CALLS),
+        calls_per_second: float = Form(DEFAULT_CALLS_PER_SECOND),
+        per_trunk_limit: int = Form(DEFAULT_PER_TRUNK_LIMIT),
+    ):
+        try:
+            contacts = parse_contacts(await file.read(), file.filename or "")
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HTTPException(status_code=400, detail=f"invalid contact file: {e}")
+        if max_concurrent_calls < 1 or per_trunk_limit < 1:
+            raise HTTPException(status_code=400, detail="concurrency limits must be >= 1")
+
+        campaign = scheduler.submit(
+            contacts,
+            agent_name=agent_name,
+            max_concurrent_calls=max_concurrent_calls,
+            calls_per_second=calls_per_second,
+            per_trunk_limit=per_trunk_limit,
+        )
+        return campaign.progress()
+
+    @router.get("/campaigns/{campaign_id}")
+    async def get_campaign(campaign_id: str):
+        progress = await scheduler.progress(campaign_id)
+        if progress is None:
+            raise HTTPException(status_code=404, detail="campaign not found")
+        return progress
+
+    @router.post("/campaigns/{campaign_id}/cancel")
+    async def cancel_campaign(campaign_id: str):
+        progress = await scheduler.request_cancel(campaign_id)
+        if progress is None:
+            raise HTTPException(status_code=404, detail="campaign not found")
+        return progress
+
+    return router
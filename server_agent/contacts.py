@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, Protocol
+
+logger = logging.getLogger("outbound-caller")
+
+CONTACTS_DB = os.getenv("CONTACTS_DB", "contacts.db")
+CACHE_SIZE = int(os.getenv("CONTACT_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CONTACT_CACHE_TTL", "300"))
+# sqlite's default limit on bound parameters is 999
+BATCH_SIZE = 500
+
+
+@dataclass(frozen=True)
+class ContactRecord:
+    phone_number: str
+    name: str | None = None
+    appointment_time: str | None = None
+    transfer_to: str | None = None
+
+
+class ContactStore(Protocol):
+    async def get_many(self, phone_numbers: list[str]) -> dict[str, ContactRecord]: ...
+
+
+class SQLiteContactStore:
+    """Contacts and their next appointment, keyed by phone number"""
+
+    def __init__(self, path: str = CONTACTS_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS contacts (
+                    phone_number TEXT PRIMARY KEY,
+                    name TEXT,
+                    appointment_time TEXT,
+                    transfer_to TEXT
+                )"""
+            )
+
+    def _select(self, phone_numbers: list[str]) -> dict[str, ContactRecord]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(phone_numbers), BATCH_SIZE):
+                batch = phone_numbers[i : i + BATCH_SIZE]
+                rows = self._conn.execute(
+                    "SELECT phone_number, name, appointment_time, transfer_to FROM contacts"
+                    f" WHERE phone_number IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for row in rows:
+                    found[row[0]] = ContactRecord(*row)
+        return found
+
+    async def get_many(self, phone_numbers: list[str]) -> dict[str, ContactRecord]:
+        return await asyncio.to_thread(self._select, phone_numbers)
+
+    def upsert_many(self, records: Iterable[ContactRecord]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """INSERT INTO contacts (phone_number, name, appointment_time, transfer_to)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(phone_number) DO UPDATE SET
+                    name = excluded.name,
+                    appointment_time = excluded.appointment_time,
+                    transfer_to = excluded.transfer_to""",
+                [(r.phone_number, r.name, r.appointment_time, r.transfer_to) for r in records],
+            )
+
+
+class ContactCache:
+    """LRU + TTL cache in front of a ContactStore; concurrent misses share one lookup"""
+
+    def __init__(self, store: ContactStore, *, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self._store = store
+        self._maxsize = maxsize
+        self._ttl = ttl
+        # phone_number -> (record or None when not found, expires_at)
+        self._entries: OrderedDict[str, tuple[ContactRecord | None, float]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, phone_number: str) -> tuple[bool, ContactRecord | None]:
+        entry = self._entries.get(phone_number)
+        if entry is None or entry[1] < time.monotonic():
+            return False, None
+        self._entries.move_to_end(phone_number)
+        return True, entry[0]
+
+    def _put(self, phone_number: str, record: ContactRecord | None):
+        self._entries[phone_number] = (record, time.monotonic() + self._ttl)
+        self._entries.move_to_end(phone_number)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    async def get(self, phone_number: str) -> ContactRecord | None:
+        found, record = self._cached(phone_number)
+        if found:
+            self.hits += 1
+            return record
+        self.misses += 1
+
+        if phone_number in self._in_flight:
+            fut = self._in_flight[phone_number]
+            try:
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                # the leading lookup was cancelled with its call, not this one: look it up again
+                if fut.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get(phone_number)
+                raise
+
+        fut = asyncio.get_running_loop().create_future()
+        self._in_flight[phone_number] = fut
+        try:
+            record = (await self._store.get_many([phone_number])).get(phone_number)
+            self._put(phone_number, record)
+            fut.set_result(record)
+            return record
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            del self._in_flight[phone_number]
+            # cancelled (a BaseException), waiters must not hang on it
+            if not fut.done():
+                fut.cancel()
+
+    async def get_many(self, phone_numbers: list[str]) -> dict[str, ContactRecord]:
+        """Batch lookup, only the numbers missing from the cache hit the store"""
+        result: dict[str, ContactRecord] = {}
+        missing = []
+        for phone_number in dict.fromkeys(phone_numbers):
+            found, record = self._cached(phone_number)
+            if not found:
+                missing.append(phone_number)
+            elif record is not None:
+                result[phone_number] = record
+        self.hits += len(phone_numbers) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            fetched = await self._store.get_many(missing)
+            for phone_number in missing:
+                record = fetched.get(phone_number)
+                self._put(phone_number, record)
+                if record is not None:
+                    result[phone_number] = record
+        return result
+
+
+_cache: ContactCache | None = None
+
+
+def get_cache() -> ContactCache:
+    """The process-wide contact cache, opening the store on first use"""
+    global _cache
+    if _cache is None:
+        _cache = ContactCache(SQLiteContactStore(CONTACTS_DB))
+    return _cache
+
+
+if __name__ == "__main__":
+    # python contacts.py import contacts.csv
+    if len(sys.argv) != 3 or sys.argv[1] != "import":
+        sys.exit("usage: python contacts.py import <contacts.csv|contacts.jsonl>")
+
+    from campaigns import parse_contacts
+
+    with open(sys.argv[2], "rb") as f:
+        rows = parse_contacts(f.read(), sys.argv[2])
+    SQLiteContactStore(CONTACTS_DB).upsert_many(
+        ContactRecord(
+            phone_number=c.phone_number,
+            name=c.name or None,
+            appointment_time=c.appointment_time or None,
+            transfer_to=c.transfer_to or None,
+        )
+        for c in rows
+    )
+    print(f"imported {len(rows)} contacts into {CONTACTS_DB}")
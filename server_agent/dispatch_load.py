@@ -0,0 +1,206 @@
+"""Load test: dispatch API throughput with and without agent call load.
+
+Runs the real dispatch API (server.py under uvicorn) against a stub LiveKit
+Twirp server and fires /dispatch requests at it in three layouts:
+
+- idle: the API alone
+- split: the API with synthetic calls in separate processes, as with
+  `gunicorn server:app` and `python agent.py start` (on another core when the
+  host has more than one, standing in for another machine)
+- shared: the same calls as threads inside the API process, as with app.py
+
+Each synthetic call burns `--call-cpu` of a core in 20ms audio frames, holding
+the GIL while it does, like a job's STT/VAD/TTS frame processing.
+
+    python dispatch_load.py --requests 2000 --concurrency 50 --calls 8 --call-cpu 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any
+
+import aiohttp
+
+import livekit_client
+
+FRAME_SECONDS = 0.02
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _synthetic_call(call_cpu: float, stop: Any = None):
+    """Busy for call_cpu of every 20ms frame, forever or until `stop` is set"""
+    while stop is None or not stop.is_set():
+        frame_end = time.perf_counter() + FRAME_SECONDS
+        busy_until = time.perf_counter() + FRAME_SECONDS * call_cpu
+        n = 0
+        while time.perf_counter() < busy_until:
+            n += 1
+        time.sleep(max(0.0, frame_end - time.perf_counter()))
+
+
+def _serve(port: int, calls: int, call_cpu: float):
+    """The API process; with calls > 0 it also runs them, like app.py"""
+    import uvicorn
+
+    stop = threading.Event()
+    for _ in range(calls):
+        threading.Thread(target=_synthetic_call, args=(call_cpu, stop), daemon=True).start()
+    uvicorn.run("server:app", host="127.0.0.1", port=port, log_level="warning")
+
+
+def _pin(pid: int, cores: set[int]):
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(pid, cores)
+
+
+async def _wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientConnectionError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+            await asyncio.sleep(0.1)
+
+
+async def _fire(url: str, requests: int, concurrency: int) -> dict[str, Any]:
+    slots = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def dispatch(session: aiohttp.ClientSession, i: int):
+        nonlocal errors
+        body = {
+            "room_name": f"load-{i}",
+            "agent_name": "outbound-caller",
+            "phone_number": f"+1555{i:07d}",
+            "transfer_to": "+15550000000",
+        }
+        async with slots:
+            started = time.perf_counter()
+            async with session.post(f"{url}/dispatch", json=body) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(dispatch(session, i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "dispatches_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000, 1),
+        "errors": errors,
+    }
+
+
+def _run_layout(layout: str, args, env: dict[str, str], cores: list[int]) -> dict[str, Any]:
+    api_cores = set(cores[:1]) if len(cores) > 1 else set()
+    call_cores = set(cores[1:]) if len(cores) > 1 else set()
+    shared_calls = args.calls if layout == "shared" else 0
+    server = subprocess.Popen(
+        [sys.executable, __file__, "serve", "--port", str(args.port),
+         "--calls", str(shared_calls), "--call-cpu", str(args.call_cpu)],
+        cwd=HERE,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    _pin(server.pid, api_cores)
+    call_processes = []
+    if layout == "split":
+        context = multiprocessing.get_context("spawn")
+        call_processes = [context.Process(target=_synthetic_call, args=(args.call_cpu,), daemon=True)
+                          for _ in range(args.calls)]
+        for process in call_processes:
+            process.start()
+            _pin(process.pid, call_cores)
+    try:
+        url = f"http://127.0.0.1:{args.port}"
+        asyncio.run(_wait_ready(f"{url}/quota"))
+        # warm up connections and the LiveKit client
+        asyncio.run(_fire(url, min(100, args.requests), args.concurrency))
+        return asyncio.run(_fire(url, args.requests, args.concurrency))
+    finally:
+        for process in call_processes:
+            process.terminate()
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help=argparse.SUPPRESS)
+    for p in (parser, serve):
+        p.add_argument("--calls", type=int, default=8, help="concurrent synthetic calls")
+        p.add_argument("--call-cpu", type=float, default=0.2, help="share of a core per call")
+        p.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005, help="stub LiveKit seconds per dispatch")
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--layouts", default="idle,split,shared")
+    parser.add_argument("--out", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        _serve(args.port, args.calls, args.call_cpu)
+        return
+
+    # the API's sqlite files and event bus socket go here instead of the working directory
+    workdir = tempfile.mkdtemp(prefix="outbound-dispatch-load-")
+    env = {
+        **os.environ,
+        "LIVEKIT_URL": f"http://127.0.0.1:{args.stub_port}",
+        "LIVEKIT_API_KEY": "load",
+        "LIVEKIT_API_SECRET": "load-secret-load-secret-load-secret",
+        "CALLS_DB": os.path.join(workdir, "calls.db"),
+        "REDIAL_DB": os.path.join(workdir, "redial.db"),
+        "CONTACTS_DB": os.path.join(workdir, "contacts.db"),
+        "EVENT_BUS_SOCKET": os.path.join(workdir, "events.sock"),
+    }
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    stub = multiprocessing.get_context("spawn").Process(
+        target=livekit_client._serve_stub, args=(args.stub_port, args.latency), daemon=True
+    )
+    stub.start()
+    try:
+        report: dict[str, Any] = {
+            "cores": len(cores) or os.cpu_count(),
+            "calls": args.calls,
+            "call_cpu": args.call_cpu,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        }
+        for layout in args.layouts.split(","):
+            report[layout] = _run_layout(layout, args, env, cores)
+    finally:
+        stub.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
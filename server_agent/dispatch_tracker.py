@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import Any
+
+import shared_state
+from livekit_client import LiveKitClient
+
+logger = logging.getLogger("outbound-caller")
+
+# livekit.protocol.agent.JobStatus
+_JOB_STATUS = {0: "pending", 1: "running", 2: "succeeded", 3: "failed"}
+TERMINAL_STATUSES = {"succeeded", "failed", "ended"}
+_NUMERIC_FIELDS = ("created_at", "updated_at")
+# a dispatch still not finished after this long is given up on as failed, so
+# whoever waits on it (a campaign slot) doesn't wait forever
+MAX_CALL_SECONDS = float(os.getenv("MAX_CALL_SECONDS", "3600"))
+
+
+@dataclass
+class TrackedDispatch:
+    dispatch_id: str
+    room_name: str
+    agent_name: str
+    status: str = "created"
+    job_id: str | None = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    finished: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "dispatch_id": self.dispatch_id,
+            "room_name": self.room_name,
+            "agent_name": self.agent_name,
+            "status": self.status,
+            "job_id": self.job_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class DispatchTracker:
+    """Reconciles dispatch status in the background instead of on the request path.
+
+    Every `interval` seconds the rooms of all unfinished dispatches are looked up
+    with list_dispatch, at most `batch_size` requests in flight at once. With a
+    shared state backend, status is mirrored there so any API worker can serve it.
+    """
+
+    def __init__(
+        self,
+        client: LiveKitClient,
+        *,
+        interval: float = 2.0,
+        batch_size: int = 50,
+        max_entries: int = 100_000,
+        max_call_seconds: float = MAX_CALL_SECONDS,
+        state: shared_state.RedisState | None = None,
+    ):
+        self._client = client
+        self._max_call_seconds = max_call_seconds
+        self._state = state
+        self._interval = interval
+        self._batch_size = batch_size
+        self._max_entries = max_entries
+        self._dispatches: OrderedDict[str, TrackedDispatch] = OrderedDict()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def track(self, dispatch_id: str, room_name: str, agent_name: str) -> TrackedDispatch:
+        tracked = TrackedDispatch(dispatch_id, room_name, agent_name)
+        self._dispatches[dispatch_id] = tracked
+        while len(self._dispatches) > self._max_entries:
+            _, evicted = self._dispatches.popitem(last=False)
+            if evicted.status not in TERMINAL_STATUSES:
+                # no longer reconciled, don't leave waiters hanging
+                evicted.status = "unknown"
+                evicted.finished.set()
+        await self._save(tracked)
+        return tracked
+
+    def get(self, dispatch_id: str) -> TrackedDispatch | None:
+        return self._dispatches.get(dispatch_id)
+
+    async def lookup(self, dispatch_id: str) -> dict[str, Any] | None:
+        """Status of a dispatch created by this or (with shared state) any other worker"""
+        tracked = self._dispatches.get(dispatch_id)
+        if tracked is not None:
+            return tracked.to_dict()
+        if self._state is not None:
+            fields = await self._state.load(f"dispatch:{dispatch_id}")
+            if fields:
+                return shared_state.decode(fields, _NUMERIC_FIELDS)
+        return None
+
+    async def _save(self, tracked: TrackedDispatch):
+        if self._state is not None:
+            await self._state.save(f"dispatch:{tracked.dispatch_id}", tracked.to_dict())
+
+    async def wait(self, dispatch_id: str) -> str:
+        """Wait until the dispatch reaches a terminal status and return it.
+
+        "unknown" if the dispatch isn't (or is no longer) tracked, "failed" if it
+        didn't finish within max_call_seconds.
+        """
+        tracked = self._dispatches.get(dispatch_id)
+        if tracked is None:
+            return "unknown"
+        try:
+            await asyncio.wait_for(tracked.finished.wait(), self._max_call_seconds)
+        except asyncio.TimeoutError:
+            if tracked.status not in TERMINAL_STATUSES:
+                logger.warning(
+                    f"dispatch {dispatch_id} still {tracked.status} after {self._max_call_seconds:.0f}s, "
+                    "marking it failed"
+                )
+                tracked.status = "failed"
+                tracked.error = f"not finished after {self._max_call_seconds:.0f}s"
+                tracked.updated_at = time.time()
+                tracked.finished.set()
+                await self._save(tracked)
+        return tracked.status
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"dispatch reconcile failed: {e}")
+
+    async def reconcile(self):
+        by_room: dict[str, list[TrackedDispatch]] = defaultdict(list)
+        for tracked in self._dispatches.values():
+            if tracked.status not in TERMINAL_STATUSES:
+                by_room[tracked.room_name].append(tracked)
+        if not by_room:
+            return
+
+        rooms = list(by_room)
+        async with self._client.acquire() as lkapi:
+            for i in range(0, len(rooms), self._batch_size):
+                batch = rooms[i : i + self._batch_size]
+                results = await asyncio.gather(
+                    *(lkapi.agent_dispatch.list_dispatch(room_name=r) for r in batch),
+                    return_exceptions=True,
+                )
+                changed: list[TrackedDispatch] = []
+                for room, result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        logger.warning(f"list_dispatch failed for {room}: {result}")
+                        continue
+                    changed.extend(self._apply(by_room[room], result))
+                if changed and self._state is not None:
+                    await asyncio.gather(*(self._save(t) for t in changed))
+
+    def _apply(
+        self, tracked_in_room: list[TrackedDispatch], dispatches: list
+    ) -> list[TrackedDispatch]:
+        changed = []
+        live = {d.id: d for d in dispatches}
+        now = time.time()
+        for tracked in tracked_in_room:
+            dispatch = live.get(tracked.dispatch_id)
+            if dispatch is None:
+                # the dispatch is removed once its room closes
+                status = "ended"
+            else:
+                status = "pending"
+                if dispatch.state.jobs:
+                    job = dispatch.state.jobs[-1]
+                    tracked.job_id = job.id
+                    status = _JOB_STATUS.get(job.state.status, "pending")
+                    tracked.error = job.state.error or None
+
+            if status != tracked.status:
+                tracked.status = status
+                tracked.updated_at = now
+                if status in TERMINAL_STATUSES:
+                    tracked.finished.set()
+                changed.append(tracked)
+        return changed
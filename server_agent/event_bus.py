@@ -0,0 +1,332 @@
+"""Carries log and transcript events from agent job processes to the /ws/logs process.
+
+Job processes publish through a background thread (never blocking the caller),
+the FastAPI process runs the receiving side and feeds log_streamer.
+
+Backends, picked with EVENT_BUS:
+- "unix" (default): newline-delimited JSON over a Unix domain socket
+- "redis": Redis pub/sub, needs `pip install redis` and REDIS_URL
+
+The Unix socket has one receiving process, so an API with several workers
+must use redis; a second worker starting on the same socket fails at startup.
+
+    python event_bus.py bench --processes 8 --rate 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+import log_streamer
+
+logger = logging.getLogger("outbound-caller")
+
+EVENT_BUS = os.getenv("EVENT_BUS", "unix")
+EVENT_BUS_SOCKET = os.getenv("EVENT_BUS_SOCKET", "/tmp/outbound-caller-events.sock")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "outbound-caller:events")
+
+# events waiting to be sent by a publisher; the oldest are dropped when full
+MAX_PENDING_EVENTS = 10_000
+FLUSH_INTERVAL = 0.02
+RECONNECT_DELAY = 1.0
+MAX_LINE_BYTES = 1 << 20
+
+stats = {
+    "published": 0,
+    "sent": 0,
+    "dropped": 0,
+    "send_errors": 0,
+    "handler_errors": 0,
+    "received": 0,
+}
+
+
+class _UnixSocketTransport:
+    def __init__(self, path: str):
+        self._path = path
+        self._sock: socket.socket | None = None
+
+    def send(self, payload: bytes):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # a stuck reader shows up as a timeout and a reconnect, not a hung thread
+            sock.settimeout(1.0)
+            sock.connect(self._path)
+            self._sock = sock
+        self._sock.sendall(payload)
+
+    def reset(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class _RedisTransport:
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1.0)
+
+    def send(self, payload: bytes):
+        self._client.publish(REDIS_CHANNEL, payload)
+
+    def reset(self):
+        pass
+
+
+class Publisher:
+    """Batches events on a background thread; publish() only appends to a deque"""
+
+    def __init__(self, transport):
+        self._transport = transport
+        self._pending: deque = deque(maxlen=MAX_PENDING_EVENTS)
+        self._thread = threading.Thread(
+            target=self._run, name="event-bus-publisher", daemon=True
+        )
+        self._thread.start()
+
+    def publish(self, event: Dict[str, Any]):
+        stats["published"] += 1
+        if len(self._pending) == MAX_PENDING_EVENTS:
+            stats["dropped"] += 1
+        self._pending.append(event)
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            if not self._pending:
+                continue
+            batch = []
+            while self._pending:
+                batch.append(self._pending.popleft())
+            payload = "".join(json.dumps(e, default=str) + "\n" for e in batch).encode()
+            try:
+                self._transport.send(payload)
+                stats["sent"] += len(batch)
+            except Exception:
+                # receiver down or too slow: drop this batch and back off,
+                # new events keep queueing (bounded) meanwhile
+                stats["send_errors"] += 1
+                stats["dropped"] += len(batch)
+                self._transport.reset()
+                time.sleep(RECONNECT_DELAY)
+
+
+_publisher: Publisher | None = None
+
+
+def start_publisher() -> Publisher:
+    """Route this process' log records to the bus (called in job processes)"""
+    global _publisher
+    if _publisher is None:
+        if EVENT_BUS == "redis":
+            transport = _RedisTransport(REDIS_URL)
+        else:
+            transport = _UnixSocketTransport(EVENT_BUS_SOCKET)
+        _publisher = Publisher(transport)
+        log_streamer.set_sink(_publisher.publish)
+    return _publisher
+
+
+def _reset_after_fork():
+    global _publisher
+    _publisher = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _deliver(line: bytes, on_event: Callable[[Dict[str, Any]], None]):
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return
+    stats["received"] += 1
+    try:
+        on_event(event)
+    except Exception:
+        # one bad event must not end the job's connection, and with it its later events
+        stats["handler_errors"] += 1
+        logger.exception(f"event bus handler failed on a {event.get('event', 'log')!r} event")
+
+
+_server: asyncio.AbstractServer | None = None
+# held by the process receiving on EVENT_BUS_SOCKET, see _claim_socket
+_lock_fd: int | None = None
+_connections: set = set()
+_redis_task: asyncio.Task | None = None
+
+
+async def start_server(on_event: Callable[[Dict[str, Any]], None] = log_streamer.publish):
+    """Receive events from job processes (FastAPI startup)"""
+    global _server, _redis_task
+    if EVENT_BUS == "redis":
+        if _redis_task is None:
+            _redis_task = asyncio.create_task(_redis_subscribe(on_event))
+        return
+    if _server is not None:
+        return
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        _connections.add(writer)
+        try:
+            while line := await reader.readline():
+                _deliver(line, on_event)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"event bus connection dropped: {e}")
+        finally:
+            _connections.discard(writer)
+            writer.close()
+
+    _claim_socket()
+    if os.path.exists(EVENT_BUS_SOCKET):
+        os.unlink(EVENT_BUS_SOCKET)
+    _server = await asyncio.start_unix_server(
+        handle, path=EVENT_BUS_SOCKET, limit=MAX_LINE_BYTES
+    )
+
+
+def _claim_socket():
+    """Lock the socket for this process, or fail if another one receives on it.
+
+    Without this each API worker would unlink and rebind the socket, and only
+    the last one to start would get any events.
+    """
+    global _lock_fd
+    fd = os.open(EVENT_BUS_SOCKET + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        raise RuntimeError(
+            f"another process already receives events on {EVENT_BUS_SOCKET}; "
+            "run the API with a single worker or set EVENT_BUS=redis"
+        ) from None
+    _lock_fd = fd
+
+
+def _release_socket():
+    global _lock_fd
+    if _lock_fd is not None:
+        os.close(_lock_fd)
+        _lock_fd = None
+
+
+async def _redis_subscribe(on_event: Callable[[Dict[str, Any]], None]):
+    import redis.asyncio as aioredis
+
+    client = aioredis.from_url(REDIS_URL)
+    pubsub = client.pubsub()
+    await pubsub.subscribe(REDIS_CHANNEL)
+    try:
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            for line in message["data"].splitlines():
+                _deliver(line, on_event)
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
+
+
+async def stop_server():
+    global _server, _redis_task
+    if _server is not None:
+        _server.close()
+        # publishers keep their connection open, close them or wait_closed hangs
+        for writer in list(_connections):
+            writer.close()
+        await _server.wait_closed()
+        _server = None
+        _release_socket()
+    if _redis_task is not None:
+        _redis_task.cancel()
+        await asyncio.gather(_redis_task, return_exceptions=True)
+        _redis_task = None
+
+
+def get_stats() -> dict:
+    return {
+        **stats,
+        "backend": EVENT_BUS,
+        "pending": len(_publisher._pending) if _publisher else 0,
+    }
+
+
+def _bench_publisher(rate: float, seconds: float, results):
+    """A job process publishing `rate` events a second"""
+    publisher = start_publisher()
+    per_tick = max(1, int(rate / 100))
+    published = 0
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        for _ in range(per_tick):
+            publisher.publish({"ts": time.time(), "event": "bench", "message": "bench event"})
+        published += per_tick
+        time.sleep(max(0.0, started + published / rate - time.monotonic()))
+    # let the last batch go out
+    time.sleep(FLUSH_INTERVAL * 5)
+    results.put(dict(stats))
+
+
+async def _bench(processes: int, rate: float, seconds: float) -> Dict[str, Any]:
+    """Publisher processes sending to a receiver in this process over the configured backend"""
+    global EVENT_BUS_SOCKET
+    if EVENT_BUS != "redis":
+        # forked publishers inherit it
+        EVENT_BUS_SOCKET = os.path.join(tempfile.mkdtemp(), "events.sock")
+    lags: list[float] = []
+
+    def on_event(event: Dict[str, Any]):
+        lags.append(time.time() - event["ts"])
+
+    await start_server(on_event)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    publishers = [context.Process(target=_bench_publisher, args=(rate, seconds, results)) for _ in range(processes)]
+    started = time.monotonic()
+    for publisher in publishers:
+        publisher.start()
+    published = await asyncio.to_thread(lambda: [results.get() for _ in publishers])
+    elapsed = time.monotonic() - started
+    for publisher in publishers:
+        publisher.join()
+    await stop_server()
+
+    lags.sort()
+    return {
+        "backend": EVENT_BUS,
+        "processes": processes,
+        "published": sum(s["published"] for s in published),
+        "sent": sum(s["sent"] for s in published),
+        "dropped": sum(s["dropped"] for s in published),
+        "send_errors": sum(s["send_errors"] for s in published),
+        "received": len(lags),
+        "received_per_second": round(len(lags) / elapsed),
+        "lag_ms_p50": round(lags[len(lags) // 2] * 1000, 1) if lags else None,
+        "lag_ms_p99": round(lags[min(len(lags) - 1, int(0.99 * len(lags)))] * 1000, 1) if lags else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="throughput from publisher processes to one receiver")
+    bench_parser.add_argument("--processes", type=int, default=8)
+    bench_parser.add_argument("--rate", type=float, default=5000, help="events per second per process")
+    bench_parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_bench(args.processes, args.rate, args.seconds)), indent=2))
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator
+
+from livekit import rtc
+from livekit.agents import AgentSession
+
+from tts_cache import PhraseCache
+
+logger = logging.getLogger("outbound-caller")
+
+# tools that answer faster than this never get a filler
+FILLER_DELAY = float(os.getenv("FILLER_DELAY_MS", "700")) / 1000
+FILLER_PHRASES = ("One moment.", "Let me check that for you.", "Just a second.")
+
+
+@dataclass
+class LatencyStats:
+    tool_calls: int = 0
+    fillers: int = 0
+    tool_seconds: float = 0.0
+    # silence the caller would have heard without fillers, and the part fillers covered
+    dead_air_seconds: float = 0.0
+    masked_seconds: float = 0.0
+
+
+class ToolLatencyMasker:
+    """Plays a cached filler phrase when a tool is slow, so the caller doesn't hear silence.
+
+    The phrases are pre-synthesized in the agent's PhraseCache (see CACHED_PHRASES).
+
+    The filler is only played once the tool has run for FILLER_DELAY. If the
+    result arrives before its audio starts, the filler is interrupted before the
+    caller hears anything; once it has started it's left to finish, so the caller
+    never hears half a phrase.
+    """
+
+    def __init__(self, cache: PhraseCache):
+        self.stats = LatencyStats()
+        self._cache = cache
+        self._phrases = itertools.cycle(FILLER_PHRASES)
+
+    async def _play(self, session: AgentSession, started: asyncio.Event, duration: list[float]):
+        await asyncio.sleep(FILLER_DELAY)
+        phrase = next(self._phrases)
+        cached = self._cache.get(phrase)
+
+        async def audio() -> AsyncIterator[rtc.AudioFrame]:
+            with cached:
+                started.set()
+                async for frame in cached.frames():
+                    yield frame
+
+        if cached is not None:
+            duration.append(cached.duration)
+            return session.say(phrase, audio=audio(), add_to_chat_ctx=False)
+        # not warmed yet: synthesize it live, which is still sooner than the tool
+        started.set()
+        return session.say(phrase, add_to_chat_ctx=False)
+
+    @asynccontextmanager
+    async def mask(self, session: AgentSession, tool: str):
+        started_at = time.perf_counter()
+        started = asyncio.Event()
+        filler_duration: list[float] = []
+        timer = asyncio.create_task(self._play(session, started, filler_duration))
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            error = None
+            if not timer.done():
+                timer.cancel()
+            elif (error := timer.exception()) is None and not started.is_set():
+                timer.result().interrupt()
+
+            self.stats.tool_calls += 1
+            self.stats.tool_seconds += elapsed
+            self.stats.dead_air_seconds += elapsed
+            if started.is_set():
+                # live synthesis has no known length, count the time it was queued
+                masked = elapsed - FILLER_DELAY
+                if filler_duration:
+                    masked = min(masked, filler_duration[0])
+                self.stats.fillers += 1
+                self.stats.masked_seconds += masked
+                logger.info(f"{tool} took {elapsed * 1000:.0f}ms, filler covered {masked * 1000:.0f}ms")
+            elif error is not None:
+                logger.warning(f"filler for {tool} failed: {error}")
+
+    async def log_summary(self):
+        """Shutdown callback: how much dead air the fillers covered on this call"""
+        s = self.stats
+        logger.info(
+            f"tool latency: {s.tool_calls} calls, {s.fillers} fillers, "
+            f"{s.masked_seconds:.1f}s of {s.dead_air_seconds:.1f}s dead air masked",
+            extra={"event": "tool_latency", "data": asdict(s)},
+        )
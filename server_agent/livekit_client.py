@@ -0,0 +1,239 @@
+"""Shared LiveKitAPI client for the dispatch API.
+
+Compare it with a client per dispatch against a local stub Twirp server:
+
+    python livekit_client.py bench --requests 2000 --concurrency 50
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import time
+from datetime import timedelta
+from importlib import metadata
+from typing import AsyncIterator
+
+import aiohttp
+from livekit import api
+
+logger = logging.getLogger("outbound-caller")
+
+# "pooled" keeps one LiveKitAPI for the lifetime of the app,
+# "per_request" restores the old behaviour of one client per dispatch
+LIVEKIT_API_MODE = os.getenv("LIVEKIT_API_MODE", "pooled")
+
+TOKEN_TTL = timedelta(minutes=10)
+# refresh cached tokens this long before they expire
+TOKEN_REFRESH_MARGIN = 60.0
+
+
+def _token_cache_supported(service) -> bool:
+    """Whether `service` has the Service._auth_header(grants, sip) that _CachedAuthHeader
+    replaces. It's private to livekit-api (pinned in requirements.txt), check before patching."""
+    method = getattr(type(service), "_auth_header", None)
+    if method is None or getattr(service, "_token", None):
+        return False
+    try:
+        return list(inspect.signature(method).parameters)[:3] == ["self", "grants", "sip"]
+    except (TypeError, ValueError):
+        return False
+
+
+class _CachedAuthHeader:
+    """Drop-in for Service._auth_header that reuses signed tokens until close to expiry"""
+
+    def __init__(self, service):
+        self._service = service
+        self._cache: dict[tuple[str, str], tuple[dict[str, str], float]] = {}
+
+    def __call__(self, grants=None, sip=None) -> dict[str, str]:
+        key = (repr(grants), repr(sip))
+        now = time.time()
+        cached = self._cache.get(key)
+        if cached and cached[1] - TOKEN_REFRESH_MARGIN > now:
+            return dict(cached[0])
+
+        tok = api.AccessToken(self._service.api_key, self._service.api_secret)
+        tok.with_ttl(TOKEN_TTL)
+        if grants:
+            tok.with_grants(grants)
+        if sip is not None:
+            tok.with_sip_grants(sip)
+        headers = {"Authorization": f"Bearer {tok.to_jwt()}"}
+        self._cache[key] = (headers, now + TOKEN_TTL.total_seconds())
+        return dict(headers)
+
+
+class LiveKitClient:
+    """Application-scoped LiveKitAPI with a keep-alive connection pool.
+
+    Call start() on app startup and aclose() on shutdown.
+    """
+
+    def __init__(
+        self, *, pool_size: int = 100, keepalive_timeout: float = 60.0, mode: str = LIVEKIT_API_MODE
+    ):
+        self._mode = mode
+        self._pool_size = pool_size
+        self._keepalive_timeout = keepalive_timeout
+        self._session: aiohttp.ClientSession | None = None
+        self._api: api.LiveKitAPI | None = None
+
+    async def start(self):
+        if self._api is not None or self._mode != "pooled":
+            return
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self._pool_size,
+                keepalive_timeout=self._keepalive_timeout,
+            ),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        self._api = _new_api(session=self._session)
+        for service in (
+            self._api.room,
+            self._api.sip,
+            self._api.agent_dispatch,
+            self._api.egress,
+            self._api.ingress,
+        ):
+            if not _token_cache_supported(service):
+                logger.warning(
+                    f"livekit-api {_sdk_version()} changed Service._auth_header, "
+                    f"{type(service).__name__} signs a new token per request"
+                )
+                continue
+            service._auth_header = _CachedAuthHeader(service)
+
+    async def aclose(self):
+        if self._api is not None:
+            await self._api.aclose()
+            self._api = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[api.LiveKitAPI]:
+        if self._api is not None:
+            yield self._api
+            return
+
+        lkapi = _new_api()
+        try:
+            yield lkapi
+        finally:
+            await lkapi.aclose()
+
+
+def _sdk_version() -> str:
+    try:
+        return metadata.version("livekit-api")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _new_api(session: aiohttp.ClientSession | None = None) -> api.LiveKitAPI:
+    return api.LiveKitAPI(
+        url=os.getenv("LIVEKIT_URL"),
+        api_key=os.getenv("LIVEKIT_API_KEY"),
+        api_secret=os.getenv("LIVEKIT_API_SECRET"),
+        session=session,
+    )
+
+
+def _serve_stub(port: int, latency: float):
+    """A Twirp endpoint answering CreateDispatch after `latency` seconds.
+
+    ListDispatch returns no dispatches, so a DispatchTracker sees them as ended.
+    """
+    from aiohttp import web
+
+    async def create_dispatch(request: web.Request):
+        body = api.CreateAgentDispatchRequest.FromString(await request.read())
+        await asyncio.sleep(latency)
+        dispatch = api.AgentDispatch(id=f"AD_{os.urandom(4).hex()}", agent_name=body.agent_name, room=body.room)
+        return web.Response(body=dispatch.SerializeToString(), content_type="application/protobuf")
+
+    async def list_dispatch(request: web.Request):
+        return web.Response(
+            body=api.ListAgentDispatchResponse().SerializeToString(), content_type="application/protobuf"
+        )
+
+    app = web.Application()
+    app.router.add_post("/twirp/livekit.AgentDispatchService/CreateDispatch", create_dispatch)
+    app.router.add_post("/twirp/livekit.AgentDispatchService/ListDispatch", list_dispatch)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, handle_signals=False)
+
+
+async def _bench_mode(mode: str, requests: int, concurrency: int) -> dict:
+    client = LiveKitClient(mode=mode)
+    await client.start()
+    slots = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def dispatch(i: int):
+        async with slots:
+            started = time.perf_counter()
+            async with client.acquire() as lkapi:
+                await lkapi.agent_dispatch.create_dispatch(
+                    api.CreateAgentDispatchRequest(agent_name="bench", room=f"bench-{i}")
+                )
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(dispatch(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await client.aclose()
+    latencies.sort()
+    return {
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "dispatches_per_second": requests / elapsed,
+    }
+
+
+async def _bench(port: int, requests: int, concurrency: int) -> dict:
+    os.environ["LIVEKIT_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("LIVEKIT_API_KEY", "bench")
+    os.environ.setdefault("LIVEKIT_API_SECRET", "bench-secret-bench-secret-bench-secret")
+    for _ in range(100):  # wait for the stub server
+        try:
+            async with aiohttp.ClientSession() as session:
+                await session.get(os.environ["LIVEKIT_URL"])
+            break
+        except aiohttp.ClientConnectionError:
+            await asyncio.sleep(0.05)
+    # warm up the stub, then run the modes in turn
+    await _bench_mode("pooled", min(requests, 100), concurrency)
+    return {
+        "livekit_api": _sdk_version(),
+        **{mode: await _bench_mode(mode, requests, concurrency) for mode in ("per_request", "pooled")},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="dispatch latency, pooled vs a client per dispatch")
+    bench.add_argument("--requests", type=int, default=2000)
+    bench.add_argument("--concurrency", type=int, default=50)
+    bench.add_argument("--latency", type=float, default=0.005, help="stub server seconds per dispatch")
+    bench.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    # the stub runs in its own process, so it doesn't share the client's event loop
+    stub = multiprocessing.Process(target=_serve_stub, args=(args.port, args.latency), daemon=True)
+    stub.start()
+    try:
+        print(json.dumps(asyncio.run(_bench(args.port, args.requests, args.concurrency)), indent=2))
+    finally:
+        stub.terminate()
@@ -1,35 +1,473 @@
+import argparse
 import asyncio
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
 from fastapi import WebSocket
-from typing import List
+from typing import Any, Dict, Iterable, Set
 
-connected_clients: List[WebSocket] = []
+# records waiting to be batched; the oldest are dropped when it is full
+MAX_BUFFERED_RECORDS = 10_000
+# how often buffered records are flushed to clients as one frame
+BATCH_INTERVAL = 0.02
+# frames queued per client before the oldest are dropped
+CLIENT_QUEUE_SIZE = 64
+
+stats = {
+    "records_received": 0,
+    "records_sent": 0,
+    "records_dropped_buffer": 0,
+    "records_dropped_client": 0,
+    "frames_sent": 0,
+}
+
+# room / phone number of the call the current task is handling
+call_context: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar(
+    "call_context", default={}
+)
+
+# filled by the listener thread, drained by the consumer on the FastAPI loop;
+# deque.append/popleft are atomic so no lock is needed
+_buffer: deque = deque(maxlen=MAX_BUFFERED_RECORDS)
+_consumer: asyncio.Task | None = None
+
+
+# a job process runs one call at a time; records logged outside the call's
+# tasks (e.g. from shutdown callbacks) are tagged with it too
+_process_context: Dict[str, str] = {}
+
+
+def set_call_context(*, room: str, phone_number: str | None = None):
+    """Tag every record logged from the current task (and its children) with the call"""
+    global _process_context
+    context = {"room": room}
+    if phone_number:
+        context["phone_number"] = phone_number
+    call_context.set(context)
+    _process_context = context
+
+
+def _as_set(value: Any) -> frozenset:
+    if not value:
+        return frozenset()
+    if isinstance(value, str):
+        value = value.split(",")
+    return frozenset(str(v).strip() for v in value if str(v).strip())
+
+
+@dataclass(frozen=True)
+class Subscription:
+    """Filters a client subscribes with; empty fields match everything"""
+
+    rooms: frozenset = frozenset()
+    phone_numbers: frozenset = frozenset()
+    min_level: int = logging.NOTSET
+    events: frozenset = frozenset()
+
+    @classmethod
+    def parse(cls, filters: Dict[str, Any]) -> "Subscription":
+        level = filters.get("level") or "NOTSET"
+        min_level = logging.getLevelName(str(level).upper())
+        return cls(
+            rooms=_as_set(filters.get("room")),
+            phone_numbers=_as_set(filters.get("phone_number")),
+            min_level=min_level if isinstance(min_level, int) else logging.NOTSET,
+            events=_as_set(filters.get("event")),
+        )
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        # rooms are matched through the room index
+        if self.phone_numbers and record.get("phone_number") not in self.phone_numbers:
+            return False
+        if record["levelno"] < self.min_level:
+            return False
+        if self.events and record["event"] not in self.events:
+            return False
+        return True
+
+
+class _Client:
+    def __init__(self, websocket: WebSocket, subscription: Subscription):
+        self.websocket = websocket
+        self.subscription = subscription
+        # (frame, number of records in it)
+        self.frames: deque = deque(maxlen=CLIENT_QUEUE_SIZE)
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def push(self, frame: str, count: int):
+        if len(self.frames) == self.frames.maxlen:
+            stats["records_dropped_client"] += self.frames[0][1]
+        self.frames.append((frame, count))
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.frames:
+                frame, count = self.frames.popleft()
+                try:
+                    await self.websocket.send_text(frame)
+                except Exception:
+                    unregister_client(self.websocket)
+                    return
+                stats["records_sent"] += count
+                stats["frames_sent"] += 1
+
+
+connected_clients: Dict[WebSocket, _Client] = {}
+# room name -> clients subscribed to that room
+_room_index: Dict[str, Set[_Client]] = defaultdict(set)
+# clients without a room filter
+_all_rooms: Set[_Client] = set()
+
+
+def _index(client: _Client):
+    if client.subscription.rooms:
+        for room in client.subscription.rooms:
+            _room_index[room].add(client)
+    else:
+        _all_rooms.add(client)
+
+
+def _unindex(client: _Client):
+    _all_rooms.discard(client)
+    for room in client.subscription.rooms:
+        subscribers = _room_index.get(room)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del _room_index[room]
+
+
+def make_record(
+    message: str,
+    *,
+    level: int = logging.INFO,
+    event: str = "log",
+    ts: float | None = None,
+    context: Dict[str, str] | None = None,
+    **fields: Any,
+) -> Dict[str, Any]:
+    record = {
+        "ts": ts or time.time(),
+        "level": logging.getLevelName(level),
+        "levelno": level,
+        "event": event,
+        "message": message,
+        **(call_context.get() if context is None else context),
+    }
+    record.update((k, v) for k, v in fields.items() if v is not None)
+    return record
+
+
+def publish(record: Dict[str, Any]):
+    """Queue a record for the dashboards, safe to call from any thread.
+
+    Records published before the consumer starts wait in the ring buffer.
+    """
+    stats["records_received"] += 1
+    if len(_buffer) == MAX_BUFFERED_RECORDS:
+        stats["records_dropped_buffer"] += 1
+    _buffer.append(record)
+
+
+# where the listener thread sends records: the local ring buffer, or the
+# cross-process event bus in agent job processes (see event_bus.start_publisher)
+_sink = publish
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink
 
-# This will be set to the main event loop when FastAPI starts
-event_loop: asyncio.AbstractEventLoop | None = None
 
 async def broadcast_log(message: str):
-    to_remove = []
-    for client in connected_clients:
-        try:
-            await client.send_text(message)
-        except Exception:
-            to_remove.append(client)
+    publish(make_record(message))
+
+
+def _subscriptions(clients: Iterable[_Client]) -> Dict[Subscription, list]:
+    grouped: Dict[Subscription, list] = defaultdict(list)
+    for client in clients:
+        grouped[client.subscription].append(client)
+    return grouped
+
+
+async def _consume():
+    while True:
+        await asyncio.sleep(BATCH_INTERVAL)
+        if not _buffer:
+            continue
+        batch = []
+        while _buffer:
+            batch.append(_buffer.popleft())
+        if not connected_clients:
+            continue
+
+        # clients with the same filters (typically most dashboards) share one
+        # frame, so each record is matched once per distinct subscription and
+        # serialized at most once
+        all_rooms = _subscriptions(_all_rooms)
+        by_room: Dict[str, Dict[Subscription, list]] = {}
+        per_subscription: Dict[Subscription, list] = defaultdict(list)
+        for record in batch:
+            groups = [all_rooms]
+            room = record.get("room")
+            if room and room in _room_index:
+                if room not in by_room:
+                    by_room[room] = _subscriptions(_room_index[room])
+                groups.append(by_room[room])
+            encoded = None
+            for group in groups:
+                for subscription in group:
+                    if not subscription.matches(record):
+                        continue
+                    if encoded is None:
+                        encoded = json.dumps(record, default=str)
+                    per_subscription[subscription].append(encoded)
+
+        subscribers = _subscriptions(connected_clients.values())
+        for subscription, encoded_records in per_subscription.items():
+            frame = "[" + ",".join(encoded_records) + "]"
+            for client in subscribers[subscription]:
+                client.push(frame, len(encoded_records))
 
-    for client in to_remove:
-        connected_clients.remove(client)
 
-def register_client(websocket: WebSocket):
-    connected_clients.append(websocket)
+async def start():
+    """Start the batching consumer on the running loop (FastAPI startup)"""
+    global _consumer
+    if _consumer is None:
+        _consumer = asyncio.create_task(_consume())
+
+
+async def stop():
+    global _consumer
+    if _consumer is not None:
+        _consumer.cancel()
+        _consumer = None
+    for websocket in list(connected_clients):
+        unregister_client(websocket)
+
+
+def register_client(websocket: WebSocket, filters: Dict[str, Any] | None = None):
+    client = _Client(websocket, Subscription.parse(filters or {}))
+    connected_clients[websocket] = client
+    _index(client)
+    client.task = asyncio.create_task(client.run())
+
+def update_subscription(websocket: WebSocket, message: str):
+    """Apply a {"room": ..., "phone_number": ..., "level": ..., "event": ...} message"""
+    client = connected_clients.get(websocket)
+    try:
+        filters = json.loads(message)
+    except ValueError:
+        return  # plain keep-alive text
+    if client is None or not isinstance(filters, dict):
+        return
+    _unindex(client)
+    client.subscription = Subscription.parse(filters)
+    _index(client)
 
 def unregister_client(websocket: WebSocket):
-    if websocket in connected_clients:
-        connected_clients.remove(websocket)
+    client = connected_clients.pop(websocket, None)
+    if client is None:
+        return
+    _unindex(client)
+    if client.task and client.task is not asyncio.current_task():
+        client.task.cancel()
+
+def get_stats() -> dict:
+    return {
+        **stats,
+        "clients": len(connected_clients),
+        "indexed_rooms": len(_room_index),
+        "buffered": len(_buffer),
+    }
 
-class WebSocketLogHandler(logging.Handler):
-    """Logging handler that sends logs to connected WebSocket clients."""
+class _PublishHandler(logging.Handler):
+    """Runs on the listener thread: turns log records into dashboard records"""
     def emit(self, record):
-        log_entry = self.format(record)
-        # Ensure this runs in the main event loop (FastAPI)
-        if event_loop and event_loop.is_running():
-            asyncio.run_coroutine_threadsafe(broadcast_log(log_entry), event_loop)
+        try:
+            _sink(
+                make_record(
+                    record.getMessage(),
+                    level=record.levelno,
+                    event=getattr(record, "event", "log"),
+                    ts=record.created,
+                    context=getattr(record, "call_context", {}),
+                    logger=record.name,
+                    room=getattr(record, "room", None),
+                    phone_number=getattr(record, "phone_number", None),
+                    # structured payload for dashboard events, logged with extra={"data": ...}
+                    data=getattr(record, "data", None),
+                    # from logger.exception(), formatted in prepare()
+                    traceback=record.exc_text,
+                )
+            )
+        except Exception:
+            self.handleError(record)
+
+
+# SimpleQueue.put is lock-free for the producer and never blocks
+_record_queue: queue.SimpleQueue = queue.SimpleQueue()
+_listener: logging.handlers.QueueListener | None = None
+
+
+def _start_listener():
+    global _listener
+    if _listener is None:
+        _listener = logging.handlers.QueueListener(_record_queue, _PublishHandler())
+        _listener.start()
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _reset_after_fork():
+    # the listener thread doesn't survive a fork, job processes get their own
+    global _listener, _record_queue, _consumer
+    _listener = None
+    _consumer = None
+    _record_queue = queue.SimpleQueue()
+    for handler in WebSocketLogHandler.instances:
+        handler.queue = _record_queue
+    _buffer.clear()
+    _start_listener()
+
+
+_formatter = logging.Formatter()
+
+
+class WebSocketLogHandler(logging.handlers.QueueHandler):
+    """Logging handler that sends structured log records to connected WebSocket clients.
+
+    emit() only tags the record with the current call and puts it on a queue, so it is
+    safe and cheap from any thread or task. Formatting happens on a listener thread.
+    """
+    instances: list = []
+
+    def __init__(self):
+        super().__init__(_record_queue)
+        WebSocketLogHandler.instances.append(self)
+        _start_listener()
+
+    def prepare(self, record):
+        # the call context lives in the emitting task, capture it before handing off
+        record.call_context = call_context.get() or _process_context
+        # format the traceback while it's current, and don't keep its frames alive in the queue
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _formatter.formatException(record.exc_info)
+            record.exc_info = None
+        if record.stack_info:
+            record.exc_text = "\n".join(filter(None, (record.exc_text, record.stack_info)))
+            record.stack_info = None
+        return record
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(_stop_listener)
+
+
+def attach_handler(logger: logging.Logger):
+    """Stream `logger` to the dashboards, once even if several modules ask for it"""
+    if not any(isinstance(h, WebSocketLogHandler) for h in logger.handlers):
+        logger.addHandler(WebSocketLogHandler())
+
+
+class _BenchClient:
+    """Stands in for a dashboard WebSocket; a slow one takes `delay` per frame"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.lags: list = []
+
+    async def send_text(self, frame: str):
+        # records start with "ts", so the oldest record's age is read without decoding the frame
+        self.lags.append(time.time() - float(frame[8 : frame.index(",", 8)]))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+
+def _bench_produce(logger: logging.Logger, rate: float, seconds: float, recipients: Dict[str, int]) -> tuple:
+    """Logs `rate` records a second for `seconds`, in 10ms ticks, like a busy agent host"""
+    rooms = list(recipients)
+    per_tick = max(1, int(rate / 100))
+    logged = expected = 0
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        tick = started + logged / rate
+        for _ in range(per_tick):
+            room = rooms[logged % len(rooms)]
+            logger.info("bench record", extra={"room": room})
+            expected += recipients[room]
+            logged += 1
+        time.sleep(max(0.0, tick + per_tick / rate - time.monotonic()))
+    return logged, time.monotonic() - started, expected
+
+
+async def _bench(rate: float, clients: int, seconds: float, rooms: int, slow: float) -> Dict[str, Any]:
+    """Logs through WebSocketLogHandler to `clients` fake dashboards.
+
+    Half of them watch every room, the others one room each; `slow` of them take
+    200ms per frame. Delivery is counted for every client, lag only for the fast ones.
+    """
+    for key in stats:
+        stats[key] = 0
+    await start()
+    bench_clients = []
+    for i in range(clients):
+        client = _BenchClient(0.2 if i < clients * slow else 0.0)
+        register_client(client, {"room": f"room-{i % rooms}"} if i % 2 else {})
+        bench_clients.append(client)
+    recipients = {f"room-{i}": len(_all_rooms) + len(_room_index.get(f"room-{i}", ())) for i in range(rooms)}
+
+    logger = logging.getLogger("log-bench")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    attach_handler(logger)
+
+    cpu = time.process_time()
+    logged, elapsed, expected = await asyncio.to_thread(_bench_produce, logger, rate, seconds, recipients)
+    # let the last batches out
+    await asyncio.sleep(0.5)
+    cpu = time.process_time() - cpu
+    await stop()
+
+    lags = sorted(lag for client in bench_clients if not client.delay for lag in client.lags)
+    return {
+        "logged_per_second": round(logged / elapsed),
+        "clients": clients,
+        "slow_clients": sum(1 for client in bench_clients if client.delay),
+        "expected_deliveries": expected,
+        **stats,
+        "delivered_share": round(stats["records_sent"] / expected, 4) if expected else 0.0,
+        "lag_ms_p50": round(lags[len(lags) // 2] * 1000, 1) if lags else None,
+        "lag_ms_p99": round(lags[min(len(lags) - 1, int(0.99 * len(lags)))] * 1000, 1) if lags else None,
+        "cpu_cores": round(cpu / (elapsed + 0.5), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the dashboard log fan-out")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="log records through the handler to fake dashboards")
+    bench_parser.add_argument("--rate", type=float, default=50_000, help="records per second")
+    bench_parser.add_argument("--clients", type=int, default=200)
+    bench_parser.add_argument("--seconds", type=float, default=10)
+    bench_parser.add_argument("--rooms", type=int, default=50)
+    bench_parser.add_argument("--slow", type=float, default=0.05, help="share of clients taking 200ms per frame")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_bench(args.rate, args.clients, args.seconds, args.rooms, args.slow)), indent=2))
@@ -0,0 +1,8 @@
+"""Percentiles of latency samples, shared by the metrics, routing and benchmarks."""
+from __future__ import annotations
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile, `q` in [0, 1]; `values` must not be empty"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
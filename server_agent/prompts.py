@@ -0,0 +1,125 @@
+"""Prompt templates for the agent.
+
+The instructions are a static prefix, the same bytes on every call, followed
+by a short per-call block rendered from a template. Tool definitions come from
+the OutboundCaller methods and never change between calls either, so a
+provider that caches prompt prefixes (Gemini implicit caching, OpenAI prompt
+caching) only processes the per-call details and the conversation.
+
+Long calls are kept inside a token budget by dropping the oldest turns before
+each LLM request, see trim_history.
+"""
+from __future__ import annotations
+
+import functools
+import logging
+import os
+from string import Template
+
+from livekit.agents import ChatContext
+
+logger = logging.getLogger("outbound-caller")
+
+# estimated tokens of instructions and conversation sent with each request,
+# 0 to send everything
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# rough tokens per character for English; only used to size the history
+CHARS_PER_TOKEN = 4
+
+STATIC_INSTRUCTIONS = """\
+You are a scheduling assistant for a dental practice. Your interface with user will be voice.
+You will be on a call with a patient who has an upcoming appointment. Your goal is to confirm the appointment details.
+As a customer service representative, you will be polite and professional at all times. Allow user to end the conversation.
+
+When the user would like to be transferred to a human agent, first confirm with them. upon confirmation, use the transfer_call tool."""
+
+# per-call parts, rendered after STATIC_INSTRUCTIONS
+TEMPLATES = {
+    "known_contact": "The customer's name is $name. Their appointment is on $appointment_time.",
+    "unknown_contact": (
+        "You don't have the customer's details on file. "
+        "Ask for their name and which appointment they have before confirming anything."
+    ),
+    "greeting": (
+        "Hi $name, this is your dental office calling to confirm your appointment "
+        "on $appointment_time. Does that still work for you?"
+    ),
+    "greeting_unknown": (
+        "Hi, this is your dental office calling about your upcoming appointment. "
+        "Who am I speaking with?"
+    ),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(template: str) -> Template:
+    return Template(TEMPLATES[template])
+
+
+def render(template: str, **variables: str) -> str:
+    return compile_template(template).substitute(variables)
+
+
+@functools.lru_cache(maxsize=4096)
+def build_instructions(name: str | None, appointment_time: str | None) -> str:
+    if name and appointment_time:
+        details = render("known_contact", name=name, appointment_time=appointment_time)
+    else:
+        details = render("unknown_contact")
+    return f"{STATIC_INSTRUCTIONS}\n\n{details}"
+
+
+@functools.lru_cache(maxsize=4096)
+def build_greeting(name: str | None, appointment_time: str | None) -> str:
+    if name and appointment_time:
+        return render("greeting", name=name, appointment_time=appointment_time)
+    return render("greeting_unknown")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def item_tokens(item) -> int:
+    if item.type == "message":
+        return estimate_tokens(item.text_content or "")
+    if item.type == "function_call":
+        return estimate_tokens(item.name + item.arguments)
+    if item.type == "function_call_output":
+        return estimate_tokens(item.output)
+    return 0
+
+
+def trim_history(chat_ctx: ChatContext, budget: int = HISTORY_TOKEN_BUDGET) -> ChatContext:
+    """The newest turns that fit in `budget`, plus the instructions.
+
+    The kept history always starts on a user message, so a tool result is
+    never sent without the call that produced it; when the latest turn alone
+    is over the budget, it is sent whole. Returns `chat_ctx` itself when
+    nothing has to go.
+    """
+    if budget <= 0:
+        return chat_ctx
+    pinned, history = [], []
+    for item in chat_ctx.items:
+        if item.type == "message" and item.role in ("system", "developer"):
+            pinned.append(item)
+        else:
+            history.append(item)
+
+    used = sum(item_tokens(item) for item in pinned)
+    start = len(history)
+    while start > 0:
+        tokens = item_tokens(history[start - 1])
+        # the latest item is always sent, whatever its size
+        if start < len(history) and used + tokens > budget:
+            break
+        used += tokens
+        start -= 1
+    turns = [i for i, item in enumerate(history) if item.type == "message" and item.role == "user"]
+    start = next((i for i in turns if i >= start), turns[-1] if turns else 0)
+    if start == 0:
+        return chat_ctx
+
+    logger.debug(f"trimmed {start} of {len(history)} chat items to fit {budget} tokens")
+    return ChatContext(items=[*pinned, *history[start:]])
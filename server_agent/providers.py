@@ -0,0 +1,617 @@
+"""STT, LLM and TTS provider routing.
+
+Each slot is configured with an ordered list of providers, e.g.
+
+    STT_PROVIDERS=assemblyai,deepgram
+    LLM_PROVIDERS=google:gemini-2.0-flash-exp,openai:gpt-4o-mini
+    TTS_PROVIDERS=elevenlabs,cartesia
+
+Per provider the router keeps rolling time-to-first-token/byte and error
+rates (shared by the jobs on a host through a small snapshot file), and puts
+healthy, fast providers first at the start of each call.
+
+- STT runs through livekit's stt.FallbackAdapter, which moves the live stream
+  to the next provider if one fails, without dropping the session.
+- LLM and TTS requests are hedged: if the first provider hasn't produced its
+  first token/audio by its p95 (HEDGE_PERCENTILE), the next one is sent the
+  same request and whichever answers first is used. A provider that fails
+  before answering is replaced by the next one for that request.
+
+Requests wait for their provider's rate limit (rate_limits.py) before the
+hedge clock starts, so a wait for quota isn't taken for a slow provider. A
+hedge is only sent if the next provider has a token free right away.
+
+Try it with fake providers and injected latency:
+
+    python providers.py simulate --requests 500 --slow 0.03 --fail 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import fcntl
+import json
+import logging
+import math
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Callable
+
+from livekit import rtc
+from livekit.agents import APIConnectOptions, llm as lk_llm, stt as lk_stt, tts as lk_tts
+
+import rate_limits
+from percentiles import percentile
+
+logger = logging.getLogger("outbound-caller")
+
+PROVIDERS = {
+    "stt": os.getenv("STT_PROVIDERS", "assemblyai"),
+    "llm": os.getenv("LLM_PROVIDERS", "google:gemini-2.0-flash-exp"),
+    "tts": os.getenv("TTS_PROVIDERS", "elevenlabs"),
+}
+HEDGE = os.getenv("PROVIDER_HEDGING", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# deadlines until a provider has enough samples for a percentile
+DEFAULT_DEADLINE = {"llm": 1.5, "tts": 0.8}
+MIN_SAMPLES = 20
+# samples kept per provider, and how far back they count
+WINDOW = 200
+WINDOW_SECONDS = 600.0
+# providers failing more often than this go to the back of the list
+MAX_ERROR_RATE = 0.2
+STATS_PATH = os.getenv("PROVIDER_STATS_PATH", "/tmp/outbound-caller-provider-stats.json")
+# with a provider to fall back to, fail fast instead of retrying the same one
+FAILOVER_CONN_OPTIONS = APIConnectOptions(max_retry=0, timeout=10.0)
+
+
+@dataclass(frozen=True)
+class ProviderSpec:
+    slot: str
+    name: str
+    model: str | None = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.slot}:{self.name}" + (f":{self.model}" if self.model else "")
+
+
+def parse_specs(slot: str, value: str) -> list[ProviderSpec]:
+    """"google:gemini-2.0-flash-exp,openai" -> specs in order of preference"""
+    specs = []
+    for item in value.split(","):
+        name, _, model = item.strip().partition(":")
+        if name:
+            specs.append(ProviderSpec(slot, name, model or None))
+    return specs
+
+
+def _create(spec: ProviderSpec, settings: dict[str, Any]):
+    """A plugin instance for a spec; plugins are imported only when configured"""
+    if spec.slot == "stt":
+        if spec.name == "assemblyai":
+            from livekit.plugins import assemblyai
+
+            return assemblyai.STT(
+                end_of_turn_confidence_threshold=0.7,
+                min_end_of_turn_silence_when_confident=160,
+                max_turn_silence=2400,
+            )
+        if spec.name == "deepgram":
+            from livekit.plugins import deepgram
+
+            return deepgram.STT(model=spec.model or "nova-3")
+    elif spec.slot == "llm":
+        if spec.name == "google":
+            from livekit.plugins import google
+
+            return google.LLM(model=spec.model or "gemini-2.0-flash-exp", temperature=0.8)
+        if spec.name == "openai":
+            from livekit.plugins import openai
+
+            return openai.LLM(model=spec.model or "gpt-4o-mini", temperature=0.8)
+    elif spec.slot == "tts":
+        if spec.name == "elevenlabs":
+            from livekit.plugins import elevenlabs
+
+            return elevenlabs.TTS(voice_id=settings["voice_id"], model=spec.model or settings["model"])
+        if spec.name == "cartesia":
+            from livekit.plugins import cartesia
+
+            return cartesia.TTS(model=spec.model or "sonic-2")
+        if spec.name == "deepgram":
+            from livekit.plugins import deepgram
+
+            return deepgram.TTS(model=spec.model or "aura-2-andromeda-en")
+    raise ValueError(f"unknown {spec.slot} provider {spec.name!r}")
+
+
+def tts_voice(spec: ProviderSpec, settings: dict[str, Any]) -> str:
+    """What a TTS provider sounds like with these settings, e.g. for the phrase cache key"""
+    if spec.name == "elevenlabs":
+        return f"{spec.name}:{settings['voice_id']}:{spec.model or settings['model']}"
+    return spec.key
+
+
+class RollingStats:
+    """Recent first-token latencies and errors of one provider"""
+
+    def __init__(self, samples: list | None = None):
+        # (unix time, seconds to first token/byte or None for an error)
+        self.samples: deque = deque(samples or (), maxlen=WINDOW)
+
+    def record(self, latency: float | None):
+        self.samples.append((time.time(), latency))
+
+    def _recent(self) -> list[float | None]:
+        cutoff = time.time() - WINDOW_SECONDS
+        return [latency for ts, latency in self.samples if ts >= cutoff]
+
+    def latencies(self) -> list[float]:
+        return [latency for latency in self._recent() if latency is not None]
+
+    def error_rate(self) -> float:
+        recent = self._recent()
+        # a couple of early errors don't condemn a provider
+        if len(recent) < MIN_SAMPLES:
+            return 0.0
+        return sum(latency is None for latency in recent) / len(recent)
+
+    def deadline(self, default: float) -> float:
+        latencies = self.latencies()
+        if len(latencies) < MIN_SAMPLES:
+            return default
+        return percentile(latencies, HEDGE_PERCENTILE)
+
+    def summary(self) -> dict[str, Any]:
+        latencies = self.latencies()
+        return {
+            "samples": len(latencies),
+            "p50": percentile(latencies, 0.5) if latencies else None,
+            "p95": percentile(latencies, 0.95) if latencies else None,
+            "error_rate": self.error_rate(),
+        }
+
+
+class ProviderRouter:
+    """Process-wide provider stats and ordering; see get_router()"""
+
+    def __init__(self, stats_path: str | None = STATS_PATH):
+        self.stats_path = stats_path
+        self.stats: dict[str, RollingStats] = {}
+        self.hedges = 0
+        self.failovers = 0
+        self._load()
+
+    def _stats(self, spec: ProviderSpec) -> RollingStats:
+        return self.stats.setdefault(spec.key, RollingStats())
+
+    def record(self, spec: ProviderSpec, latency: float):
+        self._stats(spec).record(latency)
+
+    def record_error(self, spec: ProviderSpec):
+        self._stats(spec).record(None)
+
+    def order(self, specs: list[ProviderSpec]) -> list[ProviderSpec]:
+        """Healthy providers first, in config order unless one is clearly slower"""
+
+        def rank(item: tuple[int, ProviderSpec]):
+            index, spec = item
+            stats = self._stats(spec)
+            latencies = stats.latencies()
+            # latency in 20% steps, so config order decides between similar providers
+            speed = 0
+            if len(latencies) >= MIN_SAMPLES:
+                speed = math.floor(math.log(max(percentile(latencies, 0.5), 0.001), 1.2))
+            return (stats.error_rate() > MAX_ERROR_RATE, speed, index)
+
+        return [spec for _, spec in sorted(enumerate(specs), key=rank)]
+
+    def deadline(self, spec: ProviderSpec) -> float:
+        return self._stats(spec).deadline(DEFAULT_DEADLINE[spec.slot])
+
+    async def hedge(
+        self,
+        candidates: list[tuple[ProviderSpec, Any]],
+        open_stream: Callable[[ProviderSpec, Any], AsyncIterator[Any]],
+        on_winner: Callable[[ProviderSpec], None] | None = None,
+    ) -> AsyncIterator[Any]:
+        """Stream from the first provider to answer, see the module docstring.
+
+        `on_winner` is called with the provider whose stream is used.
+        """
+        pending = list(candidates)
+        running: dict[asyncio.Future, tuple[ProviderSpec, AsyncIterator, float]] = {}
+        error: Exception | None = None
+        hedged = False
+
+        async def launch(hedging: bool = False) -> bool:
+            while pending:
+                spec, instance = pending[0]
+                # a hedge is optional, don't wait for quota to send one
+                if await rate_limits.acquire(spec.name, wait=not hedging):
+                    pending.pop(0)
+                    stream = aiter(open_stream(spec, instance))
+                    running[asyncio.ensure_future(anext(stream))] = (spec, stream, time.monotonic())
+                    return True
+                if hedging:
+                    return False
+                # the request has to go somewhere, try the next provider
+                pending.pop(0)
+                logger.warning(f"no quota for {spec.key}, {len(pending)} left")
+            return False
+
+        await launch()
+        winner = None
+        try:
+            while running and winner is None:
+                timeout = None
+                if HEDGE and not hedged and pending:
+                    spec, _, started = next(iter(running.values()))
+                    timeout = max(0.0, self.deadline(spec) - (time.monotonic() - started))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # the first provider is past its deadline, ask the next one too
+                    hedged = True
+                    if await launch(hedging=True):
+                        self.hedges += 1
+                    continue
+                for future in done:
+                    spec, stream, started = running.pop(future)
+                    try:
+                        first = future.result()
+                    except StopAsyncIteration:
+                        first = None
+                    except Exception as e:
+                        error = e
+                        self.record_error(spec)
+                        await rate_limits.throttled(spec.name, e)
+                        logger.warning(f"{spec.key} failed, {len(running) + len(pending)} left: {e}")
+                        if not running and pending:
+                            self.failovers += 1
+                            await launch()
+                        continue
+                    self.record(spec, time.monotonic() - started)
+                    winner = (stream, first)
+                    if on_winner is not None:
+                        on_winner(spec)
+                    break
+        finally:
+            # the slower requests are no longer needed
+            for future, (spec, stream, _) in running.items():
+                future.cancel()
+                await asyncio.gather(future, return_exceptions=True)
+                try:
+                    await stream.aclose()
+                except Exception as e:
+                    logger.debug(f"closing {spec.key}: {e}")
+
+        if winner is None:
+            raise error or RuntimeError("no provider available")
+        stream, first = winner
+        if first is None:
+            return
+        try:
+            yield first
+            async for item in stream:
+                yield item
+        finally:
+            await stream.aclose()
+
+    def _load(self):
+        if not self.stats_path:
+            return
+        try:
+            with open(self.stats_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, samples in snapshot.items():
+            self.stats[key] = RollingStats([tuple(s) for s in samples])
+
+    def save(self):
+        """Merge this process' samples into the host's snapshot for the next jobs"""
+        if not self.stats_path:
+            return
+        merged = {key: list(stats.samples) for key, stats in self.stats.items()}
+        # jobs ending together would otherwise drop each other's samples
+        lock_fd = os.open(f"{self.stats_path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                with open(self.stats_path) as f:
+                    for key, samples in json.load(f).items():
+                        both = {*map(tuple, samples), *map(tuple, merged.get(key, []))}
+                        merged[key] = sorted(both, key=lambda sample: sample[0])[-WINDOW:]
+            except (OSError, ValueError):
+                pass
+            tmp = f"{self.stats_path}.{os.getpid()}"
+            with open(tmp, "w") as f:
+                json.dump(merged, f)
+            os.replace(tmp, self.stats_path)
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "providers": {key: stats.summary() for key, stats in self.stats.items()},
+        }
+
+
+_router: ProviderRouter | None = None
+
+
+def get_router() -> ProviderRouter:
+    global _router
+    if _router is None:
+        _router = ProviderRouter()
+    return _router
+
+
+class _TextTee:
+    """Lets a second TTS request read the same LLM text stream from the start"""
+
+    def __init__(self, source: AsyncIterable[str]):
+        self._chunks: list[str] = []
+        self._done = False
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterable[str]):
+        try:
+            async for chunk in source:
+                self._chunks.append(chunk)
+                self._notify()
+        finally:
+            self._done = True
+            self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def started(self) -> bool:
+        """Waits for the first text; False if there is none"""
+        while not self._chunks and not self._done:
+            await self._changed.wait()
+        return bool(self._chunks)
+
+    async def read(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            while i < len(self._chunks):
+                yield self._chunks[i]
+                i += 1
+            if self._done:
+                return
+            await self._changed.wait()
+
+    async def aclose(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+class CallProviders:
+    """The providers of one call, in the router's order"""
+
+    def __init__(
+        self,
+        router: ProviderRouter,
+        instances: dict[str, list[tuple[ProviderSpec, Any]]],
+        vad=None,
+        settings: dict[str, Any] | None = None,
+    ):
+        self.router = router
+        self.settings = settings or {}
+        self.llms = instances["llm"]
+        self.ttss = instances["tts"]
+        self.stt_specs = instances["stt"]
+        self.stt = self._adapter("stt", lk_stt.FallbackAdapter, instances["stt"], vad=vad)
+        self.llm = self._adapter("llm", lk_llm.FallbackAdapter, self.llms)
+        self.tts = self._adapter("tts", lk_tts.FallbackAdapter, self.ttss)
+
+    def _adapter(self, slot: str, adapter, instances: list[tuple[ProviderSpec, Any]], **kwargs):
+        # the session's own component, used for the greeting, the TTS cache and
+        # anything that doesn't go through the nodes below
+        if len(instances) == 1:
+            return instances[0][1]
+        specs = {id(instance): spec for spec, instance in instances}
+        component = adapter([instance for _, instance in instances], **kwargs)
+
+        @component.on(f"{slot}_availability_changed")
+        def on_availability(ev):
+            spec = specs.get(id(getattr(ev, slot)))
+            if spec is not None and not ev.available:
+                self.router.record_error(spec)
+                logger.warning(f"{spec.key} unavailable, failing over")
+
+        return component
+
+    def components(self) -> dict[str, Any]:
+        """AgentSession kwargs"""
+        return {"stt": self.stt, "llm": self.llm, "tts": self.tts}
+
+    async def llm_node(self, chat_ctx: lk_llm.ChatContext, tools: list, tool_choice) -> AsyncIterator[Any]:
+        conn_options = FAILOVER_CONN_OPTIONS if len(self.llms) > 1 else APIConnectOptions()
+
+        async def open_stream(spec: ProviderSpec, instance):
+            async with instance.chat(
+                chat_ctx=chat_ctx, tools=tools, tool_choice=tool_choice, conn_options=conn_options
+            ) as stream:
+                async for chunk in stream:
+                    yield chunk
+
+        async for chunk in self.router.hedge(self.llms, open_stream):
+            yield chunk
+
+    def tts_voice(self, spec: ProviderSpec | None = None) -> str:
+        """The voice of a TTS provider, the first one by default"""
+        return tts_voice(spec or self.ttss[0][0], self.settings)
+
+    async def tts_node(
+        self, text: AsyncIterable[str], on_voice: Callable[[str], None] | None = None
+    ) -> AsyncIterator[rtc.AudioFrame]:
+        """Hedged TTS; `on_voice` gets the voice of the provider that answered"""
+        tee = _TextTee(text)
+
+        def on_winner(spec: ProviderSpec):
+            if on_voice is not None:
+                on_voice(self.tts_voice(spec))
+
+        try:
+            if not await tee.started():
+                return
+            async for frame in self.router.hedge(
+                self.ttss, lambda spec, tts: self._synthesize(spec, tts, tee), on_winner
+            ):
+                yield frame
+        finally:
+            await tee.aclose()
+
+    async def _synthesize(self, spec: ProviderSpec, tts, tee: _TextTee) -> AsyncIterator[rtc.AudioFrame]:
+        conn_options = FAILOVER_CONN_OPTIONS if len(self.ttss) > 1 else APIConnectOptions()
+        if not tts.capabilities.streaming:
+            from livekit.agents import tokenize
+
+            tts = lk_tts.StreamAdapter(tts=tts, sentence_tokenizer=tokenize.basic.SentenceTokenizer())
+        stream = tts.stream(conn_options=conn_options)
+
+        async def feed():
+            async for chunk in tee.read():
+                stream.push_text(chunk)
+            stream.end_input()
+
+        feeder = asyncio.create_task(feed())
+        # providers differ in sample rate, play everything at the session's
+        resampler = None
+        try:
+            async for ev in stream:
+                frame = ev.frame
+                if frame.sample_rate == self.tts.sample_rate:
+                    yield frame
+                    continue
+                if resampler is None:
+                    resampler = rtc.AudioResampler(frame.sample_rate, self.tts.sample_rate, num_channels=frame.num_channels)
+                for out in resampler.push(frame):
+                    yield out
+            if resampler is not None:
+                for out in resampler.flush():
+                    yield out
+        finally:
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+            await stream.aclose()
+
+    async def acquire(self, slot: str):
+        """Wait for the rate limit of the slot's first provider, for requests made
+        through the session's own components"""
+        specs = {"stt": self.stt_specs, "llm": self.llms, "tts": self.ttss}[slot]
+        await rate_limits.acquire(specs[0][0].name)
+
+    async def log_summary(self):
+        """Shutdown callback: provider health for the dashboard, and save it for the next jobs"""
+        stats = {**self.router.get_stats(), "rate_limit_waits": rate_limits.waited()}
+        logger.info(
+            f"providers: {self.router.hedges} hedged, {self.router.failovers} failed over",
+            extra={"event": "providers", "data": stats},
+        )
+        await asyncio.to_thread(self.router.save)
+
+
+def for_call(settings: dict[str, Any], vad=None) -> CallProviders:
+    """Create the configured providers for a call, best first.
+
+    `settings` carries what the plugins need from the agent (TTS voice and model).
+    """
+    router = get_router()
+    instances: dict[str, list[tuple[ProviderSpec, Any]]] = {}
+    for slot, value in PROVIDERS.items():
+        instances[slot] = []
+        for spec in router.order(parse_specs(slot, value)):
+            try:
+                instances[slot].append((spec, _create(spec, settings)))
+            except Exception as e:
+                logger.error(f"can't use {spec.key}: {e}")
+        if not instances[slot]:
+            raise RuntimeError(f"no usable {slot} provider in {value!r}")
+    return CallProviders(router, instances, vad=vad, settings=settings)
+
+
+class _FakeLLM:
+    """Answers after an injected delay; sometimes slow, sometimes failing"""
+
+    def __init__(self, name: str, latency: float, slow: float, fail: float, rng: random.Random):
+        self.name, self.latency, self.slow, self.fail, self.rng = name, latency, slow, fail, rng
+
+    async def chat(self):
+        delay = self.latency * (5 if self.rng.random() < self.slow else self.rng.uniform(0.8, 1.2))
+        await asyncio.sleep(delay)
+        if self.rng.random() < self.fail:
+            raise ConnectionError(f"{self.name} returned 503")
+        for token in ("hello", " there"):
+            yield token
+
+
+async def _simulate(
+    requests: int, concurrency: int, latency: float, slow: float, fail: float, seed: int
+) -> dict[str, Any]:
+    global HEDGE
+    report = {}
+    for hedge in (False, True):
+        HEDGE = hedge
+        # the same delays and failures for both runs
+        rng = random.Random(seed)
+        router = ProviderRouter(stats_path=None)
+        providers = [
+            (ProviderSpec("llm", "primary"), _FakeLLM("primary", latency, slow, fail, rng)),
+            (ProviderSpec("llm", "secondary"), _FakeLLM("secondary", latency * 1.3, slow, fail, rng)),
+        ]
+        ttfts, errors = [], 0
+        slots = asyncio.Semaphore(concurrency)
+
+        async def request():
+            nonlocal errors
+            async with slots:
+                order = router.order([spec for spec, _ in providers])
+                candidates = sorted(providers, key=lambda p: order.index(p[0]))
+                started = time.monotonic()
+                try:
+                    async with contextlib.aclosing(router.hedge(candidates, lambda spec, fake: fake.chat())) as stream:
+                        async for _ in stream:
+                            ttfts.append(time.monotonic() - started)
+                            break
+                except ConnectionError:
+                    errors += 1
+
+        await asyncio.gather(*(request() for _ in range(requests)))
+        report["hedged" if hedge else "failover_only"] = {
+            "p50": percentile(ttfts, 0.5),
+            "p95": percentile(ttfts, 0.95),
+            "p99": percentile(ttfts, 0.99),
+            "failed_requests": errors,
+            **router.get_stats(),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    simulate = commands.add_parser("simulate", help="hedging and failover against fake LLMs")
+    simulate.add_argument("--requests", type=int, default=500)
+    simulate.add_argument("--concurrency", type=int, default=20, help="requests in flight, like calls on a worker")
+    simulate.add_argument("--latency", type=float, default=0.05, help="primary's usual first-token seconds")
+    simulate.add_argument("--slow", type=float, default=0.03, help="share of requests 5x slower")
+    simulate.add_argument("--fail", type=float, default=0.05, help="share of requests that fail")
+    simulate.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    # failovers are expected here, keep the report readable
+    logger.setLevel(logging.ERROR)
+    print(json.dumps(asyncio.run(_simulate(args.requests, args.concurrency, args.latency, args.slow, args.fail, args.seed)), indent=2))
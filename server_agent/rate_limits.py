@@ -0,0 +1,357 @@
+"""Provider rate limits shared by every job process on a host.
+
+Each provider with a limit in PROVIDER_RATE_LIMITS gets a token bucket in a
+small file under RATE_LIMIT_DIR (shared memory on Linux), updated under an
+flock, so all calls on the host draw from one budget:
+
+    PROVIDER_RATE_LIMITS=assemblyai=2,google=10:30,elevenlabs=5
+
+is 2 STT stream opens, 10 LLM requests (bursts of 30) and 5 TTS requests per
+second. Calls wait for a token before opening an STT stream, sending an LLM
+request or synthesizing speech, instead of being throttled by the provider
+mid-call. They don't block their event loop on the flock: when another process
+holds it they sleep briefly and try again.
+
+Calls that have been answered may use the whole bucket. Work for calls that
+haven't (session start, greeting synthesis) leaves RATE_LIMIT_RESERVE of it
+untouched. When a bucket runs low, jobs log a "quota" event, and the API
+(Admission) spaces out new dispatches until it recovers.
+
+    python rate_limits.py stats
+    python rate_limits.py simulate --processes 8 --rate 20
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import tempfile
+import time
+from typing import Any
+
+logger = logging.getLogger("outbound-caller")
+
+# name=requests per second[:burst], comma separated; providers not listed aren't limited
+PROVIDER_RATE_LIMITS = os.getenv("PROVIDER_RATE_LIMITS", "")
+# burst when not given, in seconds of the rate
+BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "2"))
+# share of each bucket only answered calls may use
+RESERVE = float(os.getenv("RATE_LIMIT_RESERVE", "0.25"))
+# below this share left, jobs report it and the API slows down dispatches
+LOW_QUOTA = float(os.getenv("LOW_QUOTA_LEVEL", "0.5"))
+# seconds between dispatches when a bucket is empty, less when it's just low
+ADMISSION_MAX_INTERVAL = float(os.getenv("ADMISSION_MAX_INTERVAL", "5"))
+# quota reports older than this are ignored by the API
+QUOTA_REPORT_TTL = 5.0
+REPORT_INTERVAL = 1.0
+# host-wide, unlike worker_load's per-worker directory: provider quotas are per API key
+RATE_LIMIT_DIR = os.getenv(
+    "RATE_LIMIT_DIR",
+    os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        "outbound-caller-rate-limits",
+    ),
+)
+
+# tokens, last refill (unix time), granted, seconds waited, 429s seen
+_RECORD = struct.Struct("ddQdQ")
+# backoff while another process holds a bucket's lock
+LOCK_RETRY_DELAY = 0.0005
+MAX_LOCK_RETRY_DELAY = 0.01
+# what Bucket._update returns instead of waiting for the lock
+_BUSY = object()
+
+
+def parse_limits(value: str) -> dict[str, tuple[float, float]]:
+    """"google=10:30,elevenlabs=5" -> {name: (rate, burst)}"""
+    limits = {}
+    for item in value.split(","):
+        name, _, limit = item.strip().partition("=")
+        if not name or not limit:
+            continue
+        rate, _, burst = limit.partition(":")
+        limits[name] = (float(rate), float(burst) if burst else max(1.0, float(rate) * BURST_SECONDS))
+    return limits
+
+
+LIMITS = parse_limits(PROVIDER_RATE_LIMITS)
+
+
+class Bucket:
+    """One provider's token bucket, shared through a file"""
+
+    def __init__(self, name: str, rate: float, burst: float, directory: str | None = None):
+        self.name, self.rate, self.burst = name, rate, burst
+        directory = directory or RATE_LIMIT_DIR
+        os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(os.path.join(directory, name), os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _update(self, change, blocking: bool = True) -> Any:
+        """Runs change(state) -> result on the refilled state, under the lock.
+
+        Not `blocking`, returns _BUSY right away if another process holds it.
+        """
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return _BUSY
+        try:
+            now = time.time()
+            data = os.pread(self._fd, _RECORD.size, 0)
+            if len(data) == _RECORD.size:
+                state = list(_RECORD.unpack(data))
+                state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            else:
+                state = [self.burst, now, 0, 0.0, 0]
+            state[1] = now
+            result = change(state)
+            os.pwrite(self._fd, _RECORD.pack(*state), 0)
+            return result
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    async def _update_async(self, change) -> Any:
+        """_update for the event loop: retries with a sleep instead of blocking on the lock"""
+        delay = LOCK_RETRY_DELAY
+        while (result := self._update(change, blocking=False)) is _BUSY:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_LOCK_RETRY_DELAY)
+        return result
+
+    async def take(self, answered: bool) -> tuple[float, float]:
+        """(seconds to wait before trying again or 0 if a token was taken, share left)"""
+        # a burst too small to keep any back still lets one request through
+        keep = 0.0 if answered else max(0.0, min(RESERVE * self.burst, self.burst - 1))
+
+        def change(state):
+            if state[0] - 1 >= keep:
+                state[0] -= 1
+                state[2] += 1
+                return 0.0, state[0] / self.burst
+            return (keep + 1 - state[0]) / self.rate, max(0.0, state[0]) / self.burst
+
+        return await self._update_async(change)
+
+    async def add_wait(self, seconds: float):
+        def change(state):
+            state[3] += seconds
+
+        await self._update_async(change)
+
+    async def drain(self):
+        """The provider throttled us: stop sending until the bucket refills"""
+
+        def change(state):
+            state[0] = 0.0
+            state[4] += 1
+
+        await self._update_async(change)
+
+    def stats(self) -> dict[str, Any]:
+        def change(state):
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "level": state[0] / self.burst,
+                "granted": state[2],
+                "waited_seconds": round(state[3], 3),
+                "throttled": state[4],
+            }
+
+        return self._update(change)
+
+    def close(self):
+        os.close(self._fd)
+
+
+_buckets: dict[str, Bucket] = {}
+# whether this process' call has been answered, see set_answered
+_answered = False
+# seconds this process' call spent waiting, per provider
+_waited: dict[str, float] = {}
+_last_report: dict[str, float] = {}
+
+
+def _bucket(provider: str) -> Bucket | None:
+    if provider not in LIMITS:
+        return None
+    if provider not in _buckets:
+        _buckets[provider] = Bucket(provider, *LIMITS[provider])
+    return _buckets[provider]
+
+
+def set_answered(answered: bool):
+    """Answered calls go before calls still ringing; reset when a job starts"""
+    global _answered
+    _answered = answered
+    if not answered:
+        _waited.clear()
+
+
+async def acquire(provider: str, wait: bool = True) -> bool:
+    """Wait for `provider`'s rate limit before sending it a request.
+
+    Without `wait`, only takes a token if one is free now; returns whether it did.
+    """
+    bucket = _bucket(provider)
+    if bucket is None:
+        return True
+    started = None
+    while True:
+        delay, level = await bucket.take(_answered)
+        if level < LOW_QUOTA or delay:
+            _report(provider, level, waiting=bool(delay) and wait)
+        if not delay:
+            break
+        if not wait:
+            return False
+        started = started or time.monotonic()
+        await asyncio.sleep(delay)
+    if started is not None:
+        waited = time.monotonic() - started
+        _waited[provider] = _waited.get(provider, 0.0) + waited
+        await bucket.add_wait(waited)
+    return True
+
+
+async def throttled(provider: str, error: Exception):
+    """Back off from a provider that answered 429"""
+    bucket = _bucket(provider)
+    if bucket is not None and getattr(error, "status_code", None) == 429:
+        await bucket.drain()
+
+
+def _report(provider: str, level: float, waiting: bool):
+    now = time.monotonic()
+    if now - _last_report.get(provider, 0.0) < REPORT_INTERVAL:
+        return
+    _last_report[provider] = now
+    logger.info(
+        f"{provider} quota low: {level:.0%} left" + (", waiting" if waiting else ""),
+        extra={"event": "quota", "data": {"provider": provider, "level": level, "waiting": waiting}},
+    )
+
+
+def waited() -> dict[str, float]:
+    """Seconds the current call waited on each provider's limit"""
+    return {provider: round(seconds, 3) for provider, seconds in _waited.items()}
+
+
+def get_stats() -> dict[str, Any]:
+    """Usage of every limited provider on this host (blocks on the buckets' locks)"""
+    return {provider: _bucket(provider).stats() for provider in LIMITS}
+
+
+def _reset_after_fork():
+    # flock locks belong to the open file, a child needs its own
+    global _buckets
+    _buckets = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Admission:
+    """API side: spaces out dispatches while jobs report low quota"""
+
+    def __init__(self):
+        # provider -> (share left, monotonic time reported)
+        self._levels: dict[str, tuple[float, float]] = {}
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+        self.delayed = 0
+
+    def observe(self, event: dict[str, Any]):
+        if event.get("event") != "quota" or not event.get("data"):
+            return
+        data = event["data"]
+        level = 0.0 if data.get("waiting") else float(data.get("level", 0.0))
+        self._levels[data["provider"]] = (level, time.monotonic())
+
+    def level(self) -> float:
+        cutoff = time.monotonic() - QUOTA_REPORT_TTL
+        return min((level for level, at in self._levels.values() if at >= cutoff), default=1.0)
+
+    def interval(self) -> float:
+        level = self.level()
+        if level >= LOW_QUOTA:
+            return 0.0
+        return ADMISSION_MAX_INTERVAL * (1 - level / LOW_QUOTA)
+
+    async def wait(self):
+        """Called before each dispatch"""
+        interval = self.interval()
+        if not interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + interval
+        if wait > 0:
+            self.delayed += 1
+            await asyncio.sleep(wait)
+
+    def get_stats(self) -> dict[str, Any]:
+        return {"level": self.level(), "interval": self.interval(), "delayed": self.delayed}
+
+
+def _simulate_worker(answered: bool, requests: int, results):
+    async def run():
+        set_answered(answered)
+        for _ in range(requests):
+            await acquire("simulated")
+        results.put((answered, time.time()))
+
+    asyncio.run(run())
+
+
+def _simulate(processes: int, rate: float, requests: int) -> dict[str, Any]:
+    global LIMITS, RATE_LIMIT_DIR
+    # forked workers inherit these
+    LIMITS = {"simulated": (rate, max(1.0, rate * BURST_SECONDS))}
+    RATE_LIMIT_DIR = tempfile.mkdtemp()
+    results = multiprocessing.get_context("fork").Queue()
+    started = time.time()
+    workers = [
+        multiprocessing.get_context("fork").Process(target=_simulate_worker, args=(i % 2 == 0, requests, results))
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    finished = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - started
+
+    def done_after(answered: bool) -> float:
+        return max((at - started for a, at in finished if a == answered), default=0.0)
+
+    return {
+        "requests_per_second": processes * requests / elapsed,
+        "limit": rate,
+        # seconds until every process of the kind got its tokens
+        "answered_done_after": done_after(True),
+        "ringing_done_after": done_after(False),
+        **Bucket("simulated", *LIMITS["simulated"]).stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="usage of the limited providers on this host")
+    simulate = commands.add_parser("simulate", help="processes sharing one bucket, half of them answered calls")
+    simulate.add_argument("--processes", type=int, default=8)
+    simulate.add_argument("--rate", type=float, default=20)
+    simulate.add_argument("--requests", type=int, default=50, help="per process")
+    args = parser.parse_args()
+    logger.setLevel(logging.ERROR)
+    if args.command == "stats":
+        print(json.dumps(get_stats(), indent=2))
+    else:
+        print(json.dumps(_simulate(args.processes, args.rate, args.requests), indent=2))
@@ -0,0 +1,504 @@
+"""Per-call audio recording, encoded off the agent's event loop.
+
+The event loop only appends each received frame to a deque. A drain thread
+joins the frames once a second and sends the PCM to the host's encoder
+service, which writes WAV segments (`<room>/<track>-0001.wav`, ...); a segment
+is written as `.part` and renamed once it is complete. The callee and the
+agent are recorded as separate tracks.
+
+There is one encoder process per host, shared by every job, listening on
+RECORDING_ENCODER_SOCKET. The first job that can't reach it starts it
+(`python recorder.py serve`); it keeps running after that job ends. It also
+deletes old recordings, at most once per RECORDING_SWEEP_INTERVAL.
+
+Measure the CPU it adds per concurrent call, encoder startup included:
+
+    python recorder.py bench --calls 20 --seconds 60
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("outbound-caller")
+
+RECORD_CALLS = os.getenv("RECORD_CALLS", "0") == "1"
+RECORDINGS_DIR = os.getenv("RECORDINGS_DIR", "recordings")
+SAMPLE_RATE = int(os.getenv("RECORDING_SAMPLE_RATE", "16000"))
+SEGMENT_SECONDS = float(os.getenv("RECORDING_SEGMENT_SECONDS", "300"))
+RETENTION_DAYS = float(os.getenv("RECORDING_RETENTION_DAYS", "30"))
+SWEEP_INTERVAL = float(os.getenv("RECORDING_SWEEP_INTERVAL", "3600"))
+ENCODER_SOCKET = os.getenv("RECORDING_ENCODER_SOCKET", "/tmp/outbound-caller-recorder.sock")
+ENCODER_START_TIMEOUT = 10.0
+FLUSH_INTERVAL = 1.0
+
+_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+# a chunk sent to the encoder: path length, PCM length, sample rate, finalize; then the path and PCM
+_CHUNK = struct.Struct("<HIIB")
+# the encoder's answer to each chunk: 1 if it was written
+_ACK = struct.Struct("<B")
+
+
+def _wav_header(sample_rate: int, data_size: int) -> bytes:
+    # 16-bit mono PCM
+    return _HEADER.pack(
+        b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, 1,
+        sample_rate, sample_rate * 2, 2, 16, b"data", data_size,
+    )
+
+
+def write_chunk(path: str, pcm: bytes, sample_rate: int, finalize: bool) -> int:
+    """Append PCM to a segment (encoder side); `finalize` fixes the header and publishes it"""
+    part = path + ".part"
+    if pcm or os.path.exists(part):
+        with open(part, "ab") as f:
+            if f.tell() == 0:
+                # sizes are filled in when the segment is finalized
+                f.write(_wav_header(sample_rate, 0))
+            f.write(pcm)
+    if finalize and os.path.exists(part):
+        with open(part, "r+b") as f:
+            f.write(_wav_header(sample_rate, os.path.getsize(part) - _HEADER.size))
+        os.replace(part, path)
+    return len(pcm)
+
+
+def sweep(root: str = RECORDINGS_DIR, retention_days: float = RETENTION_DAYS) -> int:
+    """Delete the calls whose newest file is older than the retention period"""
+    cutoff = time.time() - retention_days * 86400
+    removed = 0
+    if not os.path.isdir(root):
+        return 0
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        newest = max(
+            (f.stat().st_mtime for f in os.scandir(entry.path) if f.is_file()),
+            default=entry.stat().st_mtime,
+        )
+        if newest < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def sweep_if_due(
+    root: str = RECORDINGS_DIR,
+    retention_days: float = RETENTION_DAYS,
+    interval: float = SWEEP_INTERVAL,
+) -> int:
+    """sweep(), unless a process on this host already ran it within `interval`"""
+    os.makedirs(root, exist_ok=True)
+    marker = os.path.join(root, ".last_sweep")
+    try:
+        if time.time() - os.path.getmtime(marker) < interval:
+            return 0
+    except FileNotFoundError:
+        pass
+    with open(marker, "w"):
+        pass
+    removed = sweep(root, retention_days)
+    if removed:
+        logger.info(f"deleted {removed} recordings older than {retention_days:g} days")
+    return removed
+
+
+class _EncoderHandler(socketserver.StreamRequestHandler):
+    """One job's connection; its chunks are written in the order they arrive"""
+
+    def handle(self):
+        while header := self.rfile.read(_CHUNK.size):
+            if len(header) < _CHUNK.size:
+                return
+            path_len, pcm_len, sample_rate, finalize = _CHUNK.unpack(header)
+            path = self.rfile.read(path_len).decode()
+            pcm = self.rfile.read(pcm_len)
+            try:
+                write_chunk(path, pcm, sample_rate, bool(finalize))
+                written = 1
+            except OSError as e:
+                logger.error(f"failed to write recording chunk to {path}: {e}")
+                written = 0
+            self.wfile.write(_ACK.pack(written))
+
+
+class _EncoderServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _sweep_forever(root: str):
+    while True:
+        try:
+            sweep_if_due(root)
+        except OSError as e:
+            logger.error(f"recording sweep failed: {e}")
+        time.sleep(SWEEP_INTERVAL)
+
+
+def serve(path: str | None = None):
+    """Run the host's encoder service, unless another process already does"""
+    path = path or ENCODER_SOCKET
+    lock_fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        # started by another job at the same time
+        os.close(lock_fd)
+        return
+    # holding the lock, so a socket file left here belongs to a dead service
+    if os.path.exists(path):
+        os.unlink(path)
+    threading.Thread(
+        target=_sweep_forever, args=(os.path.abspath(RECORDINGS_DIR),), name="recording-sweep", daemon=True
+    ).start()
+    with _EncoderServer(path, _EncoderHandler) as server:
+        logger.info(f"recording encoder listening on {path}")
+        server.serve_forever()
+
+
+_service: subprocess.Popen | None = None
+_service_lock = threading.Lock()
+
+
+def _start_service():
+    global _service
+    with _service_lock:
+        if _service is not None and _service.poll() is None:
+            # started by another of this process's calls, still binding the socket
+            return
+        # its own session, so it outlives the job that started it; a second one
+        # started by another job at the same time exits, see serve()
+        _service = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", "--socket", ENCODER_SOCKET],
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+
+def connect(timeout: float = ENCODER_START_TIMEOUT) -> socket.socket:
+    """A connection to the host's encoder service, starting it if it isn't running"""
+    deadline = time.monotonic() + timeout
+    started = False
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(ENCODER_SOCKET)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+        if not started:
+            _start_service()
+            started = True
+        if time.monotonic() > deadline:
+            raise ConnectionError(f"recording encoder on {ENCODER_SOCKET} didn't start")
+        time.sleep(0.05)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("recording encoder closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+def prewarm():
+    """Make sure the host's encoder is running before any call"""
+    connect().close()
+
+
+class _Track:
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        # appended on the event loop, drained by the recorder thread
+        self.frames: deque = deque()
+        self.segment = 1
+        self.segment_bytes = 0
+        self.bytes = 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.name}-{self.segment:04d}.wav")
+
+
+class CallRecorder:
+    """Records a call's tracks to RECORDINGS_DIR/<room>/"""
+
+    def __init__(self, room: str, *, root: str = RECORDINGS_DIR, sample_rate: int = SAMPLE_RATE):
+        self.directory = os.path.join(root, room)
+        self.sample_rate = sample_rate
+        self._tracks: dict[str, _Track] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # the drain thread's connection to the encoder
+        self._sock: socket.socket | None = None
+        self._segment_bytes = int(SEGMENT_SECONDS * sample_rate) * 2
+        self.frames = 0
+
+    def track(self, name: str) -> _Track:
+        if name not in self._tracks:
+            self._tracks[name] = _Track(self.directory, name)
+        return self._tracks[name]
+
+    def push(self, track: _Track, frame):
+        """The only work done on the event loop: keep a reference to the frame"""
+        track.frames.append(frame)
+        self.frames += 1
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="call-recorder", daemon=True)
+        self._thread.start()
+
+    def record_participant(self, participant, name: str = "callee"):
+        from livekit import rtc
+
+        stream = rtc.AudioStream.from_participant(
+            participant=participant,
+            track_source=rtc.TrackSource.SOURCE_MICROPHONE,
+            sample_rate=self.sample_rate,
+            num_channels=1,
+        )
+        self._tasks.append(asyncio.create_task(self._read(stream, self.track(name))))
+
+    def record_track(self, track, name: str = "agent"):
+        from livekit import rtc
+
+        stream = rtc.AudioStream.from_track(
+            track=track, sample_rate=self.sample_rate, num_channels=1
+        )
+        self._tasks.append(asyncio.create_task(self._read(stream, self.track(name))))
+
+    def record_agent(self, room, name: str = "agent"):
+        """Record the agent's own audio, once the session has published it"""
+        self._tasks.append(asyncio.create_task(self._wait_for_agent_track(room, name)))
+
+    async def _wait_for_agent_track(self, room, name: str):
+        from livekit import rtc
+
+        published = asyncio.get_running_loop().create_future()
+
+        def on_published(publication, track):
+            if track.kind == rtc.TrackKind.KIND_AUDIO and not published.done():
+                published.set_result(track)
+
+        room.on("local_track_published", on_published)
+        try:
+            for publication in room.local_participant.track_publications.values():
+                if publication.track is not None and publication.kind == rtc.TrackKind.KIND_AUDIO:
+                    on_published(publication, publication.track)
+            self.record_track(await published, name)
+        finally:
+            room.off("local_track_published", on_published)
+
+    async def _read(self, stream, track: _Track):
+        try:
+            async for ev in stream:
+                self.push(track, ev.frame)
+        finally:
+            await stream.aclose()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(FLUSH_INTERVAL):
+                self._drain(finalize=False)
+            self._drain(finalize=True)
+        finally:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    def _drain(self, finalize: bool):
+        chunks: list[bytes] = []
+        for track in list(self._tracks.values()):
+            chunk = []
+            while track.frames:
+                chunk.append(bytes(track.frames.popleft().data))
+            pcm = b"".join(chunk)
+            track.bytes += len(pcm)
+            path = os.path.abspath(track.path).encode()
+            # split at segment boundaries, so every segment but the last is full length
+            while pcm or finalize:
+                room = self._segment_bytes - track.segment_bytes
+                part, pcm = pcm[:room], pcm[room:]
+                full = len(part) == room
+                last = full or (finalize and not pcm)
+                chunks.append(_CHUNK.pack(len(path), len(part), self.sample_rate, last) + path + part)
+                track.segment_bytes += len(part)
+                if full:
+                    track.segment += 1
+                    track.segment_bytes = 0
+                if not pcm:
+                    break
+        if not chunks:
+            return
+        try:
+            if self._sock is None:
+                self._sock = connect()
+            self._sock.sendall(b"".join(chunks))
+            # a track's chunks must land in order, so wait before taking the next ones
+            acks = _recv_exact(self._sock, _ACK.size * len(chunks))
+        except OSError as e:
+            # the encoder died; drop these chunks, the next drain starts a new one
+            logger.error(f"recording encoder unavailable, dropped {len(chunks)} chunks: {e}")
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+            return
+        failed = len(chunks) - sum(acks)
+        if failed:
+            logger.error(f"failed to write {failed} recording chunks")
+
+    async def aclose(self):
+        """Stop reading and write out the last segments (shutdown callback)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._thread is not None:
+            self._stop.set()
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+        seconds = {name: t.bytes / 2 / self.sample_rate for name, t in self._tracks.items()}
+        logger.info(
+            f"recorded {', '.join(f'{n} {s:.0f}s' for n, s in seconds.items()) or 'nothing'}"
+            f" to {self.directory}",
+            extra={"event": "recording", "data": {"directory": self.directory, "seconds": seconds}},
+        )
+
+
+class _Frame:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+
+
+async def _bench_call(root: str, index: int, seconds: float, speed: float, record: bool) -> int:
+    # 20ms of a quiet tone, one frame per track
+    frame_bytes = SAMPLE_RATE // 50 * 2
+    payload = bytes(range(256)) * (frame_bytes // 256) + bytes(frame_bytes % 256)
+    recorder = CallRecorder(f"bench-{index}", root=root)
+    tracks = [recorder.track("callee"), recorder.track("agent")]
+    if record:
+        recorder.start()
+    frames = int(seconds * 50)
+    for i in range(frames):
+        for track in tracks:
+            frame = _Frame(payload)
+            if record:
+                recorder.push(track, frame)
+        if speed and i % 50 == 49:
+            await asyncio.sleep(1 / speed)
+    if record:
+        await recorder.aclose()
+    return frames * len(tracks)
+
+
+def _children_cpu() -> float:
+    # the encoder service, when this process started it
+    import psutil
+
+    total = 0.0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            times = child.cpu_times()
+        except psutil.NoSuchProcess:
+            continue
+        total += times.user + times.system
+    return total
+
+
+async def _bench_run(root: str, calls: int, seconds: float, speed: float, record: bool) -> dict:
+    cpu, wall, children = time.process_time(), time.perf_counter(), _children_cpu()
+    await asyncio.gather(*(_bench_call(root, i, seconds, speed, record) for i in range(calls)))
+    return {
+        "process_cpu": time.process_time() - cpu,
+        "encoder_cpu": _children_cpu() - children,
+        "wall": time.perf_counter() - wall,
+    }
+
+
+def bench(calls: int, seconds: float, speed: float) -> dict:
+    """CPU added by recording `calls` concurrent calls of `seconds` audio each"""
+    import tempfile
+
+    global ENCODER_SOCKET, _service
+    root = tempfile.mkdtemp(prefix="recorder-bench-")
+    # a fresh encoder started by this process, so its startup and CPU are counted
+    ENCODER_SOCKET = os.path.join(root, "encoder.sock")
+    try:
+        # the same loop without recording, so only the recorder's cost is counted
+        baseline = asyncio.run(_bench_run(root, calls, seconds, speed, record=False))
+        started, startup_cpu = time.perf_counter(), _children_cpu()
+        prewarm()
+        startup = {"seconds": time.perf_counter() - started, "cpu_seconds": _children_cpu() - startup_cpu}
+        run = asyncio.run(_bench_run(root, calls, seconds, speed, record=True))
+        written = sum(
+            os.path.getsize(os.path.join(d, f))
+            for d, _, files in os.walk(root)
+            for f in files
+            if f.endswith(".wav")
+        )
+    finally:
+        if _service is not None:
+            _service.terminate()
+            _service.wait()
+            _service = None
+        shutil.rmtree(root, ignore_errors=True)
+
+    in_process = max(0.0, run["process_cpu"] - baseline["process_cpu"])
+    encoder_cpu = run["encoder_cpu"]
+    audio_seconds = calls * seconds
+    return {
+        "calls": calls,
+        "seconds_per_call": seconds,
+        "wall_seconds": run["wall"],
+        "bytes_written": written,
+        # one encoder for the host however many calls there are, none per call
+        "encoder_processes": 1,
+        "encoder_startup": startup,
+        # share of one core each concurrent call adds, as if the audio ran in real time
+        "cpu_percent_per_call": {
+            "in_process": 100 * in_process / audio_seconds,
+            "encoder": 100 * encoder_cpu / audio_seconds,
+            "total": 100 * (in_process + encoder_cpu) / audio_seconds,
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="CPU added per concurrent recorded call")
+    bench_parser.add_argument("--calls", type=int, default=20)
+    bench_parser.add_argument("--seconds", type=float, default=60)
+    bench_parser.add_argument(
+        "--speed", type=float, default=0, help="audio seconds per wall second, 0 = as fast as possible"
+    )
+    commands.add_parser("sweep", help="delete recordings past RECORDING_RETENTION_DAYS now")
+    serve_parser = commands.add_parser("serve", help="run the host's encoder (started by the first job that needs it)")
+    serve_parser.add_argument("--socket", default=ENCODER_SOCKET)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        print(json.dumps(bench(args.calls, args.seconds, args.speed), indent=2))
+    elif args.command == "serve":
+        logging.basicConfig(level=logging.INFO)
+        serve(args.socket)
+    else:
+        print(f"deleted {sweep()} recordings")
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import aiohttp
+
+from campaigns import DispatchFnc, RateLimiter
+
+logger = logging.getLogger("outbound-caller")
+
+REDIAL_DB = os.getenv("REDIAL_DB", "redial.db")
+# the API's base URL. When set, agents report failed dials to its POST /redials;
+# otherwise they write them to REDIAL_DB themselves (agents on the API's host)
+REDIAL_API_URL = os.getenv("REDIAL_API_URL", "")
+REPORT_ATTEMPTS = 4
+
+
+def _parse_window_time(value: str) -> datetime.time:
+    """"9" or "20:30"; "24" is the end of the day"""
+    hour, _, minute = value.strip().partition(":")
+    if int(hour) >= 24:
+        return datetime.time.max
+    return datetime.time(int(hour), int(minute or 0))
+
+
+# recipients' local times we may call in ("9-20", "8:30-19:45"), and the timezone when a call has none
+CALL_WINDOW = tuple(_parse_window_time(t) for t in os.getenv("CALL_WINDOW", "9-20").split("-"))
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "UTC")
+# retries dispatched per second on each trunk, on top of regular traffic
+REDIAL_CALLS_PER_SECOND = float(os.getenv("REDIAL_CALLS_PER_SECOND", "1"))
+POLL_INTERVAL = 1.0
+BATCH_SIZE = 50
+# a claim older than this was left behind by a worker that died mid-dispatch
+STALE_CLAIM = 60.0
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    delay: float  # seconds before the first retry
+    factor: float  # delay multiplier for each later retry
+    max_attempts: int  # including the first call
+
+
+_BUSY = RetryPolicy(delay=300, factor=2, max_attempts=3)
+_NO_ANSWER = RetryPolicy(delay=1800, factor=2, max_attempts=3)
+_CONGESTION = RetryPolicy(delay=30, factor=2, max_attempts=5)
+
+# SIP status code -> policy; anything else (declined, bad number, ...) isn't retried
+RETRY_POLICIES: dict[int, RetryPolicy] = {
+    486: _BUSY,  # Busy Here
+    600: _BUSY,  # Busy Everywhere
+    408: _NO_ANSWER,  # Request Timeout
+    480: _NO_ANSWER,  # Temporarily Unavailable
+    487: _NO_ANSWER,  # Request Terminated (rang out)
+    500: _CONGESTION,
+    502: _CONGESTION,
+    503: _CONGESTION,  # Service Unavailable, trunk congestion
+    504: _CONGESTION,
+}
+
+_RETRY_SUFFIX = re.compile(r"-retry\d+$")
+
+
+def _zone(name: str | None) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def into_call_window(ts: float, timezone: str | None) -> float:
+    """The first time at or after `ts` inside the recipient's calling window"""
+    start, end = CALL_WINDOW
+    local = datetime.datetime.fromtimestamp(ts, _zone(timezone))
+    if local.time() < start:
+        local = datetime.datetime.combine(local.date(), start, local.tzinfo)
+    elif local.time() >= end:
+        local = datetime.datetime.combine(local.date() + datetime.timedelta(days=1), start, local.tzinfo)
+    return local.timestamp()
+
+
+def next_attempt_at(failed_at: float, attempt: int, policy: RetryPolicy, timezone: str | None) -> float:
+    """Backoff for the given attempt (1 = first call), with jitter so retries don't bunch up"""
+    delay = policy.delay * policy.factor ** (attempt - 1)
+    delay *= random.uniform(0.9, 1.1)
+    return into_call_window(failed_at + delay, timezone)
+
+
+class RedialQueue:
+    """Failed calls waiting to be redialed, in SQLite so they survive restarts.
+
+    Rows are keyed by the failed call's room, so the same failure delivered to
+    every API worker is only queued once. Workers claim due rows with a
+    conditional update, so each retry is dispatched by exactly one of them.
+    """
+
+    def __init__(self, path: str | None = None):
+        self._conn = sqlite3.connect(path or REDIAL_DB, timeout=5, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS redials (
+                    room TEXT PRIMARY KEY,
+                    phone_number TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    sip_status INTEGER NOT NULL,
+                    attempt INTEGER NOT NULL,
+                    due_at REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    claimed_at REAL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS redials_due ON redials (status, due_at)"
+            )
+
+    def enqueue(self, room: str, fields: dict[str, Any], sip_status: int) -> float | None:
+        """Queue a retry for a failed call; returns when it's due, or None if it won't be retried"""
+        policy = RETRY_POLICIES.get(sip_status)
+        attempt = int(fields.get("attempt") or 1)
+        if policy is None or attempt >= policy.max_attempts:
+            return None
+        due_at = next_attempt_at(time.time(), attempt, policy, fields.get("timezone"))
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR IGNORE INTO redials (room, phone_number, fields, sip_status, attempt, due_at)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (room, fields["phone_number"], json.dumps(fields), sip_status, attempt, due_at),
+            )
+        return due_at
+
+    def claim_due(self, limit: int = BATCH_SIZE) -> list[tuple[str, dict[str, Any]]]:
+        now = time.time()
+        claimed = []
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT room, fields FROM redials
+                WHERE (status = 'pending' AND due_at <= ?) OR (status = 'dispatching' AND claimed_at < ?)
+                ORDER BY due_at LIMIT ?""",
+                (now, now - STALE_CLAIM, limit),
+            ).fetchall()
+            for room, fields in rows:
+                cur = self._conn.execute(
+                    """UPDATE redials SET status = 'dispatching', claimed_at = ?
+                    WHERE room = ? AND (status = 'pending' OR (status = 'dispatching' AND claimed_at < ?))""",
+                    (now, room, now - STALE_CLAIM),
+                )
+                if cur.rowcount:
+                    claimed.append((room, json.loads(fields)))
+        return claimed
+
+    def finish(self, room: str, status: str):
+        with self._lock:
+            self._conn.execute("UPDATE redials SET status = ? WHERE room = ?", (status, room))
+
+    def postpone(self, room: str, delay: float):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE redials SET status = 'pending', due_at = ? WHERE room = ?",
+                (time.time() + delay, room),
+            )
+
+    def close(self):
+        self._conn.close()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            by_status = dict(
+                self._conn.execute("SELECT status, COUNT(*) FROM redials GROUP BY status").fetchall()
+            )
+            by_code = dict(
+                self._conn.execute(
+                    "SELECT sip_status, COUNT(*) FROM redials WHERE status = 'pending' GROUP BY sip_status"
+                ).fetchall()
+            )
+            next_due = self._conn.execute(
+                "SELECT MIN(due_at) FROM redials WHERE status = 'pending'"
+            ).fetchone()[0]
+        return {"by_status": by_status, "pending_by_sip_status": by_code, "next_due_at": next_due}
+
+
+def enqueue_dial_failed(queue: RedialQueue, data: dict[str, Any]) -> float | None:
+    """Queue the call of a "dial_failed" event again if its SIP status is worth retrying"""
+    try:
+        sip_status = int(data.get("sip_status_code") or 0)
+    except ValueError:
+        sip_status = 0
+    fields = {**data["dial_info"], "agent_name": data["agent_name"]}
+    due_at = queue.enqueue(data["room"], fields, sip_status)
+    phone_number = fields.get("phone_number")
+    if due_at is None:
+        logger.info(f"not redialing {phone_number} (SIP {sip_status})")
+    else:
+        logger.info(
+            f"redialing {phone_number} (SIP {sip_status}) at "
+            f"{datetime.datetime.fromtimestamp(due_at).isoformat(timespec='seconds')}"
+        )
+    return due_at
+
+
+def _enqueue_locally(data: dict[str, Any]):
+    queue = RedialQueue()
+    try:
+        enqueue_dial_failed(queue, data)
+    finally:
+        queue.close()
+
+
+async def report_dial_failed(data: dict[str, Any]):
+    """Agent side: queue a failed call for a redial.
+
+    The "dial_failed" event also reaches the API over the event bus, but the bus
+    drops events under backpressure, so the failure is written here as well.
+    Rows are keyed by room, so getting both is harmless.
+    """
+    if not REDIAL_API_URL:
+        try:
+            await asyncio.to_thread(_enqueue_locally, data)
+        except sqlite3.Error as e:
+            logger.error(f"could not queue {data['room']} for a redial: {e}")
+        return
+    url = f"{REDIAL_API_URL.rstrip('/')}/redials"
+    for attempt in range(REPORT_ATTEMPTS):
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+                async with session.post(url, json=data) as response:
+                    response.raise_for_status()
+                    return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"reporting failed dial of {data['room']} to {url} failed: {e}")
+            if attempt + 1 < REPORT_ATTEMPTS:
+                await asyncio.sleep(0.5 * 2**attempt)
+    logger.error(f"could not queue {data['room']} for a redial")
+
+
+class RedialScheduler:
+    """Feeds due retries back into dispatch, rate limited per trunk"""
+
+    def __init__(self, queue: RedialQueue, dispatch: DispatchFnc, default_trunk_id: str = ""):
+        self._queue = queue
+        self._dispatch = dispatch
+        self._default_trunk_id = default_trunk_id
+        self._limiters: dict[str, RateLimiter] = {}
+        self._task: asyncio.Task | None = None
+
+    def on_dial_failed(self, data: dict[str, Any]) -> float | None:
+        """A job's "dial_failed" event or report: queue the call again if its status is worth retrying"""
+        return enqueue_dial_failed(self._queue, data)
+
+    def stats(self) -> dict[str, Any]:
+        return self._queue.stats()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                due = await asyncio.to_thread(self._queue.claim_due)
+            except sqlite3.Error as e:
+                logger.error(f"redial queue unavailable: {e}")
+                continue
+            for room, fields in due:
+                await self._redial(room, fields)
+
+    async def _redial(self, room: str, fields: dict[str, Any]):
+        trunk_id = fields.get("sip_trunk_id") or self._default_trunk_id
+        limiter = self._limiters.setdefault(trunk_id, RateLimiter(REDIAL_CALLS_PER_SECOND))
+        await limiter.acquire()
+        attempt = int(fields.get("attempt") or 1) + 1
+        request = {
+            **fields,
+            "room_name": f"{_RETRY_SUFFIX.sub('', room)}-retry{attempt}",
+            "attempt": attempt,
+        }
+        try:
+            await self._dispatch(request)
+        except Exception as e:
+            logger.error(f"redial of {fields.get('phone_number')} failed to dispatch: {e}")
+            await asyncio.to_thread(self._queue.postpone, room, 60.0)
+            return
+        await asyncio.to_thread(self._queue.finish, room, "dispatched")
+        logger.info(f"redialed {fields.get('phone_number')}, attempt {attempt}")
@@ -0,0 +1,523 @@
+"""Offline replay benchmark: scripted calls against mock STT/LLM/TTS and a fake SIP API.
+
+Runs the agent's own code (OutboundCaller tools, contact lookup, slot index and
+bookings, TTS phrase cache, filler masking) with every network dependency
+replaced by a mock whose latency and jitter are configurable. The caller's
+audio comes from agentcall.wav. Results are written as JSON so runs can be
+compared between releases:
+
+    python replay.py --calls 200 --concurrency 20 --processes 2 --out replay.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import inspect
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import wave
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterable, AsyncIterator, Callable
+
+import psutil
+from livekit import rtc
+from livekit.agents import ChatContext, llm as lk_llm
+
+import bookings
+import contacts
+import prompts
+import scheduling
+import tts_cache
+from agent import OutboundCaller
+from contacts import ContactRecord
+from percentiles import percentile
+from turn_metrics import STAGES
+
+DEFAULT_WAV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agentcall.wav")
+FRAME_MS = 20
+
+# user line, optional tool call, agent reply. Tool args are formatted with the
+# previous tool result, so the caller can pick a time that was offered.
+SCRIPT: list[dict[str, Any]] = [
+    {"user": "Hello?", "reply": "Hi, this is your dental office calling to confirm your appointment. Does it still work for you?"},
+    {"user": "Do you have anything on Friday instead?", "tool": "look_up_availability", "args": {"date": "friday"},
+     "reply": "On Friday we have a few openings in the morning."},
+    {"user": "The first one works.", "tool": "confirm_appointment",
+     "args": {"date": "{date}", "time": "{available_times[0]}"}, "reply": "You're all set, see you on Friday."},
+    {"user": "Thanks, bye.", "reply": "Goodbye!"},
+]
+
+
+@dataclass
+class MockConfig:
+    ring: float = 2.0
+    session_start: float = 0.3
+    stt_final: float = 0.15
+    end_of_turn: float = 0.16
+    llm_ttft: float = 0.35
+    # added to llm_ttft per 1000 input tokens the provider hasn't cached
+    llm_prefill_per_1k: float = 0.08
+    llm_token: float = 0.01
+    tts_ttfb: float = 0.12
+    tool: float = 0.05
+    jitter: float = 0.2
+    user_seconds: float = 2.0
+
+
+class Latency:
+    """Deterministic per-call latencies: base +/- jitter from a seeded RNG"""
+
+    def __init__(self, config: MockConfig, seed: int):
+        self.config = config
+        self.rng = random.Random(seed)
+
+    def __call__(self, name: str) -> float:
+        base = getattr(self.config, name)
+        return max(0.0, base * (1 + self.rng.uniform(-self.config.jitter, self.config.jitter)))
+
+
+def load_frames(path: str) -> tuple[list[bytes], int]:
+    with wave.open(path) as w:
+        if w.getsampwidth() != 2 or w.getnchannels() != 1:
+            sys.exit(f"{path}: expected 16-bit mono audio")
+        rate = w.getframerate()
+        pcm = w.readframes(w.getnframes())
+    step = rate * FRAME_MS // 1000 * 2
+    return [pcm[i : i + step] for i in range(0, len(pcm) - step + 1, step)], rate
+
+
+class MockSTT:
+    """Receives the caller's audio as room frames, then returns the scripted line"""
+
+    def __init__(self, latency: Latency, sample_rate: int):
+        self.latency = latency
+        self.sample_rate = sample_rate
+
+    async def recognize(self, frames: list[bytes], transcript: str) -> str:
+        for frame in frames:
+            rtc.AudioFrame(
+                data=frame,
+                sample_rate=self.sample_rate,
+                num_channels=1,
+                samples_per_channel=len(frame) // 2,
+            )
+        await asyncio.sleep(self.latency("stt_final"))
+        return transcript
+
+
+class MockLLM:
+    """Time to first token grows with the uncached part of the prompt.
+
+    `prefix_cache` plays the provider's prompt cache: the first request with a
+    given static prefix pays for all of it, later ones only for what follows.
+    """
+
+    def __init__(self, latency: Latency, prefix_cache: set[str] | None):
+        self.latency = latency
+        self.prefix_cache = prefix_cache
+
+    def prompt(self, chat_ctx: ChatContext, prefix: str, prefix_tokens: int) -> tuple[int, int]:
+        """(input tokens, cached tokens) of a request"""
+        tokens = prefix_tokens + sum(prompts.item_tokens(item) for item in chat_ctx.items)
+        if self.prefix_cache is None:
+            return tokens, 0
+        if prefix in self.prefix_cache:
+            return tokens, prefix_tokens
+        self.prefix_cache.add(prefix)
+        return tokens, 0
+
+    async def first_token(self, tokens: int, cached: int):
+        prefill = self.latency("llm_prefill_per_1k") * (tokens - cached) / 1000
+        await asyncio.sleep(self.latency("llm_ttft") + prefill)
+
+    async def stream(self, reply: str, tokens: int, cached: int) -> AsyncIterator[str]:
+        await self.first_token(tokens, cached)
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.latency("llm_token"))
+            # chunks keep their spaces, like a real LLM's tokens
+            yield word if i == len(words) - 1 else word + " "
+
+
+class MockTTS:
+    """Silence at the call's sample rate, about 60ms of audio per character"""
+
+    voice = "replay"
+
+    def __init__(self, latency: Latency, sample_rate: int):
+        self.latency = latency
+        self.sample_rate = sample_rate
+        self.text_done: float | None = None
+
+    async def synthesize(
+        self, text: AsyncIterable[str], on_voice: Callable[[str], None] | None = None
+    ) -> AsyncIterator[rtc.AudioFrame]:
+        chars = len("".join([chunk async for chunk in text]))
+        self.text_done = time.perf_counter()
+        await asyncio.sleep(self.latency("tts_ttfb"))
+        if on_voice is not None:
+            on_voice(self.voice)
+        samples = self.sample_rate * FRAME_MS // 1000
+        silence = bytes(samples * 2)
+        for _ in range(max(1, chars * 60 // FRAME_MS)):
+            yield rtc.AudioFrame(
+                data=silence, sample_rate=self.sample_rate, num_channels=1, samples_per_channel=samples
+            )
+
+
+class FakeSpeech:
+    def __init__(self, audio: AsyncIterable[rtc.AudioFrame] | None):
+        self._task = asyncio.create_task(self._play(audio)) if audio is not None else None
+
+    async def _play(self, audio):
+        async for _ in audio:
+            pass
+
+    def interrupt(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class FakeProviders:
+    """What the agent uses of CallProviders besides the nodes, which the replay drives itself"""
+
+    def tts_voice(self) -> str:
+        return MockTTS.voice
+
+
+class FakeSession:
+    """What the tools use of AgentSession: say() for fillers"""
+
+    def __init__(self):
+        self.said: list[str] = []
+
+    def say(self, text: str, *, audio=None, add_to_chat_ctx: bool = True):
+        self.said.append(text)
+        return FakeSpeech(audio)
+
+
+@dataclass
+class FakeRunContext:
+    session: FakeSession
+
+
+@dataclass
+class FakeParticipant:
+    identity: str
+
+
+class FakeSIP:
+    """create_sip_participant(wait_until_answered=True): rings, then the callee answers"""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    async def create_sip_participant(self, phone_number: str) -> FakeParticipant:
+        await asyncio.sleep(self.latency("ring"))
+        return FakeParticipant(identity=phone_number)
+
+
+@dataclass
+class CallResult:
+    turns: dict[str, list[float]] = field(default_factory=lambda: {s: [] for s in STAGES})
+    time_to_first_word: float | None = None
+    duration: float = 0.0
+    booked: bool = False
+    prompt_tokens: list[int] = field(default_factory=list)
+    prompt_cached_tokens: list[int] = field(default_factory=list)
+    error: str | None = None
+
+
+async def text(value: str) -> AsyncIterator[str]:
+    yield value
+
+
+def _format_args(args: dict[str, str], previous: Any) -> dict[str, str]:
+    if not isinstance(previous, dict):
+        return args
+    try:
+        return {k: v.format(**previous) for k, v in args.items()}
+    except (KeyError, IndexError):
+        return args
+
+
+@dataclass
+class PromptOptions:
+    history_budget: int = prompts.HISTORY_TOKEN_BUDGET
+    prefix_cache: set[str] | None = field(default_factory=set)
+
+
+async def run_call(
+    index: int, config: MockConfig, seed: int, frames: list[bytes], rate: int, prompt: PromptOptions
+) -> CallResult:
+    """One call, in the same order as entrypoint: dial while the session starts and the contact is looked up"""
+    latency = Latency(config, seed + index)
+    result = CallResult()
+    started = time.perf_counter()
+    room = f"replay-{seed}-{index}"
+    phone_number = f"+1555{index:07d}"
+    session = FakeSession()
+    tts = MockTTS(latency, rate)
+    stt, llm = MockSTT(latency, rate), MockLLM(latency, prompt.prefix_cache)
+
+    agent = OutboundCaller(
+        name=None, appointment_time=None, dial_info={"phone_number": phone_number, "transfer_to": ""},
+        call_id=room,
+        # the mock STT/LLM/TTS below are driven directly, not through the provider router
+        call_providers=FakeProviders(),
+    )
+    contact_lookup = asyncio.create_task(contacts.get_cache().get(phone_number))
+    session_started = asyncio.create_task(asyncio.sleep(latency("session_start")))
+
+    async def prepare_greeting() -> list[rtc.AudioFrame]:
+        await session_started
+        await agent.set_contact(await contact_lookup)
+        return [frame async for frame in tts.synthesize(text(agent.greeting))]
+
+    greeting = asyncio.create_task(prepare_greeting())
+    try:
+        participant = await FakeSIP(latency).create_sip_participant(phone_number)
+        answered = time.perf_counter()
+        greeting_frames = await greeting
+        agent.set_participant(participant)
+        if greeting_frames:
+            result.time_to_first_word = time.perf_counter() - answered
+
+        # what each LLM request carries: the instructions and tool schemas are
+        # the static prefix, then the per-call details and the conversation
+        tool_schemas = "".join(inspect.getdoc(tool) or "" for tool in agent.tools)
+        prefix = prompts.STATIC_INSTRUCTIONS + tool_schemas
+        prefix_tokens = prompts.estimate_tokens(prefix)
+        chat = ChatContext()
+        chat.add_message(role="system", content=agent.instructions[len(prompts.STATIC_INSTRUCTIONS) :])
+
+        frames_per_turn = int(config.user_seconds * 1000 / FRAME_MS)
+        offset = (index * frames_per_turn) % max(1, len(frames) - frames_per_turn)
+        previous = None
+        for turn in SCRIPT:
+            user_frames = frames[offset : offset + frames_per_turn]
+            offset = (offset + frames_per_turn) % max(1, len(frames) - frames_per_turn)
+            user_stopped = time.perf_counter()
+            await stt.recognize(user_frames, turn["user"])
+            result.turns["stt_final"].append(time.perf_counter() - user_stopped)
+            await asyncio.sleep(latency("end_of_turn"))
+            result.turns["end_of_turn"].append(time.perf_counter() - user_stopped)
+
+            chat.add_message(role="user", content=turn["user"])
+            tokens, cached = llm.prompt(prompts.trim_history(chat, prompt.history_budget), prefix, prefix_tokens)
+            result.prompt_tokens.append(tokens)
+            result.prompt_cached_tokens.append(cached)
+
+            llm_started = time.perf_counter()
+            if "tool" in turn:
+                await llm.first_token(tokens, cached)
+                result.turns["llm_ttft"].append(time.perf_counter() - llm_started)
+                await asyncio.sleep(latency("tool"))
+                tool = getattr(agent, turn["tool"])
+                tool_args = _format_args(turn["args"], previous)
+                previous = await tool(FakeRunContext(session), **tool_args)
+                if turn["tool"] == "confirm_appointment":
+                    result.booked = previous == "reservation confirmed"
+                call_id = f"{room}-{len(chat.items)}"
+                chat.items.append(
+                    lk_llm.FunctionCall(call_id=call_id, name=turn["tool"], arguments=json.dumps(tool_args))
+                )
+                chat.items.append(
+                    lk_llm.FunctionCallOutput(
+                        call_id=call_id, name=turn["tool"], output=json.dumps(previous), is_error=False
+                    )
+                )
+
+            async def reply_text() -> AsyncIterator[str]:
+                first = "tool" not in turn
+                async for chunk in llm.stream(turn["reply"], tokens, cached):
+                    if first:
+                        first = False
+                        result.turns["llm_ttft"].append(time.perf_counter() - llm_started)
+                    yield chunk
+
+            first_frame = True
+            tts.text_done = None
+            async for _ in agent.tts_cache.tts_node(reply_text(), tts.synthesize):
+                if first_frame:
+                    first_frame = False
+                    now = time.perf_counter()
+                    # a cached phrase never reaches the TTS
+                    result.turns["tts_ttfb"].append(now - tts.text_done if tts.text_done else 0.0)
+                    result.turns["playout_start"].append(now - user_stopped)
+            chat.add_message(role="assistant", content=turn["reply"])
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        await bookings.get_store().finish_call(room)
+    result.duration = time.perf_counter() - started
+    return result
+
+
+def use_workdir(workdir: str):
+    """Keep the replay's contacts, slots, bookings and tts cache in `workdir`, away from the real ones"""
+    contacts.CONTACTS_DB = scheduling.SCHEDULE_DB = os.path.join(workdir, "contacts.db")
+    scheduling.SLOTS_CSV = None
+    tts_cache.CACHE_DIR = os.path.join(workdir, "tts_cache")
+
+
+def seed_data(calls: int, seed: int):
+    """Contacts for half the calls (the rest exercise the no-contact path) and a week of slots"""
+    contacts.SQLiteContactStore(contacts.CONTACTS_DB).upsert_many(
+        ContactRecord(phone_number=f"+1555{i:07d}", name=f"Patient {i}", appointment_time="tomorrow at 3pm")
+        for i in range(0, calls, 2)
+    )
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    conn = scheduling.connect()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO slots (provider, date, start) VALUES (?, ?, ?)",
+            [
+                (f"dr-{p}", (today + datetime.timedelta(days=d)).isoformat(), f"{h}:{m:02d}")
+                for p in range(4)
+                for d in range(1, 8)
+                for h in range(8, 17)
+                for m in (0, 30)
+                if rng.random() < 0.8
+            ],
+        )
+    conn.close()
+
+
+def _run_worker(args: tuple[str, int, int, int, MockConfig, int, str, int, bool]) -> dict[str, Any]:
+    workdir, first, count, concurrency, config, seed, wav, history_budget, prompt_cache = args
+    use_workdir(workdir)
+    frames, rate = load_frames(wav)
+    proc = psutil.Process()
+    baseline_rss = proc.memory_info().rss
+    peak_rss = baseline_rss
+    sampling = True
+
+    def sample_rss():
+        nonlocal peak_rss
+        while sampling:
+            peak_rss = max(peak_rss, proc.memory_info().rss)
+            time.sleep(0.05)
+
+    threading.Thread(target=sample_rss, daemon=True).start()
+
+    async def main():
+        scheduling.get_index()
+        limit = asyncio.Semaphore(concurrency)
+        # one provider-side prompt cache for the process, shared by its calls
+        prompt = PromptOptions(history_budget, set() if prompt_cache else None)
+
+        async def bounded(i):
+            async with limit:
+                return await run_call(i, config, seed, frames, rate, prompt)
+
+        return await asyncio.gather(*(bounded(i) for i in range(first, first + count)))
+
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    results = asyncio.run(main())
+    cpu, wall = time.process_time() - cpu_started, time.perf_counter() - wall_started
+    sampling = False
+    return {
+        "results": [asdict(r) for r in results],
+        "cpu_seconds": cpu,
+        "wall_seconds": wall,
+        "rss_per_call": (peak_rss - baseline_rss) / min(concurrency, count),
+    }
+
+
+def _summarize(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent calls per process")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--wav", default=DEFAULT_WAV)
+    parser.add_argument("--out", default="replay.json")
+    parser.add_argument("--history-budget", type=int, default=prompts.HISTORY_TOKEN_BUDGET,
+                        help="tokens of conversation sent per request, 0 = all of it")
+    parser.add_argument("--no-prompt-cache", action="store_true",
+                        help="the mock provider doesn't cache the static prompt prefix")
+    for name, default in asdict(MockConfig()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=default,
+                            help="seconds" if name != "jitter" else "fraction of each latency")
+    args = parser.parse_args()
+    config = MockConfig(**{name: getattr(args, name) for name in asdict(MockConfig())})
+
+    workdir = tempfile.mkdtemp(prefix="outbound-replay-")
+    try:
+        use_workdir(workdir)
+        seed_data(args.calls, args.seed)
+        per_process = -(-args.calls // args.processes)
+        jobs = [
+            (workdir, first, min(per_process, args.calls - first), args.concurrency, config, args.seed,
+             args.wav, args.history_budget, not args.no_prompt_cache)
+            for first in range(0, args.calls, per_process)
+        ]
+        started = time.perf_counter()
+        if len(jobs) == 1:
+            workers = [_run_worker(jobs[0])]
+        else:
+            with multiprocessing.Pool(len(jobs)) as pool:
+                workers = pool.map(_run_worker, jobs)
+        wall = time.perf_counter() - started
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    calls = [r for w in workers for r in w["results"]]
+    ok = [r for r in calls if r["error"] is None]
+    cpu = sum(w["cpu_seconds"] for w in workers)
+    mean_duration = sum(r["duration"] for r in ok) / len(ok) if ok else 0.0
+    cpu_per_call = cpu / len(calls) if calls else 0.0
+    prompt_tokens = sum(sum(r["prompt_tokens"]) for r in ok)
+    cached_tokens = sum(sum(r["prompt_cached_tokens"]) for r in ok)
+    report = {
+        "config": {**asdict(config), "calls": args.calls, "concurrency": args.concurrency,
+                   "processes": args.processes, "seed": args.seed,
+                   "history_budget": args.history_budget, "prompt_cache": not args.no_prompt_cache},
+        "calls": len(calls),
+        "failed": len(calls) - len(ok),
+        "errors": sorted({r["error"] for r in calls if r["error"]})[:10],
+        "booked": sum(r["booked"] for r in ok),
+        "wall_seconds": wall,
+        "calls_per_second": len(calls) / wall if wall else 0.0,
+        "cpu_seconds_per_call": cpu_per_call,
+        # concurrent calls one core could carry: call length over the CPU it needs
+        "calls_per_core": mean_duration / cpu_per_call if cpu_per_call else 0.0,
+        "memory_per_call_kb": sum(w["rss_per_call"] for w in workers) / len(workers) / 1024,
+        "time_to_first_word": _summarize(
+            [r["time_to_first_word"] for r in ok if r["time_to_first_word"] is not None]
+        ),
+        "turn_latency": {
+            stage: _summarize([v for r in ok for v in r["turns"][stage]]) for stage in STAGES
+        },
+        "prompt_tokens": _summarize([v for r in ok for v in r["prompt_tokens"]]),
+        "prompt_cached_share": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({k: v for k, v in report.items() if k != "config"}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
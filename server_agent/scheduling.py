@@ -0,0 +1,381 @@
+"""Free appointment slots, indexed in memory per worker process.
+
+Measure index loads and tool round trips against a schedule of any size:
+
+    python scheduling.py bench --slots 100000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import bisect
+import csv
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger("outbound-caller")
+
+# free slots come from SLOTS_CSV (provider,date,start) when set, else the sqlite db
+SCHEDULE_DB = os.getenv("SCHEDULE_DB", os.getenv("CONTACTS_DB", "contacts.db"))
+SLOTS_CSV = os.getenv("SLOTS_CSV")
+# most times offered to the caller in one answer
+MAX_OFFERED_TIMES = 5
+# the index is rebuilt in the background once it's this old, and after this
+# process writes bookings, so slots booked or freed by other calls show up
+INDEX_MAX_AGE = float(os.getenv("SLOT_INDEX_MAX_AGE", "60"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    provider TEXT NOT NULL,
+    date TEXT NOT NULL,
+    start TEXT NOT NULL,
+    booked INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (provider, date, start)
+);
+-- a call's claim on a slot while it's being confirmed, see bookings.py
+CREATE TABLE IF NOT EXISTS holds (
+    provider TEXT NOT NULL,
+    date TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    call_id TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (provider, date, start)
+);
+-- one booking per call, the call id doubles as the idempotency key
+CREATE TABLE IF NOT EXISTS bookings (
+    call_id TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    date TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    phone_number TEXT,
+    booked_at REAL NOT NULL,
+    UNIQUE (provider, date, start)
+);
+"""
+
+_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_TIME_RE = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*([ap])?\.?\s*m?\.?\s*$", re.IGNORECASE)
+
+
+def parse_date(text: str, today: datetime.date | None = None) -> datetime.date | None:
+    """Parse an ISO date, "today"/"tomorrow" or a weekday name (the next one)"""
+    today = today or datetime.date.today()
+    text = text.strip().lower()
+    try:
+        return datetime.date.fromisoformat(text)
+    except ValueError:
+        pass
+    if text == "today":
+        return today
+    if text == "tomorrow":
+        return today + datetime.timedelta(days=1)
+    for i, weekday in enumerate(_WEEKDAYS):
+        if weekday in text:
+            days_ahead = (i - today.weekday()) % 7 or 7
+            return today + datetime.timedelta(days=days_ahead)
+    return None
+
+
+def parse_time(text: str) -> int | None:
+    """Minutes since midnight for "3pm", "3:30 pm" or "15:30" """
+    match = _TIME_RE.match(text)
+    if not match:
+        return None
+    hour, minute, meridiem = int(match[1]), int(match[2] or 0), (match[3] or "").lower()
+    if meridiem == "p" and hour < 12:
+        hour += 12
+    elif meridiem == "a" and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def parse_appointment(text: str | None) -> tuple[datetime.date, int] | None:
+    """Parse "<date> at <time>" as stored for a contact's appointment"""
+    if not text or " at " not in text:
+        return None
+    date_text, _, time_text = text.rpartition(" at ")
+    date, start = parse_date(date_text), parse_time(time_text)
+    if date is None or start is None:
+        return None
+    return date, start
+
+
+def first_bookable(date: datetime.date, now: datetime.datetime | None = None) -> int | None:
+    """Earliest start minute that can still be booked on `date`, None if it's past"""
+    now = now or datetime.datetime.now()
+    if date < now.date():
+        return None
+    if date == now.date():
+        return now.hour * 60 + now.minute + 1
+    return 0
+
+
+def format_time(minutes: int) -> str:
+    hour, minute = divmod(minutes, 60)
+    suffix = "am" if hour < 12 else "pm"
+    hour = hour % 12 or 12
+    return f"{hour}{suffix}" if not minute else f"{hour}:{minute:02d}{suffix}"
+
+
+class SlotIndex:
+    """Free appointment slots per date and provider, as sorted start minutes.
+
+    Lookups are a dict access plus bisect, so answering the caller never touches
+    the database. Slots this process books are removed in place; ones booked by
+    other processes are caught when the hold fails (see bookings.py) and dropped
+    when the index is rebuilt (see get_index). Times already past are never offered.
+    """
+
+    def __init__(self):
+        # date -> provider -> sorted start minutes
+        self._free: dict[datetime.date, dict[str, list[int]]] = defaultdict(dict)
+        self.size = 0
+
+    def add(self, provider: str, date: datetime.date, start: int):
+        starts = self._free[date].setdefault(provider, [])
+        i = bisect.bisect_left(starts, start)
+        if i == len(starts) or starts[i] != start:
+            starts.insert(i, start)
+            self.size += 1
+
+    def remove(self, provider: str, date: datetime.date, start: int) -> bool:
+        starts = self._free.get(date, {}).get(provider)
+        if not starts:
+            return False
+        i = bisect.bisect_left(starts, start)
+        if i == len(starts) or starts[i] != start:
+            return False
+        del starts[i]
+        self.size -= 1
+        return True
+
+    def free_times(
+        self,
+        date: datetime.date,
+        *,
+        after: int = 0,
+        limit: int = MAX_OFFERED_TIMES,
+        now: datetime.datetime | None = None,
+    ) -> list[int]:
+        """Earliest free start times on `date` across providers"""
+        earliest = first_bookable(date, now)
+        if earliest is None:
+            return []
+        after = max(after, earliest)
+        times: set[int] = set()
+        for starts in self._free.get(date, {}).values():
+            i = bisect.bisect_left(starts, after)
+            times.update(starts[i : i + limit])
+        return sorted(times)[:limit]
+
+    def providers_at(
+        self, date: datetime.date, start: int, now: datetime.datetime | None = None
+    ) -> list[str]:
+        """Providers that are free at `start` on `date`"""
+        earliest = first_bookable(date, now)
+        if earliest is None or start < earliest:
+            return []
+        providers = []
+        for provider, starts in self._free.get(date, {}).items():
+            i = bisect.bisect_left(starts, start)
+            if i < len(starts) and starts[i] == start:
+                providers.append(provider)
+        return providers
+
+
+def connect(path: str | None = None) -> sqlite3.Connection:
+    """Open the schedule database; WAL so job processes can book concurrently"""
+    conn = sqlite3.connect(path or SCHEDULE_DB, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _load_rows(conn: sqlite3.Connection) -> list[tuple[str, str, str]]:
+    if SLOTS_CSV:
+        with open(SLOTS_CSV, newline="") as f:
+            return [(r["provider"], r["date"], r["start"]) for r in csv.DictReader(f)]
+    return conn.execute(
+        "SELECT provider, date, start FROM slots WHERE booked = 0 AND date >= ?",
+        (datetime.date.today().isoformat(),),
+    ).fetchall()
+
+
+def _taken(conn: sqlite3.Connection) -> list[tuple[str, str, int]]:
+    """Slots booked or held by calls, which aren't free whatever the slot list says"""
+    return conn.execute(
+        "SELECT provider, date, start FROM bookings"
+        " UNION SELECT provider, date, start FROM holds WHERE expires_at > ?",
+        (time.time(),),
+    ).fetchall()
+
+
+def load_index(path: str | None = None) -> SlotIndex:
+    index = SlotIndex()
+    conn = connect(path)
+    try:
+        rows, taken = _load_rows(conn), _taken(conn)
+    finally:
+        conn.close()
+
+    for provider, date, start in rows:
+        start_minutes = parse_time(start)
+        try:
+            day = datetime.date.fromisoformat(date)
+        except ValueError:
+            day = None
+        if day is None or start_minutes is None:
+            logger.warning(f"skipping invalid slot {provider} {date} {start}")
+            continue
+        index.add(provider, day, start_minutes)
+    for provider, date, start in taken:
+        index.remove(provider, datetime.date.fromisoformat(date), start)
+    return index
+
+
+_index: SlotIndex | None = None
+# monotonic time the index was loaded, -inf once invalidated
+_loaded_at = 0.0
+_rebuild: threading.Thread | None = None
+
+
+def get_index() -> SlotIndex:
+    """The process-wide slot index, loaded on first use (or in prewarm).
+
+    Once it's older than INDEX_MAX_AGE it's rebuilt on a thread, and the old
+    one keeps answering until the new one is swapped in.
+    """
+    global _index, _loaded_at
+    if _index is None:
+        _index = load_index()
+        _loaded_at = time.monotonic()
+        logger.info(f"loaded {_index.size} free appointment slots")
+    elif time.monotonic() - _loaded_at > INDEX_MAX_AGE:
+        _start_rebuild()
+    return _index
+
+
+def invalidate():
+    """Rebuild the index on its next use, e.g. after bookings were written"""
+    global _loaded_at
+    _loaded_at = float("-inf")
+
+
+def _start_rebuild():
+    global _rebuild
+    if _rebuild is not None and _rebuild.is_alive():
+        return
+    _rebuild = threading.Thread(target=_rebuild_index, name="slot-index-rebuild", daemon=True)
+    _rebuild.start()
+
+
+def _rebuild_index():
+    global _index, _loaded_at
+    started = time.monotonic()
+    try:
+        index = load_index()
+    except Exception as e:
+        logger.warning(f"failed to rebuild the slot index: {e}")
+        # keep the old one, try again after another INDEX_MAX_AGE
+        _loaded_at = started
+        return
+    _index, _loaded_at = index, started
+
+
+def _seed_slots(conn: sqlite3.Connection, slots: int, providers: int = 30) -> int:
+    """About `slots` free slots from tomorrow on, every 10 minutes from 8am to 5pm"""
+    per_day = providers * 54
+    days = -(-slots // per_day)
+    today = datetime.date.today()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO slots (provider, date, start) VALUES (?, ?, ?)",
+            (
+                (f"dr-{p}", (today + datetime.timedelta(days=d)).isoformat(), format_time(480 + 10 * i))
+                for d in range(1, days + 1)
+                for p in range(providers)
+                for i in range(54)
+            ),
+        )
+    return days * per_day
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    values = sorted(values)
+    return {
+        "p50_ms": round(values[len(values) // 2] * 1000, 3),
+        "p99_ms": round(values[min(len(values) - 1, int(0.99 * len(values)))] * 1000, 3),
+    }
+
+
+async def _bench(slots: int, lookups: int) -> dict:
+    import bookings
+
+    # every connection gets the temp path explicitly: run as a script, this is
+    # __main__ and bookings imports its own copy of this module, globals and all
+    workdir = tempfile.mkdtemp(prefix="outbound-slots-")
+    path = os.path.join(workdir, "schedule.db")
+    try:
+        conn = connect(path)
+        seeded = _seed_slots(conn, slots)
+        conn.close()
+
+        started = time.perf_counter()
+        index = load_index(path)
+        load_seconds = time.perf_counter() - started
+
+        days = sorted(index._free)
+        lookup_times = []
+        for i in range(lookups):
+            started = time.perf_counter()
+            index.free_times(days[i % len(days)], after=(i * 7) % 600)
+            lookup_times.append(time.perf_counter() - started)
+
+        # what confirm_appointment does: providers, the hold, the booking write
+        store = bookings.BookingStore(path)
+        confirm_times = []
+        for i in range(min(lookups, 500)):
+            day, start = days[i % len(days)], 480 + 10 * (i % 54)
+            started = time.perf_counter()
+            providers = index.providers_at(day, start)
+            provider = await store.hold(f"bench-{i}", day, start, providers)
+            if provider is not None and await store.book(bookings.Booking(f"bench-{i}", provider, day, start)):
+                index.remove(provider, day, start)
+            confirm_times.append(time.perf_counter() - started)
+
+        # what the background rebuild does
+        started = time.perf_counter()
+        load_index(path)
+        rebuild_seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "slots": seeded,
+        "indexed": index.size,
+        "load_seconds": round(load_seconds, 3),
+        "rebuild_seconds": round(rebuild_seconds, 3),
+        "free_times": _percentiles(lookup_times),
+        "confirm": _percentiles(confirm_times),
+        **store.get_stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="index load, lookup and booking latency")
+    bench_parser.add_argument("--slots", type=int, default=100_000)
+    bench_parser.add_argument("--lookups", type=int, default=10_000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_bench(args.slots, args.lookups)), indent=2))
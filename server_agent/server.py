@@ -1,18 +1,63 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+# Dispatch API / control plane. Runs standalone and scales on its own:
+#   gunicorn server:app -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:8000
+# With more than one worker set STATE_BACKEND=redis and EVENT_BUS=redis so
+# campaign/dispatch state and job logs are shared by every worker.
+from fastapi import FastAPI, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
 from livekit import api
+import asyncio
+import contextlib
+import logging
 import os
 import json
+from typing import Any, Awaitable, Callable
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from log_streamer import register_client, unregister_client
+import log_streamer
+import event_bus
+import shared_state
+from log_streamer import register_client, unregister_client, update_subscription
+import campaigns
+import contacts
+import turn_metrics
+import redial
+import call_records
+import rate_limits
+from livekit_client import LiveKitClient
+from dispatch_tracker import DispatchTracker
 
-app = FastAPI()
 # load environment variables, this is optional, only used for local development
 load_dotenv(dotenv_path=".env.local")
 
+logger = logging.getLogger("outbound-caller")
+logger.setLevel(logging.INFO)
+log_streamer.attach_handler(logger)
 
-app = FastAPI()
+
+# started with the app in order, stopped in the order they were registered
+_startup: list[Callable[[], Awaitable[None]]] = []
+_shutdown: list[Callable[[], Awaitable[None]]] = []
+
+
+def on_startup(hook: Callable[[], Awaitable[None]]):
+    _startup.append(hook)
+
+
+def on_shutdown(hook: Callable[[], Awaitable[None]]):
+    _shutdown.append(hook)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    for hook in _startup:
+        await hook()
+    yield
+    for hook in _shutdown:
+        await hook()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.add_middleware(
@@ -23,48 +68,224 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+on_startup(log_streamer.start)
+on_shutdown(log_streamer.stop)
+
+
+# redials being written to the queue, referenced until they're done
+_redial_writes: set[asyncio.Task] = set()
+
+
+async def _queue_redial(data: dict[str, Any]):
+    try:
+        await asyncio.to_thread(redial_scheduler.on_dial_failed, data)
+    except Exception as e:
+        logger.error(f"could not queue a redial for {data.get('room')}: {e}")
+
+
+def on_job_event(event):
+    """Records sent by agent jobs: turn timings feed /metrics, quota reports pace
+    dispatches, failed dials are queued for a redial, call events are stored,
+    everything goes to the dashboards"""
+    turn_metrics.observe(event)
+    admission.observe(event)
+    call_store.append(event)
+    if event.get("event") == "dial_failed" and event.get("data"):
+        # the redial queue is sqlite, keep it off the event loop
+        task = asyncio.create_task(_queue_redial(event["data"]))
+        _redial_writes.add(task)
+        task.add_done_callback(_redial_writes.discard)
+    log_streamer.publish(event)
+
+
+# dispatches slow down while jobs report provider quota running low, see rate_limits.py
+admission = rate_limits.Admission()
+
+
+# transcripts, tool calls, outcomes and timings, kept after the call, see call_records.py
+call_store = call_records.CallStore()
+on_startup(call_store.start)
+on_shutdown(call_store.aclose)
+
+
+async def start_event_bus():
+    await event_bus.start_server(on_job_event)
+
+
+on_startup(start_event_bus)
+on_shutdown(event_bus.stop_server)
+
+state = shared_state.connect()
+livekit_client = LiveKitClient()
+on_startup(livekit_client.start)
+dispatch_tracker = DispatchTracker(livekit_client, state=state)
+on_startup(dispatch_tracker.start)
+on_shutdown(dispatch_tracker.aclose)
+on_shutdown(livekit_client.aclose)
+if state is not None:
+    on_shutdown(state.aclose)
+
 
 @app.websocket("/ws/logs")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    register_client(websocket)
+    # optional filters: ?room=...&phone_number=...&level=...&event=...
+    register_client(websocket, dict(websocket.query_params))
     try:
         while True:
-            await websocket.receive_text()  # Keep connection alive
+            # subscription updates are sent as JSON, anything else is a keep-alive
+            update_subscription(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
         unregister_client(websocket)
 
 
+@app.get("/metrics")
+async def metrics():
+    # per-turn latency histograms, see turn_metrics.py
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/logs/stats")
+async def log_stats():
+    return {
+        **log_streamer.get_stats(),
+        "event_bus": event_bus.get_stats(),
+        "call_records": call_store.get_stats(),
+    }
+
+
+@app.get("/calls")
+async def list_calls(
+    status: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+    phone_number: str | None = None,
+    limit: int = Query(50, ge=1, le=500),
+):
+    # newest first; for the next page pass the last call's started_at as `until`
+    calls = await asyncio.to_thread(
+        call_store.list_calls,
+        status=status,
+        since=since,
+        until=until,
+        phone_number=phone_number,
+        limit=limit,
+    )
+    return {"calls": calls}
+
+
+@app.get("/calls/{room}")
+async def get_call(room: str):
+    call = await asyncio.to_thread(call_store.get_call, room)
+    if call is None:
+        raise HTTPException(status_code=404, detail="call not found")
+    return call
+
+
+@app.get("/calls/{room}/transcript")
+async def get_transcript(room: str, after: int = 0, limit: int = Query(100, ge=1, le=1000)):
+    items = await asyncio.to_thread(call_store.transcript, room, after=after, limit=limit)
+    # pass `next` back as `after` for the following page
+    return {
+        "room": room,
+        "items": items,
+        "next": items[-1]["id"] if len(items) == limit else None,
+    }
+
+
 class DispatchRequest(BaseModel):
     room_name: str
     agent_name: str
     phone_number: str
     transfer_to : str
+    name: str | None = None
+    appointment_time: str | None = None
+    sip_trunk_id: str | None = None
+    timezone: str | None = None
+    attempt: int | None = None
+
+
+def dispatch_metadata(data: DispatchRequest) -> str:
+    return json.dumps(data.model_dump(exclude={"room_name", "agent_name"}, exclude_none=True))
 
 
 @app.post("/dispatch")
 async def create_agent_dispatch(data: DispatchRequest):
-    lkapi = api.LiveKitAPI(
-        url=os.getenv("LIVEKIT_URL"),
-        api_key=os.getenv("LIVEKIT_API_KEY"),
-        api_secret=os.getenv("LIVEKIT_API_SECRET")
-    )
-    dispatch = await lkapi.agent_dispatch.create_dispatch(
-        api.CreateAgentDispatchRequest(
-            agent_name=data.agent_name, room=data.room_name,metadata = json.dumps({
-        "phone_number": data.phone_number,
-        "transfer_to": data.transfer_to
-    })
+    # campaigns and redials come through here too
+    await admission.wait()
+    async with livekit_client.acquire() as lkapi:
+        dispatch = await lkapi.agent_dispatch.create_dispatch(
+            api.CreateAgentDispatchRequest(
+                agent_name=data.agent_name, room=data.room_name,metadata=dispatch_metadata(data)
+            )
         )
-    )
-    print("created dispatch", dispatch)
+        logger.info(f"created dispatch {dispatch.id} for {data.room_name}")
 
-    dispatches = await lkapi.agent_dispatch.list_dispatch(room_name=data.room_name)
-    print(f"there are {len(dispatches)} dispatches in {data.room_name}")
-    await lkapi.aclose()
-
-    
+    # status is reconciled in the background, see GET /dispatch/{dispatch_id}
+    await dispatch_tracker.track(dispatch.id, data.room_name, data.agent_name)
     return {
         "message": "Dispatch created successfully",
-        "dispatch": data.room_name
-    }
\ No newline at end of file
+        "dispatch": data.room_name,
+        "dispatch_id": dispatch.id,
+    }
+
+
+@app.get("/dispatch/{dispatch_id}")
+async def get_agent_dispatch(dispatch_id: str):
+    status = await dispatch_tracker.lookup(dispatch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="dispatch not found")
+    return status
+
+
+def dispatch_fields(fields):
+    return create_agent_dispatch(DispatchRequest(**fields))
+
+
+# failed calls are retried by whichever worker claims them first, see redial.py
+redial_scheduler = redial.RedialScheduler(
+    redial.RedialQueue(), dispatch_fields, os.getenv("SIP_OUTBOUND_TRUNK_ID", "")
+)
+on_startup(redial_scheduler.start)
+on_shutdown(redial_scheduler.aclose)
+
+
+@app.get("/quota")
+async def quota():
+    # provider buckets are only visible when the API runs on an agent host (app.py)
+    return {"admission": admission.get_stats(), "providers": await asyncio.to_thread(rate_limits.get_stats)}
+
+
+class DialFailed(BaseModel):
+    room: str
+    agent_name: str
+    dial_info: dict[str, Any]
+    sip_status_code: str | int | None = None
+
+
+@app.get("/redials")
+async def redial_stats():
+    return redial_scheduler.stats()
+
+
+@app.post("/redials")
+async def report_dial_failed(data: DialFailed):
+    # agents on other hosts report failed dials here, see redial.report_dial_failed
+    due_at = await asyncio.to_thread(redial_scheduler.on_dial_failed, data.model_dump())
+    return {"room": data.room, "due_at": due_at}
+
+
+app.include_router(
+    campaigns.create_router(
+        dispatch_fields,
+        dispatch_tracker.wait,
+        state,
+        contacts.get_cache(),
+    )
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Dict
+
+# "memory" keeps campaign/dispatch state in the API process (single worker),
+# "redis" shares it between every API worker, needs `pip install redis`
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+KEY_PREFIX = "outbound-caller:"
+# shared entries expire on their own so finished campaigns don't pile up
+STATE_TTL = int(os.getenv("STATE_TTL", str(7 * 24 * 3600)))
+
+
+class RedisState:
+    """Hash-per-object state shared by all API workers"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+
+        self._client = aioredis.from_url(url, decode_responses=True)
+
+    async def save(self, key: str, fields: Dict[str, Any]):
+        mapping = {k: "" if v is None else str(v) for k, v in fields.items()}
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.hset(KEY_PREFIX + key, mapping=mapping)
+            pipe.expire(KEY_PREFIX + key, STATE_TTL)
+            await pipe.execute()
+
+    async def load(self, key: str) -> Dict[str, str] | None:
+        fields = await self._client.hgetall(KEY_PREFIX + key)
+        return fields or None
+
+    async def set_field(self, key: str, field: str, value: Any):
+        await self._client.hset(KEY_PREFIX + key, field, str(value))
+
+    async def get_field(self, key: str, field: str) -> str | None:
+        return await self._client.hget(KEY_PREFIX + key, field)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+def connect() -> RedisState | None:
+    """The shared state backend, or None when state stays in this process"""
+    if STATE_BACKEND == "redis":
+        return RedisState(REDIS_URL)
+    return None
+
+
+def decode(fields: Dict[str, str], numeric: tuple = ()) -> Dict[str, Any]:
+    """Turn a loaded hash back into JSON-friendly values"""
+    decoded: Dict[str, Any] = {}
+    for k, v in fields.items():
+        if v == "":
+            decoded[k] = None
+        elif k in numeric:
+            decoded[k] = float(v) if "." in v else int(v)
+        else:
+            decoded[k] = v
+    return decoded
@@ -0,0 +1,64 @@
+import asyncio
+
+import numpy as np
+
+import amd
+
+
+def test_greeting_wait_gives_up_after_the_timeout(monkeypatch):
+    async def listen_forever(participant, detector):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(amd, "_listen", listen_forever)
+    assert asyncio.run(amd.wait_for_greeting_end(None, timeout=0.05)) is False
+
+
+def test_greeting_end_is_reported(monkeypatch):
+    async def greeting_ends(participant, detector):
+        return amd.Decision("machine", 1.0, "beep")
+
+    monkeypatch.setattr(amd, "_listen", greeting_ends)
+    assert asyncio.run(amd.wait_for_greeting_end(None, timeout=1.0)) is True
+
+
+RATE = 16000
+
+
+def _noise(seconds, amplitude, rng):
+    return (rng.standard_normal(int(RATE * seconds)) * amplitude).astype(np.int16)
+
+
+def _detect(*parts):
+    detector = amd.AnsweringMachineDetector(RATE)
+    pcm = np.concatenate(parts)
+    step = RATE * amd.FRAME_MS // 1000
+    for i in range(0, len(pcm), step):
+        decision = detector.push(pcm[i : i + step])
+        if decision is not None:
+            return decision
+    return None
+
+
+def test_short_greeting_then_silence_is_a_human():
+    rng = np.random.default_rng(1)
+    decision = _detect(_noise(0.3, 10, rng), _noise(0.8, 3000, rng), _noise(2.0, 10, rng))
+
+    assert decision.label == "human"
+    assert decision.at < 2.0
+
+
+def test_long_greeting_is_a_machine():
+    rng = np.random.default_rng(2)
+    decision = _detect(_noise(0.3, 10, rng), _noise(4.0, 3000, rng))
+
+    assert (decision.label, decision.reason) == ("machine", "long greeting")
+
+
+def test_tone_is_a_beep():
+    rng = np.random.default_rng(3)
+    t = np.arange(int(RATE * 0.5)) / RATE
+    tone = (np.sin(2 * np.pi * 1000 * t) * 8000).astype(np.int16)
+    decision = _detect(_noise(0.3, 10, rng), tone, _noise(1.0, 10, rng))
+
+    assert (decision.label, decision.reason) == ("machine", "beep")
+    assert decision.at < 0.3 + 0.5
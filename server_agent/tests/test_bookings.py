@@ -0,0 +1,67 @@
+import asyncio
+import datetime
+import multiprocessing
+import sqlite3
+
+import bookings
+import scheduling
+
+PROCESSES = 4
+CALLERS_PER_PROCESS = 500
+DAY = datetime.date(2030, 1, 7)
+
+
+def _compete(path: str, first: int, results):
+    """One job process: its callers all try to book the same slot at once"""
+
+    async def run():
+        store = bookings.BookingStore(path)
+
+        async def caller(i: int) -> bool:
+            call_id = f"call-{first + i}"
+            provider = await store.hold(call_id, DAY, 600, ["dr-a", "dr-b"])
+            if provider is None:
+                return False
+            return await store.book(bookings.Booking(call_id, provider, DAY, 600))
+
+        booked = await asyncio.gather(*(caller(i) for i in range(CALLERS_PER_PROCESS)))
+        for i in range(CALLERS_PER_PROCESS):
+            await store.finish_call(f"call-{first + i}")
+        return sum(booked)
+
+    results.put(asyncio.run(run()))
+
+
+def test_thousands_of_callers_competing_for_one_slot(tmp_path):
+    path = str(tmp_path / "schedule.db")
+    scheduling.connect(path).close()
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [
+        context.Process(target=_compete, args=(path, p * CALLERS_PER_PROCESS, results))
+        for p in range(PROCESSES)
+    ]
+    for worker in workers:
+        worker.start()
+    booked = sum(results.get(timeout=120) for _ in workers)
+    for worker in workers:
+        worker.join()
+
+    # one winner per provider, and every loser's hold is gone
+    assert booked == 2
+    conn = sqlite3.connect(path)
+    assert sorted(conn.execute("SELECT provider FROM bookings").fetchall()) == [("dr-a",), ("dr-b",)]
+    assert conn.execute("SELECT COUNT(*) FROM holds").fetchone() == (0,)
+    conn.close()
+
+
+def test_booking_lost_after_the_hold_expired_is_reported(tmp_path):
+    path = str(tmp_path / "schedule.db")
+
+    async def run():
+        store = bookings.BookingStore(path)
+        assert await store.book(bookings.Booking("first", "dr-a", DAY, 600))
+        # "second" held the slot earlier, its hold expired and "first" booked it
+        return await store.book(bookings.Booking("second", "dr-a", DAY, 600))
+
+    assert asyncio.run(run()) is False
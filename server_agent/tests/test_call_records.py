@@ -0,0 +1,92 @@
+import asyncio
+import importlib
+import logging
+
+import pytest
+from fastapi.testclient import TestClient
+
+import call_records
+
+ROOM = "call-1"
+
+
+def _events():
+    ts = 1000.0
+    return [
+        {"event": "call_started", "room": ROOM, "ts": ts, "phone_number": "+15550000000", "data": {}},
+        {"event": "transcript", "room": ROOM, "ts": ts + 1, "data": {"role": "assistant", "text": "Hi Jayden"}},
+        {"event": "transcript", "room": ROOM, "ts": ts + 2, "data": {"role": "user", "text": "Hello"}},
+        {"event": "tool_call", "room": ROOM, "ts": ts + 3, "data": {"name": "look_up_availability"}},
+        {"event": "turn", "room": ROOM, "ts": ts + 4, "data": {"llm_ttft": 0.3}},
+        {"event": "call_outcome", "room": ROOM, "ts": ts + 5, "data": {"outcome": "confirmed"}},
+        {"event": "call_ended", "room": ROOM, "ts": ts + 6, "data": {}},
+    ]
+
+
+def _record(store, events):
+    async def run():
+        await store.start()
+        for event in events:
+            store.append(event)
+        await store.aclose()
+
+    asyncio.run(run())
+
+
+def test_writer_thread_stores_the_call_record(tmp_path):
+    store = call_records.CallStore(str(tmp_path / "calls.db"))
+    # plain log lines and events without a room are not kept
+    _record(store, [*_events(), {"event": "log", "room": ROOM}, {"event": "transcript", "data": {}}])
+
+    call = store.get_call(ROOM)
+    assert call["phone_number"] == "+15550000000"
+    assert call["status"] == "confirmed"
+    assert (call["started_at"], call["ended_at"]) == (1000.0, 1006.0)
+    assert call["turns"] == 1
+    assert [item["text"] for item in store.transcript(ROOM)] == ["Hi Jayden", "Hello", None]
+    assert store.get_stats() == {
+        "received": 7, "written": 7, "duplicates": 0, "dropped": 0, "errors": 0, "pending": 0
+    }
+
+
+def test_event_received_by_two_api_workers_is_stored_once(tmp_path):
+    first = call_records.CallStore(str(tmp_path / "calls.db"))
+    second = call_records.CallStore(str(tmp_path / "calls.db"))
+    _record(first, _events())
+    _record(second, _events())
+
+    assert second.stats["duplicates"] == len(_events())
+    assert first.get_call(ROOM)["turns"] == 1
+    assert len(first.transcript(ROOM)) == 3
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # the API opens its other databases on import, keep them in tmp_path, and
+    # streams the log to the dashboards, which the other tests don't expect
+    monkeypatch.chdir(tmp_path)
+    logger = logging.getLogger("outbound-caller")
+    monkeypatch.setattr(logger, "handlers", list(logger.handlers))
+    server = importlib.import_module("server")
+    store = call_records.CallStore(str(tmp_path / "calls.db"))
+    _record(store, [*_events(), {"event": "call_started", "room": "call-2", "ts": 3000.0, "data": {}}])
+    monkeypatch.setattr(server, "call_store", store)
+    return TestClient(server.app)
+
+
+def test_calls_endpoints(client):
+    calls = client.get("/calls").json()["calls"]
+    assert [call["room"] for call in calls] == ["call-2", ROOM]
+    assert [c["room"] for c in client.get("/calls", params={"status": "confirmed"}).json()["calls"]] == [ROOM]
+    assert client.get("/calls", params={"until": 3000.0}).json()["calls"][0]["room"] == ROOM
+    assert client.get(f"/calls/{ROOM}").json()["status"] == "confirmed"
+    assert client.get("/calls/missing").status_code == 404
+
+
+def test_transcript_pages(client):
+    page = client.get(f"/calls/{ROOM}/transcript", params={"limit": 2}).json()
+    assert [item["text"] for item in page["items"]] == ["Hi Jayden", "Hello"]
+
+    rest = client.get(f"/calls/{ROOM}/transcript", params={"after": page["next"], "limit": 2}).json()
+    assert [item["data"] for item in rest["items"]] == [{"name": "look_up_availability"}]
+    assert rest["next"] is None
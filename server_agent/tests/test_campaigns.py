@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from campaigns import CampaignScheduler, Contact, parse_contacts
+
+
+def test_parse_contacts_rejects_non_object_lines():
+    with pytest.raises(ValueError, match="contact 2 is not an object"):
+        parse_contacts(b'{"phone_number": "+1555"}\n["+1556"]\n', "contacts.jsonl")
+
+
+def test_parse_contacts_coerces_numbers_and_rejects_nested_values():
+    contacts = parse_contacts(b'{"phone_number": 15551234567, "name": "Ann"}\n', "contacts.jsonl")
+    assert contacts == [Contact(phone_number="15551234567", name="Ann")]
+    with pytest.raises(ValueError, match="contact 1 has an invalid phone_number"):
+        parse_contacts(b'{"phone_number": {"number": "+1555"}}\n', "contacts.jsonl")
+
+
+def test_full_trunk_does_not_hold_up_other_trunks():
+    async def run():
+        dialed: list[str] = []
+        release_busy = asyncio.Event()
+
+        async def dispatch(fields):
+            dialed.append(fields["phone_number"])
+            return {"dispatch_id": fields["phone_number"]}
+
+        async def wait_for_call(dispatch_id):
+            if dispatch_id.startswith("busy"):
+                await release_busy.wait()
+            return "succeeded"
+
+        scheduler = CampaignScheduler(dispatch, "default", wait_for_call)
+        contacts = [Contact(f"busy-{i}", sip_trunk_id="a") for i in range(4)]
+        contacts += [Contact(f"free-{i}", sip_trunk_id="b") for i in range(4)]
+        campaign = scheduler.submit(
+            contacts, agent_name="test", max_concurrent_calls=2, calls_per_second=0, per_trunk_limit=1
+        )
+        for _ in range(50):
+            await asyncio.sleep(0)
+        # trunk a is stuck on one call, trunk b's contacts still got dialed
+        assert [n for n in dialed if n.startswith("free")] == [f"free-{i}" for i in range(4)]
+        assert dialed.count("busy-0") == 1 and len(dialed) == 5
+        assert campaign.queued() == 3
+
+        release_busy.set()
+        await asyncio.wait_for(campaign.task, 1)
+        assert campaign.done == 8 and campaign.queued() == 0
+
+    asyncio.run(run())
+
+
+def test_unknown_call_status_counts_as_failed():
+    async def run():
+        async def dispatch(fields):
+            return {"dispatch_id": fields["phone_number"]}
+
+        async def wait_for_call(dispatch_id):
+            return "unknown"
+
+        scheduler = CampaignScheduler(dispatch, "default", wait_for_call)
+        campaign = scheduler.submit([Contact("+1555")], agent_name="test", calls_per_second=0)
+        await asyncio.wait_for(campaign.task, 1)
+        assert (campaign.done, campaign.failed) == (0, 1)
+
+    asyncio.run(run())
+
+
+def test_prefetch_and_sync_stop_with_the_campaign():
+    class SlowContacts:
+        async def get_many(self, phone_numbers):
+            await asyncio.Event().wait()
+
+    class State:
+        def __init__(self):
+            self.saved = []
+
+        async def save(self, key, fields):
+            self.saved.append(fields)
+
+        async def get_field(self, key, name):
+            return None
+
+    async def run():
+        async def dispatch(fields):
+            return {}
+
+        state = State()
+        scheduler = CampaignScheduler(dispatch, "default", state=state, contacts=SlowContacts())
+        campaign = scheduler.submit([Contact("+1555")], agent_name="test", calls_per_second=0)
+        await campaign.task
+        # nothing of the campaign is left running, and its final progress was saved
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+        assert state.saved[-1]["status"] == "completed"
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+import asyncio
+
+from contacts import ContactCache, ContactRecord
+
+
+class SlowStore:
+    def __init__(self):
+        self.lookups = 0
+
+    async def get_many(self, phone_numbers):
+        self.lookups += 1
+        await asyncio.sleep(0.05)
+        return {n: ContactRecord(n, "Ann", "", "") for n in phone_numbers}
+
+
+def test_waiters_survive_a_cancelled_leader():
+    store = SlowStore()
+    cache = ContactCache(store)
+
+    async def run():
+        leader = asyncio.create_task(cache.get("+1555"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get("+1555"))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.wait_for(waiter, 1.0)
+
+    record = asyncio.run(run())
+    assert record.name == "Ann"
+    assert store.lookups == 2
+
+
+def test_concurrent_misses_share_one_lookup():
+    store = SlowStore()
+    cache = ContactCache(store)
+
+    async def run():
+        return await asyncio.gather(*(cache.get("+1555") for _ in range(10)))
+
+    assert {record.name for record in asyncio.run(run())} == {"Ann"}
+    assert store.lookups == 1
@@ -0,0 +1,26 @@
+import asyncio
+
+from dispatch_tracker import DispatchTracker
+
+
+def test_wait_gives_up_after_max_call_seconds():
+    async def run():
+        tracker = DispatchTracker(None, max_call_seconds=0.05)
+        await tracker.track("AD_1", "room", "agent")
+        assert await tracker.wait("AD_1") == "failed"
+        assert (await tracker.lookup("AD_1"))["status"] == "failed"
+
+    asyncio.run(run())
+
+
+def test_evicted_and_untracked_dispatches_are_unknown():
+    async def run():
+        tracker = DispatchTracker(None, max_entries=1)
+        await tracker.track("AD_1", "room-1", "agent")
+        waiter = asyncio.create_task(tracker.wait("AD_1"))
+        await asyncio.sleep(0)
+        await tracker.track("AD_2", "room-2", "agent")
+        assert await asyncio.wait_for(waiter, 1) == "unknown"
+        assert await tracker.wait("AD_missing") == "unknown"
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+import asyncio
+import fcntl
+import os
+
+import pytest
+
+import event_bus
+
+
+def test_second_receiver_on_the_socket_fails_at_startup(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_bus, "EVENT_BUS", "unix")
+    monkeypatch.setattr(event_bus, "EVENT_BUS_SOCKET", str(tmp_path / "events.sock"))
+    # another API worker holding the socket
+    other = os.open(event_bus.EVENT_BUS_SOCKET + ".lock", os.O_RDWR | os.O_CREAT)
+    fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    try:
+        with pytest.raises(RuntimeError, match="EVENT_BUS=redis"):
+            asyncio.run(event_bus.start_server(lambda event: None))
+        assert not os.path.exists(event_bus.EVENT_BUS_SOCKET)
+    finally:
+        os.close(other)
+
+
+def test_events_reach_the_receiver(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_bus, "EVENT_BUS", "unix")
+    monkeypatch.setattr(event_bus, "EVENT_BUS_SOCKET", str(tmp_path / "events.sock"))
+    received = []
+
+    async def run():
+        await event_bus.start_server(received.append)
+        try:
+            publisher = event_bus.Publisher(event_bus._UnixSocketTransport(event_bus.EVENT_BUS_SOCKET))
+            for i in range(100):
+                publisher.publish({"event": "log", "message": str(i)})
+            for _ in range(100):
+                if len(received) == 100:
+                    break
+                await asyncio.sleep(event_bus.FLUSH_INTERVAL)
+        finally:
+            await event_bus.stop_server()
+
+    asyncio.run(run())
+    assert [event["message"] for event in received] == [str(i) for i in range(100)]
+
+
+def test_handler_error_does_not_drop_the_connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_bus, "EVENT_BUS", "unix")
+    monkeypatch.setattr(event_bus, "EVENT_BUS_SOCKET", str(tmp_path / "events.sock"))
+    received = []
+
+    def on_event(event):
+        if event["message"] == "bad":
+            raise KeyError("data")
+        received.append(event["message"])
+
+    async def run():
+        await event_bus.start_server(on_event)
+        try:
+            publisher = event_bus.Publisher(event_bus._UnixSocketTransport(event_bus.EVENT_BUS_SOCKET))
+            for message in ("before", "bad", "after"):
+                publisher.publish({"event": "log", "message": message})
+            for _ in range(100):
+                if len(received) == 2:
+                    break
+                await asyncio.sleep(event_bus.FLUSH_INTERVAL)
+        finally:
+            await event_bus.stop_server()
+
+    errors = event_bus.stats["handler_errors"]
+    asyncio.run(run())
+    assert received == ["before", "after"]
+    assert event_bus.stats["handler_errors"] == errors + 1
@@ -0,0 +1,85 @@
+import asyncio
+
+from aiohttp import web
+from livekit import api
+
+import livekit_client
+from livekit_client import LiveKitClient, _CachedAuthHeader, _token_cache_supported
+
+
+def _services(lkapi: api.LiveKitAPI):
+    return (lkapi.room, lkapi.sip, lkapi.agent_dispatch, lkapi.egress, lkapi.ingress)
+
+
+def test_sdk_still_has_the_patched_auth_header():
+    # _CachedAuthHeader replaces a private livekit-api method, fail here when an upgrade changes it
+    async def check():
+        lkapi = api.LiveKitAPI(url="http://127.0.0.1:1", api_key="key", api_secret="secret-secret-secret-secret-secret-32")
+        try:
+            assert all(_token_cache_supported(service) for service in _services(lkapi))
+        finally:
+            await lkapi.aclose()
+
+    asyncio.run(check())
+
+
+def test_cached_token_reused_until_close_to_expiry(monkeypatch):
+    async def check():
+        lkapi = api.LiveKitAPI(url="http://127.0.0.1:1", api_key="key", api_secret="secret-secret-secret-secret-secret-32")
+        try:
+            header = _CachedAuthHeader(lkapi.agent_dispatch)
+            grants = api.VideoGrants(room_admin=True, room="r")
+            first = header(grants)
+            assert header(grants) == first
+            assert header(api.VideoGrants(room_admin=True, room="other")) != first
+
+            # re-signed once inside the refresh margin
+            ttl = livekit_client.TOKEN_TTL.total_seconds()
+            (_, expires), = [entry for entry in header._cache.values() if entry[0] == first]
+            now = expires - livekit_client.TOKEN_REFRESH_MARGIN
+            monkeypatch.setattr(livekit_client.time, "time", lambda: now)
+            header(grants)
+            assert max(expiry for _, expiry in header._cache.values()) == now + ttl
+        finally:
+            await lkapi.aclose()
+
+    asyncio.run(check())
+
+
+def test_pooled_client_reuses_connection_and_token(monkeypatch):
+    async def check():
+        seen = []
+
+        async def create_dispatch(request: web.Request):
+            body = api.CreateAgentDispatchRequest.FromString(await request.read())
+            seen.append((request.headers["Authorization"], request.transport.get_extra_info("peername")))
+            dispatch = api.AgentDispatch(id="AD_1", agent_name=body.agent_name, room=body.room)
+            return web.Response(body=dispatch.SerializeToString(), content_type="application/protobuf")
+
+        app = web.Application()
+        app.router.add_post("/twirp/livekit.AgentDispatchService/CreateDispatch", create_dispatch)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setenv("LIVEKIT_URL", f"http://127.0.0.1:{port}")
+        monkeypatch.setenv("LIVEKIT_API_KEY", "key")
+        monkeypatch.setenv("LIVEKIT_API_SECRET", "secret-secret-secret-secret-secret-32")
+
+        client = LiveKitClient(mode="pooled")
+        await client.start()
+        try:
+            for room in ("a", "a"):
+                async with client.acquire() as lkapi:
+                    dispatch = await lkapi.agent_dispatch.create_dispatch(
+                        api.CreateAgentDispatchRequest(agent_name="agent", room=room)
+                    )
+                assert dispatch.room == room
+        finally:
+            await client.aclose()
+            await runner.cleanup()
+        # same signed token and the same keep-alive connection for both dispatches
+        assert seen[0] == seen[1]
+
+    asyncio.run(check())
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import logging
+
+import log_streamer
+
+
+class FakeWebSocket:
+    def __init__(self, block: asyncio.Event | None = None):
+        self.block = block
+        self.frames: list[list[dict]] = []
+
+    async def send_text(self, frame):
+        if self.block is not None:
+            await self.block.wait()
+        self.frames.append(json.loads(frame))
+
+    def messages(self):
+        return [record["message"] for frame in self.frames for record in frame]
+
+
+def _run(clients, records, until=None):
+    async def run():
+        await log_streamer.start()
+        try:
+            for websocket, filters in clients:
+                log_streamer.register_client(websocket, filters)
+            for record in records:
+                log_streamer.publish(record)
+            await asyncio.sleep(log_streamer.BATCH_INTERVAL * 3)
+            if until is not None:
+                await until()
+        finally:
+            await log_streamer.stop()
+
+    asyncio.run(run())
+
+
+def test_records_fan_out_by_subscription():
+    everything, also_everything = FakeWebSocket(), FakeWebSocket()
+    room_a, warnings_b = FakeWebSocket(), FakeWebSocket()
+    records = [
+        log_streamer.make_record("a info", context={"room": "a"}),
+        log_streamer.make_record("b info", context={"room": "b"}),
+        log_streamer.make_record("b warning", level=logging.WARNING, context={"room": "b"}),
+        log_streamer.make_record("no room", context={}),
+    ]
+    _run(
+        [
+            (everything, {}),
+            (also_everything, {}),
+            (room_a, {"room": "a"}),
+            (warnings_b, {"room": "b", "level": "WARNING"}),
+        ],
+        records,
+    )
+
+    assert everything.messages() == ["a info", "b info", "b warning", "no room"]
+    assert also_everything.messages() == everything.messages()
+    assert room_a.messages() == ["a info"]
+    assert warnings_b.messages() == ["b warning"]
+
+
+def test_slow_client_drops_oldest_frames_without_holding_up_others():
+    release = asyncio.Event()
+    slow, fast = FakeWebSocket(block=release), FakeWebSocket()
+    dropped = log_streamer.stats["records_dropped_client"]
+
+    async def publish_frames():
+        # one record per batch, enough batches to overflow the slow client's queue
+        for i in range(log_streamer.CLIENT_QUEUE_SIZE + 10):
+            log_streamer.publish(log_streamer.make_record(f"record {i}", context={}))
+            await asyncio.sleep(log_streamer.BATCH_INTERVAL * 1.5)
+        release.set()
+        await asyncio.sleep(log_streamer.BATCH_INTERVAL)
+
+    _run([(slow, {}), (fast, {})], [], until=publish_frames)
+
+    assert len(fast.messages()) == log_streamer.CLIENT_QUEUE_SIZE + 10
+    assert log_streamer.stats["records_dropped_client"] > dropped
+    # the slow client got its first frame and then the newest ones
+    assert slow.messages()[-1] == f"record {log_streamer.CLIENT_QUEUE_SIZE + 9}"
+    assert len(slow.messages()) <= log_streamer.CLIENT_QUEUE_SIZE + 1
+
+
+def test_tracebacks_reach_the_dashboards():
+    logger = logging.getLogger("test-log-streamer")
+    log_streamer.attach_handler(logger)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("lookup failed")
+    websocket = FakeWebSocket()
+
+    _run([(websocket, {})], [])
+
+    [record] = [r for frame in websocket.frames for r in frame if r["message"] == "lookup failed"]
+    assert record["level"] == "ERROR"
+    assert "ValueError: boom" in record["traceback"]
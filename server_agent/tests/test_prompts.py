@@ -0,0 +1,75 @@
+from livekit.agents import ChatContext, llm
+
+import prompts
+
+
+def test_instructions_start_with_the_static_prefix():
+    known = prompts.build_instructions("Jayden", "next Tuesday at 3pm")
+    unknown = prompts.build_instructions(None, None)
+
+    assert known.startswith(prompts.STATIC_INSTRUCTIONS)
+    assert unknown.startswith(prompts.STATIC_INSTRUCTIONS)
+    assert known.endswith("The customer's name is Jayden. Their appointment is on next Tuesday at 3pm.")
+    assert "don't have the customer's details" in unknown
+
+
+def test_greetings():
+    assert prompts.build_greeting("Jayden", "next Tuesday at 3pm").startswith("Hi Jayden,")
+    assert "next Tuesday at 3pm" in prompts.build_greeting("Jayden", "next Tuesday at 3pm")
+    # without both details the greeting asks who answered
+    assert prompts.build_greeting("Jayden", None) == prompts.render("greeting_unknown")
+
+
+def _chat(*turns):
+    chat = ChatContext.empty()
+    chat.add_message(role="system", content="Be brief.")
+    for i, (user, output) in enumerate(turns):
+        chat.add_message(role="user", content=user)
+        if output is not None:
+            chat.items.append(llm.FunctionCall(call_id=f"call-{i}", name="look_up_availability", arguments="{}"))
+            chat.items.append(
+                llm.FunctionCallOutput(call_id=f"call-{i}", name="look_up_availability", output=output, is_error=False)
+            )
+        chat.add_message(role="assistant", content="Okay.")
+    return chat
+
+
+def _types(chat):
+    return [item.role if item.type == "message" else item.type for item in chat.items]
+
+
+def test_oldest_turns_are_dropped_to_fit_the_budget():
+    chat = _chat(("a" * 400, None), ("b" * 400, "c" * 40), ("d" * 40, None))
+
+    trimmed = prompts.trim_history(chat, budget=150)
+
+    assert _types(trimmed) == [
+        "system", "user", "function_call", "function_call_output", "assistant", "user", "assistant"
+    ]
+    assert trimmed.items[1].text_content == "b" * 400
+    assert prompts.trim_history(chat, budget=0) is chat
+    assert prompts.trim_history(chat, budget=10_000) is chat
+
+
+def test_tool_output_is_never_sent_without_its_call():
+    chat = ChatContext.empty()
+    chat.add_message(role="system", content="Be brief.")
+    chat.add_message(role="user", content="a" * 400)
+    chat.items.append(llm.FunctionCall(call_id="call-0", name="look_up_availability", arguments="{}"))
+    chat.items.append(
+        llm.FunctionCallOutput(call_id="call-0", name="look_up_availability", output="b" * 400, is_error=False)
+    )
+
+    # the latest turn alone is over the budget, it goes whole
+    assert prompts.trim_history(chat, budget=150) is chat
+
+    chat.add_message(role="assistant", content="Okay.")
+    chat.add_message(role="user", content="c" * 40)
+    chat.items.append(llm.FunctionCall(call_id="call-1", name="look_up_availability", arguments="{}"))
+    chat.items.append(
+        llm.FunctionCallOutput(call_id="call-1", name="look_up_availability", output="d" * 800, is_error=False)
+    )
+
+    assert _types(prompts.trim_history(chat, budget=150)) == [
+        "system", "user", "function_call", "function_call_output"
+    ]
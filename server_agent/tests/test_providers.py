@@ -0,0 +1,129 @@
+import asyncio
+import random
+import threading
+import time
+
+import pytest
+
+import providers
+from providers import ProviderSpec
+
+
+class TrackedLLM(providers._FakeLLM):
+    """A fake with a fixed latency that counts the streams opened and closed"""
+
+    def __init__(self, name: str, latency: float, fail: float = 0.0):
+        super().__init__(name, latency, slow=0.0, fail=fail, rng=random.Random(0))
+        self.spec = ProviderSpec("llm", name)
+        self.opened = 0
+        self.closed = 0
+
+    async def chat(self):
+        self.opened += 1
+        try:
+            async for token in super().chat():
+                yield token
+        finally:
+            self.closed += 1
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(providers, "HEDGE", True)
+    monkeypatch.setattr(providers, "DEFAULT_DEADLINE", {"llm": 0.05, "tts": 0.05})
+    return providers.ProviderRouter(stats_path=None)
+
+
+def _stream(router, *fakes, on_first=None):
+    async def run():
+        tokens = []
+        stream = router.hedge([(fake.spec, fake) for fake in fakes], lambda spec, fake: fake.chat())
+        async for token in stream:
+            if not tokens and on_first is not None:
+                on_first()
+            tokens.append(token)
+        return tokens
+
+    return asyncio.run(run())
+
+
+def test_hedge_fires_after_the_deadline(router):
+    slow, fast = TrackedLLM("slow", 0.5), TrackedLLM("fast", 0.01)
+
+    started = time.monotonic()
+    tokens = _stream(router, slow, fast)
+
+    assert tokens == ["hello", " there"]
+    assert time.monotonic() - started < 0.3
+    assert router.hedges == 1
+    assert fast.opened == 1
+
+
+def test_no_hedge_when_the_first_answers_in_time(router):
+    first, second = TrackedLLM("first", 0.01), TrackedLLM("second", 0.01)
+
+    assert _stream(router, first, second) == ["hello", " there"]
+    assert router.hedges == 0
+    assert second.opened == 0
+
+
+def test_winner_is_used_and_loser_cancelled_and_closed(router):
+    slow, fast = TrackedLLM("slow", 0.5), TrackedLLM("fast", 0.01)
+    at_first_token = {}
+
+    def on_first():
+        at_first_token.update(slow_closed=slow.closed, fast_closed=fast.closed)
+
+    assert _stream(router, slow, fast, on_first=on_first) == ["hello", " there"]
+    # the loser was closed before the winner's first token reached the caller
+    assert at_first_token == {"slow_closed": 1, "fast_closed": 0}
+    assert fast.closed == 1
+    # only the winner's latency was recorded
+    assert router.stats[fast.spec.key].latencies()
+    assert not router.stats[slow.spec.key].samples
+
+
+def test_failover_on_error(router, monkeypatch):
+    monkeypatch.setattr(providers, "HEDGE", False)
+    broken, backup = TrackedLLM("broken", 0.01, fail=1.0), TrackedLLM("backup", 0.01)
+
+    assert _stream(router, broken, backup) == ["hello", " there"]
+    assert router.failovers == 1
+    assert [latency for _, latency in router.stats[broken.spec.key].samples] == [None]
+
+
+def test_last_error_is_raised_when_all_fail(router):
+    first, second = TrackedLLM("first", 0.01, fail=1.0), TrackedLLM("second", 0.01, fail=1.0)
+
+    with pytest.raises(ConnectionError, match="second returned 503"):
+        _stream(router, first, second)
+    assert router.failovers == 1
+    assert first.closed == second.closed == 1
+
+
+def test_request_falls_through_when_the_first_has_no_quota(router, monkeypatch):
+    async def acquire(provider, wait=True):
+        return provider != "first"
+
+    monkeypatch.setattr(providers.rate_limits, "acquire", acquire)
+    first, second = TrackedLLM("first", 0.01), TrackedLLM("second", 0.01)
+
+    assert _stream(router, first, second) == ["hello", " there"]
+    assert (first.opened, second.opened) == (0, 1)
+
+
+def test_concurrent_saves_keep_every_jobs_samples(tmp_path):
+    path = str(tmp_path / "stats.json")
+
+    def job(i):
+        router = providers.ProviderRouter(stats_path=path)
+        router.record(ProviderSpec("llm", f"provider-{i}"), 0.1)
+        router.save()
+
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(providers.ProviderRouter(stats_path=path).stats) == 16
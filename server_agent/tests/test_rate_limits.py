@@ -0,0 +1,111 @@
+import asyncio
+import fcntl
+import os
+import time
+
+import pytest
+
+import providers
+import rate_limits
+from test_providers import TrackedLLM, _stream
+
+
+@pytest.fixture
+def limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limits, "RATE_LIMIT_DIR", str(tmp_path))
+    monkeypatch.setattr(rate_limits, "_buckets", {})
+    monkeypatch.setattr(rate_limits, "_waited", {})
+    rate_limits.set_answered(True)
+
+    def set_limits(**limits):
+        monkeypatch.setattr(rate_limits, "LIMITS", limits)
+
+    return set_limits
+
+
+def _drain(*names):
+    async def run():
+        for name in names:
+            assert await rate_limits.acquire(name)
+
+    asyncio.run(run())
+
+
+def test_acquire_does_not_block_the_loop_on_a_held_lock(tmp_path, limits):
+    limits(held=(100.0, 100.0))
+    # another process' update in progress
+    other = os.open(tmp_path / "held", os.O_RDWR | os.O_CREAT)
+    fcntl.flock(other, fcntl.LOCK_EX)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        asyncio.get_running_loop().call_later(0.2, fcntl.flock, other, fcntl.LOCK_UN)
+        started = time.monotonic()
+        await rate_limits.acquire("held")
+        ticker.cancel()
+        return time.monotonic() - started, ticks
+
+    elapsed, ticks = asyncio.run(run())
+    os.close(other)
+    assert elapsed >= 0.2
+    assert ticks >= 10
+
+
+def test_acquire_without_wait_only_takes_a_free_token(limits):
+    limits(provider=(1.0, 1.0))
+
+    async def run():
+        return [await rate_limits.acquire("provider", wait=False) for _ in range(2)]
+
+    assert asyncio.run(run()) == [True, False]
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(providers, "HEDGE", True)
+    monkeypatch.setattr(providers, "DEFAULT_DEADLINE", {"llm": 0.05, "tts": 0.05})
+    return providers.ProviderRouter(stats_path=None)
+
+
+def test_rate_limit_wait_is_not_counted_against_the_hedge_deadline(limits, router):
+    # the next token is 0.2s away, well past the deadline
+    limits(first=(5.0, 1.0))
+    _drain("first")
+    first, second = TrackedLLM("first", 0.01), TrackedLLM("second", 0.01)
+
+    assert _stream(router, first, second) == ["hello", " there"]
+    assert router.hedges == 0
+    assert second.opened == 0
+    assert router.stats[first.spec.key].latencies()[0] < 0.05
+
+
+def test_no_hedge_to_a_provider_without_quota(limits, router):
+    limits(second=(0.1, 1.0))
+    _drain("second")
+    first, second = TrackedLLM("first", 0.2), TrackedLLM("second", 0.01)
+
+    assert _stream(router, first, second) == ["hello", " there"]
+    assert router.hedges == 0
+    assert second.opened == 0
+
+
+def test_unanswered_call_gets_a_token_from_a_small_burst(limits):
+    limits(small=(1.0, 1.0), pair=(1.0, 2.0))
+    rate_limits.set_answered(False)
+
+    async def run():
+        return [await rate_limits.acquire(name, wait=False) for name in ("small", "small", "pair", "pair")]
+
+    try:
+        # one of the pair's two tokens is kept for answered calls
+        assert asyncio.run(run()) == [True, False, True, False]
+    finally:
+        rate_limits.set_answered(True)
@@ -0,0 +1,55 @@
+import asyncio
+import os
+
+import psutil
+import pytest
+
+import recorder
+
+
+@pytest.fixture
+def encoder(tmp_path, monkeypatch):
+    monkeypatch.setattr(recorder, "ENCODER_SOCKET", str(tmp_path / "encoder.sock"))
+    monkeypatch.setattr(recorder, "FLUSH_INTERVAL", 0.05)
+    # the encoder service is a new process, it sweeps the RECORDINGS_DIR of its environment
+    monkeypatch.setenv("RECORDINGS_DIR", str(tmp_path))
+    yield
+    if recorder._service is not None:
+        recorder._service.terminate()
+        recorder._service.wait()
+        recorder._service = None
+
+
+def _record(root, rooms):
+    async def call(room):
+        call_recorder = recorder.CallRecorder(room, root=str(root))
+        call_recorder.start()
+        track = call_recorder.track("callee")
+        for _ in range(50):
+            call_recorder.push(track, recorder._Frame(bytes(640)))
+        await asyncio.sleep(0.1)
+        await call_recorder.aclose()
+
+    async def run():
+        await asyncio.gather(*(call(room) for room in rooms))
+
+    asyncio.run(run())
+
+
+def test_calls_share_one_encoder(tmp_path, encoder):
+    _record(tmp_path, ["a", "b", "c"])
+
+    for room in ("a", "b", "c"):
+        path = tmp_path / room / "callee-0001.wav"
+        assert os.path.getsize(path) == recorder._HEADER.size + 50 * 640
+    children = psutil.Process().children(recursive=True)
+    assert [p.pid for p in children] == [recorder._service.pid]
+
+
+def test_encoder_is_restarted_when_it_dies(tmp_path, encoder):
+    _record(tmp_path, ["a"])
+    recorder._service.kill()
+    recorder._service.wait()
+
+    _record(tmp_path, ["b"])
+    assert (tmp_path / "b" / "callee-0001.wav").exists()
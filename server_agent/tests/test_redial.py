@@ -0,0 +1,49 @@
+import asyncio
+import datetime
+
+import pytest
+
+import redial
+
+NEW_YORK = "America/New_York"
+
+
+def _ts(*args):
+    return datetime.datetime(*args, tzinfo=redial._zone(NEW_YORK)).timestamp()
+
+
+@pytest.fixture
+def window(monkeypatch):
+    monkeypatch.setattr(redial, "CALL_WINDOW", (datetime.time(8, 30), datetime.time(19, 45)))
+
+
+def test_call_window_compares_minutes(window):
+    assert redial.into_call_window(_ts(2026, 3, 2, 19, 30), NEW_YORK) == _ts(2026, 3, 2, 19, 30)
+    assert redial.into_call_window(_ts(2026, 3, 2, 19, 50), NEW_YORK) == _ts(2026, 3, 3, 8, 30)
+    assert redial.into_call_window(_ts(2026, 3, 2, 8, 15), NEW_YORK) == _ts(2026, 3, 2, 8, 30)
+    assert redial.into_call_window(_ts(2026, 3, 2, 8, 45), NEW_YORK) == _ts(2026, 3, 2, 8, 45)
+
+
+def test_window_times_are_parsed():
+    assert redial._parse_window_time("9") == datetime.time(9)
+    assert redial._parse_window_time("19:45") == datetime.time(19, 45)
+    assert redial._parse_window_time("24") == datetime.time.max
+
+
+def test_agent_queues_failed_dial_without_the_bus(tmp_path, monkeypatch):
+    monkeypatch.setattr(redial, "REDIAL_DB", str(tmp_path / "redial.db"))
+    monkeypatch.setattr(redial, "REDIAL_API_URL", "")
+    failure = {
+        "room": "call-1",
+        "agent_name": "outbound-caller",
+        "dial_info": {"phone_number": "+15550000000", "transfer_to": ""},
+        "sip_status_code": "486",
+    }
+    asyncio.run(redial.report_dial_failed(failure))
+    # the same failure over the event bus is ignored
+    queue = redial.RedialQueue()
+    redial.RedialScheduler(queue, None).on_dial_failed(failure)
+
+    assert queue.stats()["by_status"] == {"pending": 1}
+    assert queue.stats()["pending_by_sip_status"] == {486: 1}
+    queue.close()
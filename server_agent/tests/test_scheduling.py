@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import bookings
+import scheduling
+
+
+@pytest.fixture
+def schedule_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduling, "SCHEDULE_DB", str(tmp_path / "schedule.db"))
+    monkeypatch.setattr(scheduling, "_index", None)
+    monkeypatch.setattr(bookings, "_store", None)
+    return scheduling.SCHEDULE_DB
+
+
+def test_past_times_are_not_offered():
+    index = scheduling.SlotIndex()
+    today = datetime.date(2026, 3, 2)
+    for start in (540, 600, 660):
+        index.add("dr-a", today, start)
+        index.add("dr-a", today - datetime.timedelta(days=1), start)
+    now = datetime.datetime(2026, 3, 2, 10, 0, 30)
+
+    assert index.free_times(today, now=now) == [660]
+    assert index.free_times(today - datetime.timedelta(days=1), now=now) == []
+    assert index.providers_at(today, 600, now=now) == []
+    assert index.providers_at(today, 660, now=now) == ["dr-a"]
+
+
+def test_index_is_rebuilt_after_bookings(schedule_db):
+    conn = scheduling.connect()
+    scheduling._seed_slots(conn, 100, providers=1)
+    index = scheduling.get_index()
+    day = min(index._free)
+    # booked by another process, this one's index still has it
+    conn.execute(
+        "INSERT INTO bookings (call_id, provider, date, start, booked_at) VALUES ('other', 'dr-0', ?, 480, 0)",
+        (day.isoformat(),),
+    )
+    conn.close()
+    assert 480 in index.free_times(day)
+
+    async def book():
+        store = bookings.get_store()
+        assert await store.hold("ours", day, 490, ["dr-0"]) == "dr-0"
+        assert await store.book(bookings.Booking("ours", "dr-0", day, 490))
+
+    asyncio.run(book())
+    scheduling.get_index()  # starts the rebuild
+    scheduling._rebuild.join()
+    assert scheduling.get_index().free_times(day)[:2] == [500, 510]
+
+
+def test_tool_round_trip_under_10ms_with_100k_slots(schedule_db):
+    from agent import OutboundCaller
+
+    conn = scheduling.connect()
+    scheduling._seed_slots(conn, 100_000)
+    conn.close()
+    scheduling.get_index()
+    day = (datetime.date.today() + datetime.timedelta(days=3)).isoformat()
+
+    async def run():
+        agent = OutboundCaller(
+            name=None,
+            appointment_time=None,
+            dial_info={"phone_number": "+15550000000", "transfer_to": ""},
+            call_id="round-trip",
+            call_providers=SimpleNamespace(tts_voice=lambda: "voice"),
+        )
+        agent.set_participant(SimpleNamespace(identity="+15550000000"))
+        ctx = SimpleNamespace(session=None)
+        lookups, confirms = [], []
+        for i in range(50):
+            started = time.perf_counter()
+            result = await agent.look_up_availability(ctx, date=day)
+            lookups.append(time.perf_counter() - started)
+            assert len(result["available_times"]) == scheduling.MAX_OFFERED_TIMES
+
+            started = time.perf_counter()
+            result = await agent.confirm_appointment(ctx, date=day, time=result["available_times"][0])
+            confirms.append(time.perf_counter() - started)
+            assert result == "reservation confirmed"
+        return sorted(lookups), sorted(confirms)
+
+    lookups, confirms = asyncio.run(run())
+    assert lookups[len(lookups) // 2] < 0.010
+    assert confirms[len(confirms) // 2] < 0.010
@@ -0,0 +1,68 @@
+import asyncio
+import gc
+import os
+
+from livekit import rtc
+
+import tts_cache
+
+
+def _cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(tts_cache, "CACHE_DIR", str(tmp_path))
+    cache = tts_cache.PhraseCache("voice", ["One moment."])
+    frame = rtc.AudioFrame(b"\0\0" * 1600, 16000, 1, 1600)
+    asyncio.run(cache.store("One moment.", [frame]))
+    return cache
+
+
+def test_map_is_closed_when_audio_is_dropped_unplayed(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, monkeypatch)
+    audio = cache.get("one moment.")
+    buf = audio._buf
+    del audio
+    gc.collect()
+    assert buf.closed
+
+
+def test_map_is_closed_when_playback_stops_early(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, monkeypatch)
+
+    async def play_one_frame():
+        with cache.get("one moment.") as audio:
+            frames = audio.frames()
+            await anext(frames)
+        return audio
+
+    audio = asyncio.run(play_one_frame())
+    assert audio._buf.closed
+    assert cache.hits == 1
+
+
+def test_truncated_file_is_a_miss(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, monkeypatch)
+    with open(cache._path("one moment."), "wb") as f:
+        f.write(b"\x80>")
+
+    assert cache.get("one moment.") is None
+    assert cache.misses == 1
+
+
+def test_phrase_is_stored_under_the_voice_that_served_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(tts_cache, "CACHE_DIR", str(tmp_path))
+    cache = tts_cache.PhraseCache("elevenlabs:voice:model", ["Thanks."])
+
+    async def text():
+        yield "Thanks."
+
+    async def fallback(text, on_voice):
+        async for _ in text:
+            pass
+        on_voice("tts:cartesia")
+        yield rtc.AudioFrame(b"\0\0" * 1600, 16000, 1, 1600)
+
+    async def speak():
+        return [frame async for frame in cache.tts_node(text(), fallback)]
+
+    assert len(asyncio.run(speak())) == 1
+    assert cache.get("thanks.") is None
+    assert os.path.exists(cache._path("thanks.", "tts:cartesia"))
@@ -0,0 +1,73 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+from livekit.agents import metrics
+from prometheus_client import REGISTRY
+
+import turn_metrics
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_job_setup_and_prewarm_events_are_exported():
+    first = _sample("outbound_job_setup_seconds_count", job="first")
+    later = _sample("outbound_job_setup_seconds_count", job="later")
+    prewarm = _sample("outbound_worker_prewarm_seconds_count")
+
+    turn_metrics.observe({"event": "prewarm", "data": {"seconds": 1.2}})
+    turn_metrics.observe({"event": "job_setup", "data": {"seconds": 0.4, "first": True}})
+    turn_metrics.observe({"event": "job_setup", "data": {"seconds": 0.02, "first": False}})
+
+    assert _sample("outbound_worker_prewarm_seconds_count") == prewarm + 1
+    assert _sample("outbound_job_setup_seconds_count", job="first") == first + 1
+    assert _sample("outbound_job_setup_seconds_count", job="later") == later + 1
+
+
+class FakeSession:
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    def emit(self, event, **fields):
+        self.handlers[event](SimpleNamespace(**fields))
+
+
+def test_turn_breakdown_is_logged_and_exported(caplog):
+    session = FakeSession()
+    collector = turn_metrics.TurnCollector(session)
+    stt_final = _sample("outbound_turn_stage_seconds_count", stage="stt_final")
+    playout = _sample("outbound_turn_stage_seconds_count", stage="playout_start")
+    llm_sum = _sample("outbound_turn_stage_seconds_sum", stage="llm_ttft")
+    cached = _sample("outbound_llm_prompt_tokens_sum", kind="cached")
+
+    session.emit("user_state_changed", old_state="speaking", new_state="listening")
+    session.emit("speech_created", source="generate_reply", speech_handle=SimpleNamespace(id="reply-1"))
+    for m in (
+        metrics.EOUMetrics.model_construct(speech_id="reply-1", transcription_delay=0.2, end_of_utterance_delay=0.4),
+        metrics.LLMMetrics.model_construct(speech_id="reply-1", ttft=0.3, prompt_tokens=900, prompt_cached_tokens=600),
+        # a second LLM request of the same reply, after a tool call
+        metrics.LLMMetrics.model_construct(speech_id="reply-1", ttft=0.9, prompt_tokens=1000, prompt_cached_tokens=0),
+        metrics.TTSMetrics.model_construct(speech_id="reply-1", ttfb=0.15),
+    ):
+        session.emit("metrics_collected", metrics=m)
+    with caplog.at_level(logging.INFO, logger="outbound-caller"):
+        session.emit("agent_state_changed", old_state="thinking", new_state="speaking")
+
+    [record] = [r for r in caplog.records if getattr(r, "event", None) == "turn"]
+    assert record.data["llm_ttft"] == 0.3
+    assert record.data["prompt_tokens"] == 900
+    assert set(turn_metrics.STAGES) <= set(record.data)
+    assert collector.turns == 1
+    assert collector.summary()["end_of_turn"]["p50"] == 0.4
+
+    turn_metrics.observe({"event": record.event, "data": record.data})
+
+    assert _sample("outbound_turn_stage_seconds_count", stage="stt_final") == stt_final + 1
+    assert _sample("outbound_turn_stage_seconds_count", stage="playout_start") == playout + 1
+    assert _sample("outbound_turn_stage_seconds_sum", stage="llm_ttft") == pytest.approx(llm_sum + 0.3)
+    assert _sample("outbound_llm_prompt_tokens_sum", kind="cached") == cached + 600
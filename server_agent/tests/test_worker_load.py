@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import worker_load
+
+
+@pytest.fixture
+def load_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker_load, "LOAD_ROOT", str(tmp_path))
+    directory = tmp_path / "outbound-caller-load-worker-1"
+    directory.mkdir()
+    return directory
+
+
+def test_reports_of_dead_job_processes_are_removed(load_root):
+    dead = multiprocessing.get_context("fork").Process(target=lambda: None)
+    dead.start()
+    dead.join()
+    (load_root / f"{os.getpid()}-job-live").write_text("0.0100 0.2000")
+    (load_root / f"{dead.pid}-job-dead").write_text("0.5000 0.9000")
+
+    assert worker_load._read_reports(str(load_root)) == [(0.01, 0.2)]
+    assert sorted(os.listdir(load_root)) == [f"{os.getpid()}-job-live"]
+
+
+def test_lag_over_budget_saturates_the_worker(load_root):
+    (load_root / f"{os.getpid()}-job-a").write_text(f"{worker_load.LAG_BUDGET:.4f} 0.2000")
+
+    load = worker_load.compute_load(SimpleNamespace(id="worker-1", active_jobs=[object()]))
+
+    assert load >= worker_load.LOAD_THRESHOLD
+    assert worker_load.saturated()
+
+
+def test_load_counts_this_workers_call_cpu_only(load_root, monkeypatch):
+    monkeypatch.setattr(worker_load, "CORES", 2)
+    # the host is busy, but with other processes
+    monkeypatch.setattr(worker_load.psutil, "cpu_percent", lambda *args, **kwargs: 100.0)
+    for job in ("a", "b", "c"):
+        (load_root / f"{os.getpid()}-job-{job}").write_text("0.0010 0.3000")
+
+    load = worker_load.compute_load(SimpleNamespace(id="worker-1", active_jobs=[object()] * 3))
+
+    assert worker_load.get_stats()["cpu"] == pytest.approx(0.45)
+    assert worker_load.get_stats()["cpu_per_call"] == pytest.approx(0.3)
+    assert load == pytest.approx(0.45)
+    assert not worker_load.saturated()
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import weakref
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
+
+from livekit import rtc
+from livekit.agents import tts
+
+logger = logging.getLogger("outbound-caller")
+
+# shared by every worker process on the host, so a phrase is synthesized once
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+MAX_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB", "64")) * 1024 * 1024)
+FRAME_MS = 20
+
+# sample rate, channels; followed by int16 PCM
+_HEADER = struct.Struct("<II")
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+class CachedAudio:
+    """A cached phrase, memory-mapped so the first frame is ready without reading the file.
+
+    The map is closed once frames() is done, on close(), or when the object is
+    dropped without being played.
+    """
+
+    def __init__(self, buf: mmap.mmap):
+        self._buf = buf
+        self._close = weakref.finalize(self, buf.close)
+        self.sample_rate, self.num_channels = _HEADER.unpack_from(buf)
+        self.duration = (len(buf) - _HEADER.size) / (2 * self.num_channels * self.sample_rate)
+
+    def close(self):
+        self._close()
+
+    def __enter__(self) -> CachedAudio:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def frames(self) -> AsyncIterator[rtc.AudioFrame]:
+        samples = self.sample_rate * FRAME_MS // 1000
+        step = samples * self.num_channels * 2
+        try:
+            for offset in range(_HEADER.size, len(self._buf), step):
+                chunk = self._buf[offset : offset + step]
+                yield rtc.AudioFrame(
+                    data=chunk,
+                    sample_rate=self.sample_rate,
+                    num_channels=self.num_channels,
+                    samples_per_channel=len(chunk) // (2 * self.num_channels),
+                )
+        finally:
+            self.close()
+
+
+class PhraseCache:
+    """Synthesized audio for fixed phrases, keyed on voice and normalized text.
+
+    The voice names the TTS provider, voice and model that produced the audio
+    (providers.tts_voice); lookups are for the provider tried first. Each phrase is a PCM file under CACHE_DIR. Hits touch the file's mtime and
+    stores evict the least recently used files once the directory is over
+    MAX_BYTES. Only registered phrases are cached, since LLM replies rarely repeat.
+    """
+
+    def __init__(self, voice: str, phrases: Iterable[str] = ()):
+        self.voice = voice
+        self._phrases = sorted({normalize(p) for p in phrases})
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, text: str, voice: str | None = None) -> str:
+        key = f"{voice or self.voice}\0{normalize(text)}".encode()
+        return os.path.join(CACHE_DIR, hashlib.sha1(key).hexdigest() + ".pcm")
+
+    def is_phrase(self, text: str) -> bool:
+        text = normalize(text)
+        i = bisect.bisect_left(self._phrases, text)
+        return i < len(self._phrases) and self._phrases[i] == text
+
+    def _could_be_phrase(self, text: str) -> bool:
+        text = normalize(text)
+        i = bisect.bisect_left(self._phrases, text)
+        return i < len(self._phrases) and self._phrases[i].startswith(text)
+
+    def get(self, text: str) -> CachedAudio | None:
+        path = self._path(text)
+        try:
+            with open(path, "rb") as f:
+                audio = CachedAudio(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (FileNotFoundError, ValueError, struct.error):  # empty or truncated file
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted meanwhile, the map stays readable
+        self.hits += 1
+        return audio
+
+    def _store(self, text: str, frames: list[rtc.AudioFrame], voice: str | None):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = self._path(text, voice)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(frames[0].sample_rate, frames[0].num_channels))
+            for frame in frames:
+                f.write(frame.data.tobytes())
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith(".pcm"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    async def store(self, text: str, frames: list[rtc.AudioFrame], voice: str | None = None):
+        """Cache a phrase spoken in `voice`, this cache's own by default"""
+        if not frames:
+            return
+        try:
+            await asyncio.to_thread(self._store, text, frames, voice)
+        except OSError as e:
+            logger.warning(f"could not cache tts for {text!r}: {e}")
+
+    async def warm(
+        self,
+        engine: tts.TTS,
+        phrases: Iterable[str],
+        acquire: Callable[[], Awaitable[None]] | None = None,
+    ):
+        """Synthesize the phrases missing from the cache, after `acquire()` if given.
+
+        `engine` must be the provider the cache's voice describes.
+        """
+        for phrase in phrases:
+            if os.path.exists(self._path(phrase)):
+                continue
+            try:
+                if acquire is not None:
+                    await acquire()
+                async with engine.synthesize(phrase) as stream:
+                    await self.store(phrase, [ev.frame async for ev in stream])
+            except Exception as e:
+                logger.warning(f"could not synthesize {phrase!r}: {e}")
+
+    async def tts_node(
+        self,
+        text: AsyncIterable[str],
+        synthesize: Callable[[AsyncIterable[str], Callable[[str], None]], AsyncIterable[rtc.AudioFrame]],
+    ) -> AsyncIterator[rtc.AudioFrame]:
+        """Agent.tts_node: play registered phrases from the cache, stream everything else.
+
+        Text is only held back while it could still be a registered phrase, which
+        for LLM replies is usually the first token. `synthesize` reports the voice
+        that served the audio, which a phrase is stored under.
+        """
+        chunks = aiter(text)
+        buffered: list[str] = []
+        complete = True
+        async for chunk in chunks:
+            buffered.append(chunk)
+            if not self._could_be_phrase("".join(buffered)):
+                complete = False
+                break
+
+        full_text = "".join(buffered)
+        cacheable = complete and self.is_phrase(full_text)
+        if cacheable:
+            cached = self.get(full_text)
+            if cached is not None:
+                with cached:
+                    async for frame in cached.frames():
+                        yield frame
+                return
+
+        async def replay() -> AsyncIterator[str]:
+            for chunk in buffered:
+                yield chunk
+            async for chunk in chunks:
+                yield chunk
+
+        frames = []
+        voices: list[str] = []
+        async for frame in synthesize(replay(), voices.append):
+            if cacheable:
+                frames.append(frame)
+            yield frame
+        if cacheable and voices:
+            await self.store(full_text, frames, voices[-1])
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def log_summary(self):
+        """Shutdown callback: the call's cache hit rate"""
+        stats = self.get_stats()
+        logger.info(
+            f"tts cache: {stats['hits']} hits, {stats['misses']} misses",
+            extra={"event": "tts_cache", "data": stats},
+        )
+
+
+if __name__ == "__main__":
+    # python tts_cache.py warm: synthesize the agent's fixed phrases before starting workers
+    if sys.argv[1:] != ["warm"]:
+        sys.exit("usage: python tts_cache.py warm")
+
+    import aiohttp
+    from livekit.plugins import elevenlabs
+
+    import providers
+    from agent import CACHED_PHRASES, TTS_MODEL, TTS_VOICE_ID
+
+    async def main():
+        voice = providers.tts_voice(
+            providers.ProviderSpec("tts", "elevenlabs"), {"voice_id": TTS_VOICE_ID, "model": TTS_MODEL}
+        )
+        async with aiohttp.ClientSession() as http:
+            engine = elevenlabs.TTS(voice_id=TTS_VOICE_ID, model=TTS_MODEL, http_session=http)
+            await PhraseCache(voice).warm(engine, CACHED_PHRASES)
+        print(f"cached {len(CACHED_PHRASES)} phrases in {CACHE_DIR}")
+
+    asyncio.run(main())
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict
+
+from livekit.agents import AgentSession, metrics
+from prometheus_client import Counter, Histogram
+
+from percentiles import percentile
+
+logger = logging.getLogger("outbound-caller")
+
+# seconds from the user's end of speech to each point of the agent's reply
+STAGES = ("stt_final", "end_of_turn", "llm_ttft", "tts_ttfb", "playout_start")
+# input tokens of the turn's first LLM request, and how many the provider had cached
+TOKENS = ("prompt_tokens", "prompt_cached_tokens")
+
+TURN_SECONDS = Histogram(
+    "outbound_turn_stage_seconds",
+    "Latency of each stage of a conversational turn",
+    ["stage"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0),
+)
+TURNS = Counter("outbound_turns_total", "Conversational turns measured")
+FIRST_WORD_SECONDS = Histogram(
+    "outbound_time_to_first_word_seconds",
+    "Time from the callee answering to the agent starting to speak",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0),
+)
+PROMPT_TOKENS = Histogram(
+    "outbound_llm_prompt_tokens",
+    "Input tokens of the first LLM request of each turn, and the cached part of them",
+    ["kind"],
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000),
+)
+JOB_SETUP_SECONDS = Histogram(
+    "outbound_job_setup_seconds",
+    "Time from joining the room to the agent session being set up, for the first and later jobs of a worker process",
+    ["job"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+PREWARM_SECONDS = Histogram(
+    "outbound_worker_prewarm_seconds",
+    "Time to load the VAD and other per-process models in a worker process",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+class TurnCollector:
+    """Per-turn timings for one call, from the session's metrics and state events.
+
+    LiveKit reports STT/end-of-turn, LLM and TTS metrics separately, tied
+    together by speech id; playout start is measured here from the user going
+    quiet to the agent starting to speak. Each turn is logged as a "turn"
+    event (tagged with the call's room and phone number), which the API turns
+    into Prometheus histograms and the dashboard shows as it happens.
+    """
+
+    def __init__(self, session: AgentSession):
+        # speech id -> stage -> seconds, until the turn is logged
+        self._turns: dict[str, dict[str, float]] = {}
+        self._finished: set[str] = set()
+        self._reply_id: str | None = None
+        self._user_stopped_at: float | None = None
+        self._answered_at: float | None = None
+        self.time_to_first_word: float | None = None
+        self.history: dict[str, list[float]] = defaultdict(list)
+        self.turns = 0
+
+        session.on("metrics_collected", self._on_metrics)
+        session.on("speech_created", self._on_speech_created)
+        session.on("user_state_changed", self._on_user_state)
+        session.on("agent_state_changed", self._on_agent_state)
+
+    def _on_metrics(self, ev):
+        m = ev.metrics
+        if isinstance(m, metrics.EOUMetrics):
+            stages = {"stt_final": m.transcription_delay, "end_of_turn": m.end_of_utterance_delay}
+        elif isinstance(m, metrics.LLMMetrics):
+            stages = {
+                "llm_ttft": m.ttft,
+                "prompt_tokens": m.prompt_tokens,
+                "prompt_cached_tokens": getattr(m, "prompt_cached_tokens", 0),
+            }
+        elif isinstance(m, metrics.TTSMetrics):
+            stages = {"tts_ttfb": m.ttfb}
+        else:
+            return
+        if not m.speech_id or m.speech_id in self._finished:
+            return
+        turn = self._turns.setdefault(m.speech_id, {})
+        for stage, seconds in stages.items():
+            # a reply with tool calls runs the LLM more than once, the first one counts
+            turn.setdefault(stage, seconds)
+        if all(stage in turn for stage in STAGES):
+            self._finish(m.speech_id)
+
+    def _on_speech_created(self, ev):
+        if ev.source != "say":
+            self._reply_id = ev.speech_handle.id
+
+    def _on_user_state(self, ev):
+        if ev.new_state == "speaking":
+            # the previous reply is over, log whatever was measured for it
+            self.flush()
+        elif ev.old_state == "speaking":
+            self._user_stopped_at = time.monotonic()
+
+    def mark_answered(self):
+        """The callee picked up; time_to_first_word runs until the agent speaks"""
+        self._answered_at = time.monotonic()
+
+    def _on_agent_state(self, ev):
+        if ev.new_state == "speaking" and self._answered_at is not None:
+            self.time_to_first_word = time.monotonic() - self._answered_at
+            self._answered_at = None
+            logger.info(
+                f"time to first word: {self.time_to_first_word * 1000:.0f}ms",
+                extra={"event": "first_word", "data": {"seconds": self.time_to_first_word}},
+            )
+        if ev.new_state != "speaking" or self._user_stopped_at is None:
+            return
+        # first audio the caller hears after their turn, a filler counts too
+        self._user_stopped_at, stopped_at = None, self._user_stopped_at
+        if self._reply_id is None or self._reply_id in self._finished:
+            return
+        turn = self._turns.setdefault(self._reply_id, {})
+        turn["playout_start"] = time.monotonic() - stopped_at
+        if all(stage in turn for stage in STAGES):
+            self._finish(self._reply_id)
+
+    def _finish(self, speech_id: str):
+        turn = self._turns.pop(speech_id)
+        self._finished.add(speech_id)
+        # speech that doesn't answer the user (say(), fillers) has no LLM or EOU timing
+        if "llm_ttft" not in turn and "end_of_turn" not in turn:
+            return
+        self.turns += 1
+        for stage, value in turn.items():
+            self.history[stage].append(value)
+        breakdown = ", ".join(f"{s} {turn[s] * 1000:.0f}ms" for s in STAGES if s in turn)
+        if "prompt_tokens" in turn:
+            breakdown += f", {turn['prompt_tokens']} prompt tokens ({turn['prompt_cached_tokens']} cached)"
+        logger.info(
+            f"turn {self.turns}: {breakdown}",
+            extra={"event": "turn", "data": {"speech_id": speech_id, **turn}},
+        )
+
+    def flush(self):
+        for speech_id in list(self._turns):
+            self._finish(speech_id)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "turns": self.turns,
+            "time_to_first_word": self.time_to_first_word,
+            **{
+                stage: {
+                    "p50": percentile(values, 0.5),
+                    "p95": percentile(values, 0.95),
+                    "max": max(values),
+                }
+                for stage, values in self.history.items()
+            },
+        }
+
+    async def log_summary(self):
+        """Shutdown callback: the call's timing breakdown for the dashboard"""
+        self.flush()
+        summary = self.summary()
+        p50 = ", ".join(
+            f"{s} {summary[s]['p50'] * 1000:.0f}ms" for s in STAGES if s in summary
+        )
+        logger.info(
+            f"call latency over {self.turns} turns (p50): {p50}",
+            extra={"event": "call_latency", "data": summary},
+        )
+
+
+def observe(event: Dict[str, Any]):
+    """Feed "turn", "first_word" and job setup events from jobs into the Prometheus histograms (API side)"""
+    if event.get("event") == "first_word":
+        FIRST_WORD_SECONDS.observe(event["data"]["seconds"])
+        return
+    if event.get("event") == "job_setup":
+        job = "first" if event["data"]["first"] else "later"
+        JOB_SETUP_SECONDS.labels(job=job).observe(event["data"]["seconds"])
+        return
+    if event.get("event") == "prewarm":
+        PREWARM_SECONDS.observe(event["data"]["seconds"])
+        return
+    if event.get("event") != "turn":
+        return
+    TURNS.inc()
+    for stage, value in event.get("data", {}).items():
+        if stage in STAGES:
+            TURN_SECONDS.labels(stage=stage).observe(value)
+        elif stage in TOKENS:
+            PROMPT_TOKENS.labels(kind="cached" if stage == "prompt_cached_tokens" else "total").observe(value)
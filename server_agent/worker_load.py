@@ -0,0 +1,302 @@
+"""Worker load from per-call CPU and audio loop lag, and admission of new jobs.
+
+Soak test the load function and admission with synthetic calls, each a job
+process pushing 20ms audio frames through the Silero VAD:
+
+    python worker_load.py soak --arrivals 2 --call-seconds 60 --seconds 600
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+import psutil
+from livekit.agents import JobContext, JobRequest
+
+logger = logging.getLogger("outbound-caller")
+
+MAX_CALLS_PER_WORKER = int(os.getenv("MAX_CALLS_PER_WORKER", "8"))
+# above this load the worker stops taking jobs and LiveKit routes them elsewhere
+LOAD_THRESHOLD = float(os.getenv("WORKER_LOAD_THRESHOLD", "0.8"))
+# event loop lag a call can have before its audio starts to suffer
+LAG_BUDGET = float(os.getenv("WORKER_LAG_BUDGET_MS", "40")) / 1000
+
+SAMPLE_INTERVAL = 0.1
+REPORT_INTERVAL = 1.0
+STALE_AFTER = 5.0
+
+# job processes write their lag/cpu under here, the worker process reads them in
+# compute_load(); one directory per worker, so workers on a host don't count
+# each other's calls
+LOAD_ROOT = os.getenv("WORKER_LOAD_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+# cores the calls of this worker share
+CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+# last computed values, used by admit() which doesn't get the worker
+_last = {"load": 0.0, "calls": 0, "cpu": 0.0, "lag": 0.0, "cpu_per_call": 0.0}
+# the worker's directory, removed when the worker exits
+_cleanup: str | None = None
+
+
+def load_dir(worker_id: str) -> str:
+    """Where the jobs of a worker report (ctx.worker_id on the job side, worker.id in the worker)"""
+    return os.path.join(LOAD_ROOT, f"outbound-caller-load-{worker_id}")
+
+
+async def _monitor(path: str):
+    """Measure how late the job's event loop wakes up, which is when audio frames get processed late"""
+    lag_peak = 0.0
+    cpu_started, wall_started = time.process_time(), time.monotonic()
+    last_report = wall_started
+    while True:
+        expected = time.monotonic() + SAMPLE_INTERVAL
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        now = time.monotonic()
+        lag_peak = max(lag_peak, now - expected)
+        if now - last_report < REPORT_INTERVAL:
+            continue
+
+        cpu = (time.process_time() - cpu_started) / (now - wall_started)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{lag_peak:.4f} {cpu:.4f}")
+        os.replace(tmp, path)
+        lag_peak = 0.0
+        cpu_started, wall_started = time.process_time(), now
+        last_report = now
+
+
+def start_monitor(ctx: JobContext):
+    """Report this call's loop lag and CPU to the worker's load function"""
+    directory = load_dir(ctx.worker_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}-{ctx.job.id}")
+    task = asyncio.create_task(_monitor(path))
+
+    async def stop():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    ctx.add_shutdown_callback(stop)
+
+
+def _read_reports(directory: str) -> list[tuple[float, float]]:
+    reports = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return reports
+    now = time.time()
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.endswith(".tmp"):
+            continue
+        try:
+            pid = int(name.split("-", 1)[0])
+        except ValueError:
+            continue
+        try:
+            # the job process died without cleaning up
+            if not psutil.pid_exists(pid) or now - os.path.getmtime(path) > STALE_AFTER:
+                os.remove(path)
+                continue
+            with open(path) as f:
+                lag, cpu = f.read().split()
+            reports.append((float(lag), float(cpu)))
+        except (OSError, ValueError):
+            continue
+    return reports
+
+
+def _remove_dir(directory: str):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def compute_load(worker) -> float:
+    """WorkerOptions.load_fnc: the most saturated of call slots, CPU and audio lag.
+
+    CPU is what this worker's calls use, not the host's, so other processes on
+    the host don't make the worker turn calls away.
+    """
+    global _cleanup
+    directory = load_dir(worker.id)
+    if _cleanup != directory:
+        _cleanup = directory
+        atexit.register(_remove_dir, directory)
+    calls = len(worker.active_jobs)
+    reports = _read_reports(directory)
+    lag = max((lag for lag, _ in reports), default=0.0)
+    cpu = sum(c for _, c in reports) / CORES
+    cpu_per_call = sum(c for _, c in reports) / len(reports) if reports else 0.0
+
+    load = min(
+        1.0,
+        max(
+            calls / MAX_CALLS_PER_WORKER,
+            cpu,
+            lag / LAG_BUDGET * LOAD_THRESHOLD,  # at the lag budget we're "full"
+        ),
+    )
+    _last.update(load=load, calls=calls, cpu=cpu, lag=lag, cpu_per_call=cpu_per_call)
+    return load
+
+
+def saturated() -> bool:
+    return _last["calls"] >= MAX_CALLS_PER_WORKER or _last["load"] >= LOAD_THRESHOLD
+
+
+async def admit(req: JobRequest):
+    """WorkerOptions.request_fnc: reject jobs when saturated so another worker gets them"""
+    if saturated():
+        logger.warning(
+            f"rejecting job {req.job.id}: {_last['calls']} calls, load {_last['load']:.2f}, "
+            f"cpu {_last['cpu']:.0%}, loop lag {_last['lag'] * 1000:.0f}ms, "
+            f"{_last['cpu_per_call']:.0%} cpu per call"
+        )
+        await req.reject()
+        return
+    # count the job right away, load is only recomputed periodically
+    _last["calls"] += 1
+    await req.accept()
+
+
+def get_stats() -> dict:
+    return dict(_last, max_calls=MAX_CALLS_PER_WORKER, threshold=LOAD_THRESHOLD)
+
+
+def _synthetic_call(directory: str, room: str, seconds: float, frame_cpu: float):
+    """A call's job process: synthetic speech and silence through the VAD, 20ms frames in real time.
+
+    `frame_cpu` of each frame is spent busy on top, for the rest of the call's
+    audio work (noise cancellation, STT/TTS encoding).
+    """
+    import numpy as np
+    from livekit import rtc
+    from livekit.plugins import silero
+
+    sample_rate, samples = 16000, 320
+
+    async def run():
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}-{room}")
+        monitor = asyncio.create_task(_monitor(path))
+        stream = silero.VAD.load().stream()
+        events = asyncio.create_task(_drain(stream))
+        t = np.arange(samples) / sample_rate
+        started = time.monotonic()
+        frame = 0
+        while time.monotonic() - started < seconds:
+            # 1.5s of voice-like tones, 1s of quiet
+            speaking = (frame * 0.02) % 2.5 < 1.5
+            tone = np.sin(2 * np.pi * (180 + 40 * np.sin(frame / 5)) * (t + frame * 0.02))
+            audio = tone * 8000 if speaking else np.random.randn(samples) * 30
+            stream.push_frame(rtc.AudioFrame(audio.astype(np.int16).tobytes(), sample_rate, 1, samples))
+            busy_until = time.perf_counter() + 0.02 * frame_cpu
+            while time.perf_counter() < busy_until:
+                pass
+            frame += 1
+            await asyncio.sleep(max(0.0, started + frame * 0.02 - time.monotonic()))
+        stream.end_input()
+        await events
+        monitor.cancel()
+        await asyncio.gather(monitor, return_exceptions=True)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    asyncio.run(run())
+
+
+async def _drain(stream):
+    async for _ in stream:
+        pass
+
+
+def soak(arrivals: float, call_seconds: float, seconds: float, frame_cpu: float) -> dict:
+    """Offer a new call every 1/arrivals seconds to a worker using compute_load() and
+    saturated(), each accepted call running as its own process; returns the timeline"""
+    # calls are forked from a process that has the plugins loaded, like LiveKit's job processes
+    from livekit.plugins import silero  # noqa: F401
+
+    context = multiprocessing.get_context("fork")
+    calls: list = []
+    worker = SimpleNamespace(id=f"soak-{os.getpid()}", active_jobs=calls)
+    timeline = []
+    offered = accepted = 0
+    lags: list[float] = []
+    started = time.monotonic()
+    next_arrival = started
+    try:
+        while time.monotonic() - started < seconds:
+            calls[:] = [call for call in calls if call.is_alive()]
+            compute_load(worker)
+            lags.append(_last["lag"])
+            now = time.monotonic()
+            while next_arrival <= now:
+                offered += 1
+                next_arrival += 1 / arrivals
+                if saturated():
+                    continue
+                call = context.Process(
+                    target=_synthetic_call,
+                    args=(load_dir(worker.id), f"soak-{offered}", call_seconds, frame_cpu),
+                    daemon=True,
+                )
+                call.start()
+                calls.append(call)
+                accepted += 1
+                # like admit(), count it before the next load computation
+                _last["calls"] += 1
+            timeline.append({"t": round(now - started, 1), **{k: round(v, 3) for k, v in _last.items()}})
+            time.sleep(REPORT_INTERVAL)
+    finally:
+        for call in calls:
+            call.terminate()
+        _remove_dir(load_dir(worker.id))
+
+    lags.sort()
+    return {
+        "offered": offered,
+        "accepted": accepted,
+        "rejected": offered - accepted,
+        "max_calls": MAX_CALLS_PER_WORKER,
+        "peak_calls": max(sample["calls"] for sample in timeline),
+        "peak_load": max(sample["load"] for sample in timeline),
+        "lag_ms_p50": round(lags[len(lags) // 2] * 1000, 1),
+        "lag_ms_p95": round(lags[min(len(lags) - 1, int(0.95 * len(lags)))] * 1000, 1),
+        "lag_ms_max": round(lags[-1] * 1000, 1),
+        "lag_budget_ms": LAG_BUDGET * 1000,
+        "cpu_per_call": round(max(sample["cpu_per_call"] for sample in timeline), 3),
+        "timeline": timeline,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    soak_parser = commands.add_parser("soak", help="synthetic calls against the load function and admission")
+    soak_parser.add_argument("--arrivals", type=float, default=1.0, help="calls offered per second")
+    soak_parser.add_argument("--call-seconds", type=float, default=60)
+    soak_parser.add_argument("--seconds", type=float, default=300)
+    soak_parser.add_argument("--frame-cpu", type=float, default=0.1, help="extra share of each frame spent busy")
+    soak_parser.add_argument("--out", help="also write the report to this JSON file")
+    args = parser.parse_args()
+    report = soak(args.arrivals, args.call_seconds, args.seconds, args.frame_cpu)
+    print(json.dumps({k: v for k, v in report.items() if k != "timeline"}, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from livekit.agents import JobProcess
+from livekit.plugins import silero
+
+import event_bus
+import recorder
+import scheduling
+
+logger = logging.getLogger("outbound-caller")
+
+# set TURN_DETECTOR=english to use the EnglishModel turn detector instead of
+# AssemblyAI's STT-based end of turn
+TURN_DETECTOR = os.getenv("TURN_DETECTOR", "stt")
+
+
+@dataclass
+class SetupStats:
+    """Per-process job setup timings, split by first and later jobs"""
+
+    prewarm_seconds: float | None = None
+    jobs: int = 0
+    first_job_seconds: float | None = None
+    later_jobs: int = 0
+    later_jobs_total_seconds: float = 0.0
+    later_jobs_max_seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "prewarm_seconds": self.prewarm_seconds,
+            "jobs": self.jobs,
+            "first_job_seconds": self.first_job_seconds,
+            "later_jobs_avg_seconds": (
+                self.later_jobs_total_seconds / self.later_jobs if self.later_jobs else None
+            ),
+            "later_jobs_max_seconds": self.later_jobs_max_seconds,
+        }
+
+
+setup_stats = SetupStats()
+
+
+def prewarm(proc: JobProcess):
+    """Load the VAD (and optionally the turn detector) once per worker process"""
+    # job processes can't reach the dashboards directly, send logs over the bus
+    event_bus.start_publisher()
+    started = time.perf_counter()
+    proc.userdata["vad"] = silero.VAD.load()
+    if TURN_DETECTOR == "english":
+        from livekit.plugins.turn_detector.english import EnglishModel
+
+        proc.userdata["turn_detection"] = EnglishModel()
+    # free appointment slots, so look_up_availability never waits on the database
+    scheduling.get_index()
+    if recorder.RECORD_CALLS:
+        # start the encoder process now rather than when the first call is answered
+        recorder.prewarm()
+    setup_stats.prewarm_seconds = time.perf_counter() - started
+    logger.info(
+        f"worker process prewarmed in {setup_stats.prewarm_seconds * 1000:.0f}ms",
+        extra={"event": "prewarm", "data": {"seconds": setup_stats.prewarm_seconds}},
+    )
+
+
+def session_models(proc: JobProcess) -> dict:
+    """AgentSession kwargs for the process-wide models, loading them if prewarm didn't run"""
+    if "vad" not in proc.userdata:
+        prewarm(proc)
+    return {
+        "vad": proc.userdata["vad"],
+        "turn_detection": proc.userdata.get("turn_detection", "stt"),
+    }
+
+
+def record_job_setup(seconds: float):
+    setup_stats.jobs += 1
+    if setup_stats.jobs == 1:
+        setup_stats.first_job_seconds = seconds
+    else:
+        setup_stats.later_jobs += 1
+        setup_stats.later_jobs_total_seconds += seconds
+        setup_stats.later_jobs_max_seconds = max(setup_stats.later_jobs_max_seconds, seconds)
+    # exported on the API's /metrics, see turn_metrics.observe
+    logger.info(
+        f"job setup took {seconds * 1000:.0f}ms",
+        extra={
+            "event": "job_setup",
+            "data": {"seconds": seconds, "first": setup_stats.jobs == 1, **setup_stats.to_dict()},
+        },
+    )